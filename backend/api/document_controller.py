@@ -1,15 +1,56 @@
+import asyncio
+import contextvars
+import json
+import time
+import uuid
 from pathlib import Path
-from fastapi import APIRouter, UploadFile, File, status
-from schemas.chat_schemas import ChatRequest, ChatResponse
+from typing import Any, AsyncIterator, Awaitable, Dict, List, Optional
+from fastapi import (
+    APIRouter,
+    File,
+    Header,
+    HTTPException,
+    Request,
+    UploadFile,
+    status,
+)
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from schemas.chat_schemas import (
+    BatchChatRequest,
+    BatchChatResponse,
+    BatchChatResult,
+    ChatRequest,
+    ChatResponse,
+    SearchRequest,
+    SearchResponse,
+)
+from schemas.quota_schemas import QuotaResponse
+from schemas.reindex_schemas import ReindexResponse, ReindexStatus
+from schemas.task_schemas import TaskStatus
+from services.admission_control import AdmissionRejected, admission, current_admission
+from services.cancellation import CancellationToken, RequestCancelled, cancellable
+from services.ingestion_routing import IngestionRouter
+from services.quota_limiter import get_quota_limiter
 from services.rag_service import RAGService
+from services.reindex_service import ReindexConflict, ReindexService
+from services.request_coalescer import RequestCoalescer, coalescing_key
+from services.task_events import TaskStatusService, TaskStatusUnavailable
+from settings import settings
 from utils import validate_document_type, get_supported_extensions
 
 # from ..celery_worker import process_document_task
 from schemas.upload_schemas import UploadResponse
-from celery_worker import process_document_task
+from celery_worker import process_document_task, reindex_collection_task
 
 router = APIRouter()
 rag_service = RAGService()
+chat_coalescer = RequestCoalescer(
+    "chat",
+    settings.REDIS_URL if settings.CHAT_COALESCING_ACROSS_REPLICAS else None,
+)
+task_status_service = TaskStatusService()
+ingestion_router = IngestionRouter()
 # Use the mounted data directory for uploads
 UPLOAD_DIR = Path("/data")
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
@@ -18,39 +59,368 @@ UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 @router.post(
     "/upload", status_code=status.HTTP_202_ACCEPTED, response_model=UploadResponse
 )
-async def upload_document(file: UploadFile = File(...)):
+async def upload_document(
+    request: Request,
+    file: UploadFile = File(...),
+    x_user_id: Optional[str] = Header(None),
+):
     """
     An endpoint to upload a document.
 
+    The document is queued in the fast or heavy ingestion lane depending on
+    its estimated processing time, behind fewer of the user's own uploads.
+
     Args:
+        request: The HTTP request, whose client identifies the user without
+            an X-User-Id header.
         file: The file to upload.
+        x_user_id: The user uploading the file, for fairness between users.
 
     Returns:
-        A response with the task ID and the filename.
+        A response with the task ID, the filename and the lane. The task's
+        progress is served at /tasks/{task_id}.
     """
     await validate_document_type(file.filename)
     # Create a safe file path using the uploads directory
     file_path = UPLOAD_DIR / file.filename
 
     # Write the uploaded file to disk
+    content = await file.read()
     with open(file_path, "wb") as buffer:
-        buffer.write(await file.read())
+        buffer.write(content)
+
+    user = x_user_id or (request.client.host if request.client else "anonymous")
+    route = await run_in_threadpool(
+        ingestion_router.route, file.filename, content, user
+    )
+
+    # Start the background task to process the document, known as queued
+    # before a worker can report on it
+    task_id = str(uuid.uuid4())
+    await task_status_service.queued(
+        task_id, lane=route["lane"], estimated_cost_s=route["estimated_cost_s"]
+    )
+    process_document_task.apply_async(
+        (str(file_path), route["lane"], user, time.time()),
+        task_id=task_id,
+        queue=route["queue"],
+        priority=route["priority"],
+    )
+    return {"task_id": task_id, "filename": file.filename, "lane": route["lane"]}
+
+
+@router.get("/tasks/{task_id}", response_model=TaskStatus)
+async def task_status(task_id: str):
+    """
+    An endpoint to read the status of a document processing task.
+
+    Args:
+        task_id: The ID returned by the upload.
+
+    Returns:
+        The task's state and stage, with the chunks processed, the throughput
+        and the estimated time remaining while it embeds.
+    """
+    return await _task_status(task_id)
+
+
+@router.get("/tasks/{task_id}/events")
+async def task_events(task_id: str, last_event_id: Optional[str] = Header(None)):
+    """
+    An endpoint to follow a document processing task as Server-Sent Events.
 
-    # Start the background task to process the document
-    task = process_document_task.delay(str(file_path))
-    return {"task_id": task.id, "filename": file.filename}
+    The current status is sent first, then each change until the task
+    succeeds or fails. A reconnecting client sending Last-Event-ID only gets
+    the changes it missed.
+
+    Args:
+        task_id: The ID returned by the upload.
+        last_event_id: The ID of the last event received, when resuming.
+
+    Returns:
+        A text/event-stream of task statuses.
+    """
+    await _task_status(task_id)
+    after = int(last_event_id) if last_event_id and last_event_id.isdigit() else 0
+    return StreamingResponse(
+        _server_sent_events(task_status_service.events(task_id, after)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _task_status(task_id: str) -> Dict[str, Any]:
+    """
+    Reads the status of a task, as the task endpoints answer it.
+
+    Args:
+        task_id: The ID returned by the upload.
+
+    Returns:
+        The last event of the task.
+
+    Raises:
+        HTTPException: 404 if the task is unknown or expired, 503 if its
+            status cannot be read.
+    """
+    try:
+        task = await task_status_service.status(task_id)
+    except TaskStatusUnavailable as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": "5"},
+        )
+    if task is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Unknown or expired task"
+        )
+    return task
+
+
+async def _server_sent_events(
+    events: AsyncIterator[Optional[Dict[str, Any]]],
+) -> AsyncIterator[str]:
+    """
+    Formats task statuses as Server-Sent Events.
+
+    Args:
+        events: The statuses, None when a keep-alive is due.
+
+    Yields:
+        The events, numbered by the status sequence.
+    """
+    async for event in events:
+        if event is None:
+            yield ": keep-alive\n\n"
+        else:
+            yield f"id: {event['seq']}\ndata: {json.dumps(event)}\n\n"
 
 
 @router.post("/chat", response_model=ChatResponse)
-async def chat_with_document(request: ChatRequest):
+async def chat_with_document(request: ChatRequest, http_request: Request):
     """
     An endpoint to chat with the document.
 
+    Concurrent requests for the same question share one pipeline execution.
+    The pipeline stops once every client waiting for it disconnected, or
+    when the request deadline passes.
+
     Args:
         request: The chat request with the user's question.
+        http_request: The HTTP request, watched for a client disconnect.
+
+    Returns:
+        A response with the generated answer and how its context was built.
+    """
+    timeout_s = (
+        request.deadline_ms / 1000 if request.deadline_ms else settings.CHAT_DEADLINE_S
+    )
+    with admission("interactive", timeout_s):
+        _, deadline = current_admission()
+        if not settings.CHAT_COALESCING:
+            answer = _answer(request.question, CancellationToken(deadline))
+        else:
+            answer = chat_coalescer.run(
+                coalescing_key(request.question),
+                lambda token: _answer(request.question, token),
+                deadline,
+            )
+        return await _unless_disconnected(http_request, answer)
+
+
+async def _unless_disconnected(http_request: Request, answer: Awaitable[Any]) -> Any:
+    """
+    Awaits an answer, cancelling it if the client disconnects first.
+
+    Args:
+        http_request: The HTTP request of the client.
+        answer: Produces the response.
+
+    Returns:
+        The response.
+
+    Raises:
+        RequestCancelled: If the client disconnected.
+    """
+    task = asyncio.ensure_future(answer)
+    try:
+        while True:
+            done, _ = await asyncio.wait(
+                {task}, timeout=settings.DISCONNECT_POLL_INTERVAL_S
+            )
+            if done:
+                return task.result()
+            if await http_request.is_disconnected():
+                raise RequestCancelled("disconnect", "client")
+    finally:
+        task.cancel()
+
+
+async def _answer(question: str, token: CancellationToken) -> dict:
+    """
+    Runs the RAG pipeline for a question.
+
+    Cancelling the coroutine stops the pipeline at its next check, as the
+    thread running it cannot be interrupted.
+
+    Args:
+        question: The user's question.
+        token: Stops the pipeline, and carries its deadline.
+
+    Returns:
+        The chat response as JSON-compatible data, so it can be shared
+        through Redis.
+
+    Raises:
+        RequestCancelled: If the deadline passes first.
+    """
+    with cancellable(token):
+        pipeline = asyncio.get_running_loop().run_in_executor(
+            None, contextvars.copy_context().run, rag_service.run, question
+        )
+    try:
+        result = await pipeline
+    except asyncio.CancelledError:
+        token.cancel("disconnect")
+        raise
+    response = ChatResponse(
+        response=result["response"], context=result["context_report"]
+    )
+    return response.model_dump(mode="json")
+
+
+@router.post("/chat/batch", response_model=BatchChatResponse)
+async def batch_chat(request: BatchChatRequest):
+    """
+    An endpoint to answer many questions in one request.
+
+    Questions are processed in chunks of `BATCH_CHAT_CHUNK_SIZE`, each stage
+    running once per chunk, and each chunk having `BATCH_CHAT_DEADLINE_S` to
+    complete. With `stream` set, each answer is sent as an
+    NDJSON line as soon as its chunk completes, and a chunk that is shed or
+    runs out of time gets an error line per question instead of ending the
+    stream.
+
+    Args:
+        request: The batch chat request with the questions.
+
+    Returns:
+        A response with one answer per question, in order.
+    """
+    chunk_size = settings.BATCH_CHAT_CHUNK_SIZE
+    starts = range(0, len(request.questions), chunk_size)
+
+    async def answer_chunk(start: int) -> List[BatchChatResult]:
+        chunk = request.questions[start : start + chunk_size]
+        # Each chunk gets the full deadline
+        with admission("batch", settings.BATCH_CHAT_DEADLINE_S):
+            results = await run_in_threadpool(rag_service.batch, chunk)
+        return [
+            BatchChatResult(index=start + i, **result)
+            for i, result in enumerate(results)
+        ]
+
+    if request.stream:
+
+        async def stream_results():
+            for start in starts:
+                try:
+                    results = await answer_chunk(start)
+                except (AdmissionRejected, RequestCancelled) as e:
+                    # The status line is already sent, so the failure is
+                    # reported on the chunk's questions
+                    results = [
+                        BatchChatResult(index=start + i, question=q, error=str(e))
+                        for i, q in enumerate(
+                            request.questions[start : start + chunk_size]
+                        )
+                    ]
+                for result in results:
+                    yield f"{result.model_dump_json()}\n"
+
+        return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+    results: List[BatchChatResult] = []
+    for start in starts:
+        results.extend(await answer_chunk(start))
+    return {"results": results}
+
+
+@router.post("/search", response_model=SearchResponse)
+async def search_documents(request: SearchRequest):
+    """
+    An endpoint to find the passages relevant to a query without generating
+    an answer.
+
+    Args:
+        request: The search request with the query and options.
+
+    Returns:
+        A response with the ranked passages, their scores and highlights.
+    """
+    timeout_s = (
+        request.latency_budget_ms / 1000
+        if request.latency_budget_ms
+        else settings.CHAT_DEADLINE_S
+    )
+    with admission("interactive", timeout_s):
+        return await run_in_threadpool(
+            rag_service.search, request.query, request.top_k, request.latency_budget_ms
+        )
+
+
+@router.get("/quota", response_model=QuotaResponse)
+async def quota_state():
+    """
+    An endpoint to inspect the cluster-wide Gemini quotas.
+
+    Returns:
+        The available requests and tokens of each quota, and the waits and
+        rejections seen by this replica.
+    """
+    return {
+        "quotas": [
+            await run_in_threadpool(get_quota_limiter(name).state)
+            for name in ("llm", "embedding")
+        ]
+    }
+
+
+@router.post(
+    "/reindex", status_code=status.HTTP_202_ACCEPTED, response_model=ReindexResponse
+)
+async def start_reindex():
+    """
+    An endpoint to re-embed the documents with the configured embedding
+    settings, into a new collection that replaces the current one when done.
+
+    An interrupted or failed re-index is resumed instead of restarted.
+
+    Returns:
+        A response with the task ID and the migration state.
+    """
+    reindex_service = ReindexService(rag_service.vector_store_repository)
+    try:
+        migration = await run_in_threadpool(reindex_service.start)
+    except ReindexConflict as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    task = reindex_collection_task.delay()
+    return {"task_id": task.id, "migration": migration}
+
+
+@router.get("/reindex", response_model=ReindexStatus)
+async def reindex_status():
+    """
+    An endpoint to follow the progress of the current or last re-index.
 
     Returns:
-        A response with the generated answer.
+        The migration state, with the throughput and estimated time remaining.
     """
-    response = rag_service.invoke(request.question)
-    return {"response": response}
+    reindex_service = ReindexService(rag_service.vector_store_repository)
+    migration = await run_in_threadpool(reindex_service.status)
+    if migration is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="No re-index was started"
+        )
+    return migration
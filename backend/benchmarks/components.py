@@ -0,0 +1,582 @@
+"""
+Micro-benchmarks for the hot paths of the API and the worker.
+
+Gemini, the cross-encoder and Chroma are replaced by deterministic local
+stand-ins, so the suite runs offline and measures this code base rather than
+the network: reranking at several candidate counts, embedding batching,
+vector store payload serialization, metadata sanitization and, when the
+docling models are available locally, conversion and chunking of the PDFs in
+`data/`.
+
+Results are written as JSON keyed by benchmark name and compared against a
+stored baseline. Baseline numbers only mean something on the machine that
+produced them, so refresh `benchmarks/baseline.json` with `--update-baseline`
+on the reference machine when the code gets faster on purpose.
+
+Usage:
+    python -m benchmarks.components --output results.json
+    python -m benchmarks.components --only rerank,sanitize --fail-on-regression
+    python -m benchmarks.components --update-baseline
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import zlib
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+from unittest import mock
+import numpy as np
+
+BASELINE_PATH = Path(__file__).with_name("baseline.json")
+DATA_DIR = Path(__file__).resolve().parents[2] / "data"
+# A benchmark regresses when its median is this much slower than the baseline
+DEFAULT_TOLERANCE = 0.25
+FULL_DIMENSIONALITY = 768
+
+VOCABULARY = (
+    "policy employee leave remote work contract salary benefit holiday office "
+    "manager report quarter budget security access password device travel "
+    "expense approval training onboarding review performance team project "
+    "deadline customer support incident process document section table"
+).split()
+
+
+def synthetic_texts(
+    n_texts: int, words_per_text: int = 120, seed: int = 0
+) -> List[str]:
+    """
+    Generates reproducible chunk-sized texts.
+
+    Args:
+        n_texts: The number of texts.
+        words_per_text: The number of words in each text.
+        seed: The random seed.
+
+    Returns:
+        The texts.
+    """
+    rng = np.random.default_rng(seed)
+    words = rng.choice(VOCABULARY, size=(n_texts, words_per_text))
+    return [" ".join(row) for row in words]
+
+
+def stub_embedding(text: str, dimensionality: int = FULL_DIMENSIONALITY) -> List[float]:
+    """
+    Embeds a text deterministically, seeded by its checksum.
+
+    Args:
+        text: The text to embed.
+        dimensionality: The vector size.
+
+    Returns:
+        A unit-length vector.
+    """
+    rng = np.random.default_rng(zlib.crc32(text.encode()))
+    vector = rng.normal(size=dimensionality)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+class StubGemini:
+    """
+    Stands in for `genai.embed_content`, with an optional per-call latency.
+    """
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self.calls = 0
+
+    def embed_content(self, model, content, task_type=None, output_dimensionality=None):
+        self.calls += 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        size = output_dimensionality or FULL_DIMENSIONALITY
+        if isinstance(content, str):
+            return {"embedding": stub_embedding(content, size)}
+        return {"embedding": [stub_embedding(text, size) for text in content]}
+
+
+class StubCrossEncoder:
+    """
+    Stands in for the sentence-transformers `CrossEncoder`, scoring pairs by
+    word overlap.
+    """
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def predict(self, pairs: List[List[str]]) -> np.ndarray:
+        scores = []
+        for query, document in pairs:
+            query_words = set(query.lower().split())
+            scores.append(len(query_words & set(document.lower().split())))
+        return np.asarray(scores, dtype=np.float32)
+
+
+class StubCollection:
+    """
+    Stands in for a Chroma HTTP collection.
+
+    Requests and responses go through JSON as they would over HTTP, and the
+    search is an exact squared-L2 scan over the stored vectors.
+    """
+
+    def __init__(self, name: str, metadata: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.metadata = metadata
+        self.ids: List[str] = []
+        self.documents: List[str] = []
+        self.metadatas: List[Dict[str, Any]] = []
+        self.vectors = np.empty((0, 0), dtype=np.float32)
+        self.payload_bytes = 0
+
+    def _send(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        body = json.dumps(payload)
+        self.payload_bytes += len(body)
+        return json.loads(body)
+
+    def add(self, ids, documents, metadatas, embeddings):
+        payload = self._send(
+            {
+                "ids": ids,
+                "documents": documents,
+                "metadatas": metadatas,
+                "embeddings": np.asarray(embeddings, dtype=np.float32).tolist(),
+            }
+        )
+        vectors = np.asarray(payload["embeddings"], dtype=np.float32)
+        # Extend the lists before the vectors so concurrent queries never see
+        # a vector without its id
+        self.ids.extend(payload["ids"])
+        self.documents.extend(payload["documents"])
+        self.metadatas.extend(payload["metadatas"])
+        self.vectors = (
+            vectors if not len(self.vectors) else np.vstack([self.vectors, vectors])
+        )
+
+    def upsert(self, ids, documents, metadatas, embeddings):
+        # The benchmarks only ever write new ids
+        self.add(ids, documents, metadatas, embeddings)
+
+    def query(self, query_embeddings, n_results, include):
+        request = self._send(
+            {
+                "query_embeddings": np.asarray(query_embeddings).tolist(),
+                "n_results": n_results,
+                "include": include,
+            }
+        )
+        queries = np.asarray(request["query_embeddings"], dtype=np.float32)
+        distances = (
+            (queries**2).sum(axis=1)[:, None]
+            - 2 * queries @ self.vectors.T
+            + (self.vectors**2).sum(axis=1)[None, :]
+        )
+        top = np.argsort(distances, axis=1)[:, :n_results]
+        response = {"ids": [[self.ids[j] for j in row] for row in top]}
+        if "documents" in include:
+            response["documents"] = [[self.documents[j] for j in row] for row in top]
+        if "metadatas" in include:
+            response["metadatas"] = [[self.metadatas[j] for j in row] for row in top]
+        if "distances" in include:
+            response["distances"] = [
+                distances[i, row].tolist() for i, row in enumerate(top)
+            ]
+        if "embeddings" in include:
+            response["embeddings"] = [self.vectors[row].tolist() for row in top]
+        return self._send(response)
+
+
+class StubChromaClient:
+    """
+    Stands in for `chromadb.HttpClient`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.collections: Dict[str, StubCollection] = {}
+
+    def get_or_create_collection(self, name, metadata=None):
+        if name not in self.collections:
+            self.collections[name] = StubCollection(name, metadata)
+        return self.collections[name]
+
+    def heartbeat(self):
+        return 0
+
+
+def measure(func: Callable[[], Any], repeat: int, warmup: int = 1) -> Dict[str, Any]:
+    """
+    Times a function over several runs.
+
+    Args:
+        func: The function to time.
+        repeat: The number of timed runs.
+        warmup: The number of untimed runs first.
+
+    Returns:
+        The median, 95th percentile and fastest run in milliseconds.
+    """
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        "median_ms": float(np.median(samples)),
+        "p95_ms": float(np.percentile(samples, 95)),
+        "min_ms": float(min(samples)),
+        "repeat": repeat,
+    }
+
+
+def bench_rerank(repeat: int) -> Dict[str, Dict[str, Any]]:
+    """
+    Benchmarks `RerankingService.rerank_documents` at several candidate counts.
+    """
+    with mock.patch("services.reranking_service.CrossEncoder", StubCrossEncoder):
+        from services.reranking_service import RerankingService
+
+        service = RerankingService()
+
+    query = "how many remote work days does the leave policy allow"
+    results = {}
+    for n_candidates in (5, 20, 50, 100):
+        texts = synthetic_texts(n_candidates, seed=n_candidates)
+        retrieved_docs = {
+            "ids": [[f"doc_chunk_{i}" for i in range(n_candidates)]],
+            "documents": [texts],
+            "metadatas": [
+                [{"source": "doc.pdf", "chunk_index": i} for i in range(n_candidates)]
+            ],
+        }
+        results[f"rerank/candidates={n_candidates}"] = measure(
+            lambda: service.rerank_documents(query, retrieved_docs), repeat
+        )
+    return results
+
+
+def bench_embeddings(repeat: int, latency_ms: float) -> Dict[str, Dict[str, Any]]:
+    """
+    Benchmarks the batching in `EmbeddingService.generate_embeddings`.
+
+    The one-second pause between Gemini batches is recorded instead of slept,
+    so the timings show the client-side overhead and `throttle_s` shows the
+    pause a real run would add.
+    """
+    gemini = StubGemini(latency_ms)
+    throttle = []
+    results = {}
+    with ExitStack() as stack:
+        stack.enter_context(
+            mock.patch(
+                "services.embedding_backends.genai.embed_content", gemini.embed_content
+            )
+        )
+        stack.enter_context(
+            mock.patch("services.embedding_backends.time.sleep", throttle.append)
+        )
+        from services.embedding_service import EmbeddingService
+
+        service = EmbeddingService("models/text-embedding-004")
+        for n_texts in (10, 100, 500):
+            texts = synthetic_texts(n_texts, seed=n_texts)
+            gemini.calls = 0
+            throttle.clear()
+            service.generate_embeddings(texts)
+            calls, throttle_s = gemini.calls, sum(throttle)
+            results[f"embeddings/texts={n_texts}"] = {
+                **measure(lambda: service.generate_embeddings(texts), repeat),
+                "api_calls": calls,
+                "throttle_s": throttle_s,
+            }
+    return results
+
+
+def bench_vector_store(repeat: int) -> Dict[str, Dict[str, Any]]:
+    """
+    Benchmarks `VectorStoreRepository.add_documents` and `query` through a
+    JSON round trip.
+    """
+    with mock.patch(
+        "repositories.vector_store_repository.chromadb.HttpClient", StubChromaClient
+    ):
+        from repositories.vector_store_repository import (
+            DEFAULT_COLLECTION,
+            VectorStoreRepository,
+        )
+
+        # Pinned, so the benchmark never looks up the active collection
+        repository = VectorStoreRepository(DEFAULT_COLLECTION)
+    collection = repository.collection
+
+    results = {}
+    for n_chunks in (100, 1000):
+        texts = synthetic_texts(n_chunks, seed=n_chunks)
+        embeddings = [stub_embedding(text) for text in texts]
+        metadatas = [
+            {"document_id": "doc", "chunk_index": i, "source": "/data/doc.pdf"}
+            for i in range(n_chunks)
+        ]
+        ids = [f"doc_chunk_{i}" for i in range(n_chunks)]
+
+        def add():
+            # Start from an empty collection so every run stores the same data
+            collection.__init__(collection.name, collection.metadata)
+            repository.add_documents(ids, texts, metadatas, embeddings)
+
+        add()
+        payload_bytes = collection.payload_bytes
+        results[f"vector_store/add/chunks={n_chunks}"] = {
+            **measure(add, repeat),
+            "payload_bytes": payload_bytes,
+        }
+
+    # Query the 1000 chunks left by the last add
+    query_embedding = [stub_embedding("remote work leave policy")]
+    for n_results in (5, 20):
+        results[f"vector_store/query/n_results={n_results}"] = measure(
+            lambda: repository.query(query_embedding, n_results), repeat
+        )
+    return results
+
+
+def bench_sanitize_metadata(repeat: int) -> Dict[str, Dict[str, Any]]:
+    """
+    Benchmarks `sanitize_metadata` on flat and docling-style nested metadata.
+    """
+    from celery_worker import sanitize_metadata
+
+    flat = {
+        "document_id": "doc",
+        "chunk_index": 3,
+        "source": "/data/doc.pdf",
+        "file_type": ".pdf",
+        "text_length": 812,
+    }
+    nested = {
+        **flat,
+        "headings": ["Leave policy", "Remote work"],
+        "origin": {
+            "filename": "doc.pdf",
+            "mimetype": "application/pdf",
+            "binary_hash": 1234567890,
+            "pages": {"first": 1, "last": 2, "sizes": [612, 792]},
+        },
+        "doc_items": [{"self_ref": "#/texts/1", "label": "text"}] * 5,
+        "converter": object(),
+    }
+    results = {}
+    for name, metadata in (("flat", flat), ("nested", nested)):
+        batch = [dict(metadata, chunk_index=i) for i in range(1000)]
+        results[f"sanitize_metadata/{name}/chunks=1000"] = measure(
+            lambda: [sanitize_metadata(m) for m in batch], repeat
+        )
+    return results
+
+
+def bench_documents(repeat: int, data_dir: Path) -> Dict[str, Dict[str, Any]]:
+    """
+    Benchmarks `DocumentService.load_and_chunk_documents` on the sample PDFs.
+
+    Docling runs for real here. Without its models in the local cache the
+    benchmark is skipped and reported as such.
+    """
+    pdfs = sorted(data_dir.glob("*.pdf"))
+    if not pdfs:
+        return {"documents": {"skipped": f"no PDFs in {data_dir}"}}
+    try:
+        from services.document_service import DocumentService
+
+        service = DocumentService()
+    except Exception as e:
+        return {"documents": {"skipped": f"docling unavailable: {e}"}}
+
+    results = {}
+    for pdf in pdfs:
+        name = f"documents/{pdf.stem}"
+        chunks = service.load_and_chunk_documents([str(pdf)])
+        if not chunks:
+            results[name] = {"skipped": "no chunks produced, see the logs"}
+            continue
+        results[name] = {
+            **measure(
+                lambda: service.load_and_chunk_documents([str(pdf)]), repeat, warmup=0
+            ),
+            "chunks": len(chunks),
+        }
+    return results
+
+
+def run(
+    only: Optional[List[str]] = None,
+    repeat: int = 20,
+    document_repeat: int = 1,
+    gemini_latency_ms: float = 0.0,
+    data_dir: Path = DATA_DIR,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Runs the selected benchmark groups.
+
+    Args:
+        only: The groups to run, all of them by default.
+        repeat: The timed runs per benchmark.
+        document_repeat: The timed runs per PDF, which are much slower.
+        gemini_latency_ms: The simulated latency of each Gemini call.
+        data_dir: The directory holding the sample PDFs.
+
+    Returns:
+        The measurements, keyed by benchmark name.
+    """
+    groups = {
+        "rerank": lambda: bench_rerank(repeat),
+        "embeddings": lambda: bench_embeddings(repeat, gemini_latency_ms),
+        "vector_store": lambda: bench_vector_store(repeat),
+        "sanitize": lambda: bench_sanitize_metadata(repeat),
+        "documents": lambda: bench_documents(document_repeat, data_dir),
+    }
+    results = {}
+    for group, bench in groups.items():
+        if only is None or group in only:
+            results.update(bench())
+    return results
+
+
+def compare(
+    results: Dict[str, Dict[str, Any]],
+    baseline: Dict[str, Dict[str, Any]],
+    tolerance: float = DEFAULT_TOLERANCE,
+) -> List[Dict[str, Any]]:
+    """
+    Compares median timings against a baseline.
+
+    Args:
+        results: The current measurements.
+        baseline: The baseline measurements.
+        tolerance: The relative slowdown tolerated before a regression.
+
+    Returns:
+        One row per benchmark with its status: "ok", "regression",
+        "improvement", "new" (no baseline) or "skipped".
+    """
+    rows = []
+    for name, result in results.items():
+        row = {"name": name, "current_ms": result.get("median_ms")}
+        reference = baseline.get(name, {})
+        row["baseline_ms"] = reference.get("median_ms")
+        if row["current_ms"] is None:
+            row["status"] = "skipped"
+        elif row["baseline_ms"] is None:
+            row["status"] = "new"
+        else:
+            row["ratio"] = row["current_ms"] / row["baseline_ms"]
+            if row["ratio"] > 1 + tolerance:
+                row["status"] = "regression"
+            elif row["ratio"] < 1 / (1 + tolerance):
+                row["status"] = "improvement"
+            else:
+                row["status"] = "ok"
+        rows.append(row)
+    return rows
+
+
+def print_comparison(rows: List[Dict[str, Any]]):
+    """
+    Prints the comparison as an aligned table.
+
+    Args:
+        rows: The rows returned by `compare`.
+    """
+    header = (
+        f"{'benchmark':<45} {'median ms':>10} {'baseline':>10} {'ratio':>6}  status"
+    )
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        current = f"{row['current_ms']:.3f}" if row["current_ms"] is not None else "-"
+        reference = (
+            f"{row['baseline_ms']:.3f}" if row["baseline_ms"] is not None else "-"
+        )
+        ratio = f"{row['ratio']:.2f}" if "ratio" in row else "-"
+        print(
+            f"{row['name']:<45} {current:>10} {reference:>10} {ratio:>6}  {row['status']}"
+        )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--only",
+        help="Comma-separated groups: rerank, embeddings, vector_store, sanitize, documents",
+    )
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--document-repeat", type=int, default=1)
+    parser.add_argument(
+        "--gemini-latency-ms",
+        type=float,
+        default=0.0,
+        help="Simulated latency per Gemini call",
+    )
+    parser.add_argument("--data-dir", type=Path, default=DATA_DIR)
+    parser.add_argument("--output", help="Write the results as JSON to this path")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="Store the results as the new baseline",
+    )
+    parser.add_argument(
+        "--fail-on-regression",
+        action="store_true",
+        help="Exit with 1 on any regression",
+    )
+    args = parser.parse_args(argv)
+
+    # The settings require an API key, which the stand-ins never use
+    os.environ.setdefault("GOOGLE_AI_API_KEY", "benchmark")
+    results = run(
+        only=args.only.split(",") if args.only else None,
+        repeat=args.repeat,
+        document_repeat=args.document_repeat,
+        gemini_latency_ms=args.gemini_latency_ms,
+        data_dir=args.data_dir,
+    )
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "repeat": args.repeat,
+        "results": results,
+    }
+
+    baseline = {}
+    if args.baseline.exists():
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+    rows = compare(results, baseline, args.tolerance)
+    print_comparison(rows)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({**report, "comparison": rows}, f, indent=2)
+    if args.update_baseline:
+        # Keep the entries of groups that were not run or were skipped
+        measured = {name: r for name, r in results.items() if "median_ms" in r}
+        with open(args.baseline, "w") as f:
+            json.dump({**report, "results": {**baseline, **measured}}, f, indent=2)
+
+    regressions = [row["name"] for row in rows if row["status"] == "regression"]
+    if regressions and args.fail_on_regression:
+        print(f"Regressions: {', '.join(regressions)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
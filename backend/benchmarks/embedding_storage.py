@@ -0,0 +1,261 @@
+"""
+Benchmark for reduced-dimension and quantized embedding storage.
+
+Compares every (dimensionality, precision) pair against exact search over the
+full-size float32 vectors and reports recall@k, memory per million chunks and
+query latency. Only the dimensionality can be configured in the service
+(`EMBEDDING_DIMENSIONALITY`): Chroma stores float32, so the memory it needs
+is reported apart from the size of the compact codes, which only a store
+keeping them would save.
+
+Latency is that of an exact numpy search over the vectors in memory, not of
+a Chroma query.
+
+Usage:
+    python -m benchmarks.embedding_storage --output results.json
+    python -m benchmarks.embedding_storage --from-chroma --queries 200
+    python -m benchmarks.embedding_storage --embeddings corpus.npy
+"""
+
+import argparse
+import json
+import time
+from typing import Any, Dict, List, Optional
+import numpy as np
+from utils.quantization import (
+    SUPPORTED_PRECISIONS,
+    bytes_per_vector,
+    dequantize_embeddings,
+    quantize_embeddings,
+    truncate_and_normalize,
+)
+
+
+def synthetic_corpus(n_vectors: int, dimensionality: int, seed: int = 0) -> np.ndarray:
+    """
+    Generates a clustered corpus that behaves like real document embeddings.
+
+    Args:
+        n_vectors: The number of vectors to generate.
+        dimensionality: The full vector size.
+        seed: The random seed.
+
+    Returns:
+        A float32 matrix of unit-length vectors.
+    """
+    rng = np.random.default_rng(seed)
+    n_clusters = max(1, n_vectors // 50)
+    # Decaying variance per dimension, as in Matryoshka-style embeddings
+    spectrum = 1.0 / np.sqrt(np.arange(1, dimensionality + 1))
+    centers = rng.normal(size=(n_clusters, dimensionality)) * spectrum
+    labels = rng.integers(0, n_clusters, size=n_vectors)
+    noise = rng.normal(scale=0.5, size=(n_vectors, dimensionality)) * spectrum
+    return truncate_and_normalize(centers[labels] + noise)
+
+
+def load_chroma_corpus(page_size: int = 1000) -> np.ndarray:
+    """
+    Reads every stored embedding out of the configured Chroma collection.
+
+    Args:
+        page_size: The number of vectors fetched per request.
+
+    Returns:
+        A float32 matrix of unit-length vectors.
+    """
+    from repositories import VectorStoreRepository
+
+    collection = VectorStoreRepository().collection
+    embeddings: List[List[float]] = []
+    offset = 0
+    while True:
+        page = collection.get(limit=page_size, offset=offset, include=["embeddings"])
+        if len(page["ids"]) == 0:
+            break
+        embeddings.extend(page["embeddings"])
+        offset += len(page["ids"])
+    return truncate_and_normalize(embeddings)
+
+
+def exact_top_k(corpus: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    """
+    Finds the exact top-k neighbours by inner product.
+
+    Args:
+        corpus: The corpus matrix.
+        queries: The query matrix.
+        k: The number of neighbours.
+
+    Returns:
+        The neighbour indices, best first, one row per query.
+    """
+    scores = queries @ corpus.T
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.take_along_axis(scores, top, axis=1).argsort(axis=1)[:, ::-1]
+    return np.take_along_axis(top, order, axis=1)
+
+
+def run_config(
+    corpus: np.ndarray,
+    queries: np.ndarray,
+    baseline: np.ndarray,
+    dimensionality: int,
+    precision: str,
+    k: int,
+) -> Dict[str, Any]:
+    """
+    Measures one storage configuration against the baseline neighbours.
+
+    Args:
+        corpus: The full-size float32 corpus.
+        queries: The full-size float32 queries.
+        baseline: The exact full-size top-k neighbours.
+        dimensionality: The number of leading dimensions kept.
+        precision: The storage precision.
+        k: The number of results per query.
+
+    Returns:
+        The measurements for this configuration.
+    """
+    reduced_corpus = truncate_and_normalize(corpus, dimensionality)
+    reduced_queries = truncate_and_normalize(queries, dimensionality)
+    codes, scales = quantize_embeddings(reduced_corpus, precision)
+    stored = dequantize_embeddings(codes, scales)
+
+    latencies = []
+    hits = 0
+    for i, query in enumerate(reduced_queries):
+        start = time.perf_counter()
+        found = exact_top_k(stored, query[None, :], k)[0]
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += len(set(baseline[i].tolist()) & set(found.tolist()))
+
+    stored_bytes = bytes_per_vector(dimensionality, "float32")
+    code_bytes = bytes_per_vector(dimensionality, precision)
+    return {
+        "dimensionality": dimensionality,
+        "precision": precision,
+        f"recall@{k}": hits / (k * len(queries)),
+        "bytes_per_vector": stored_bytes,
+        "memory_mb_per_million": stored_bytes * 1_000_000 / 2**20,
+        "code_bytes_per_vector": code_bytes,
+        "code_memory_mb_per_million": code_bytes * 1_000_000 / 2**20,
+        "latency_ms_p50": float(np.percentile(latencies, 50)),
+        "latency_ms_p95": float(np.percentile(latencies, 95)),
+    }
+
+
+def run(
+    corpus: np.ndarray,
+    n_queries: int,
+    dimensionalities: List[int],
+    precisions: List[str],
+    k: int = 20,
+    seed: int = 0,
+) -> List[Dict[str, Any]]:
+    """
+    Runs every storage configuration over the corpus.
+
+    Queries are perturbed copies of corpus vectors, so each one has a
+    meaningful neighbourhood.
+
+    Args:
+        corpus: The full-size float32 corpus.
+        n_queries: The number of queries.
+        dimensionalities: The dimensionalities to test.
+        precisions: The precisions to test.
+        k: The number of results per query.
+        seed: The random seed.
+
+    Returns:
+        One measurement dictionary per configuration.
+    """
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(corpus), size=n_queries, replace=len(corpus) < n_queries)
+    noise = rng.normal(scale=0.02, size=(n_queries, corpus.shape[1]))
+    queries = truncate_and_normalize(corpus[picks] + noise)
+    baseline = exact_top_k(corpus, queries, k)
+
+    return [
+        run_config(corpus, queries, baseline, dim, precision, k)
+        for dim in dimensionalities
+        if dim <= corpus.shape[1]
+        for precision in precisions
+    ]
+
+
+def print_table(results: List[Dict[str, Any]], k: int):
+    """
+    Prints the results as an aligned table.
+
+    Args:
+        results: The measurements returned by `run`.
+        k: The number of results per query.
+    """
+    header = f"{'dim':>5} {'precision':>9} {'recall@' + str(k):>10} {'MB/1M':>9} {'codes MB/1M':>12} {'p50 ms':>8} {'p95 ms':>8}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r['dimensionality']:>5} {r['precision']:>9} {r[f'recall@{k}']:>10.3f} "
+            f"{r['memory_mb_per_million']:>9.0f} {r['code_memory_mb_per_million']:>12.0f} "
+            f"{r['latency_ms_p50']:>8.2f} {r['latency_ms_p95']:>8.2f}"
+        )
+    print("MB/1M: in Chroma (float32). Latency: exact numpy search, not Chroma.")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument(
+        "--embeddings", help="Path to a .npy matrix of full-size embeddings"
+    )
+    source.add_argument(
+        "--from-chroma",
+        action="store_true",
+        help="Read the corpus from the configured Chroma collection",
+    )
+    parser.add_argument(
+        "--vectors", type=int, default=20_000, help="Synthetic corpus size"
+    )
+    parser.add_argument("--full-dimensionality", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dims", default="768,512,256,128")
+    parser.add_argument("--precisions", default=",".join(SUPPORTED_PRECISIONS))
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--output", help="Write the results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    if args.embeddings:
+        corpus = truncate_and_normalize(np.load(args.embeddings))
+    elif args.from_chroma:
+        corpus = load_chroma_corpus()
+    else:
+        corpus = synthetic_corpus(args.vectors, args.full_dimensionality)
+
+    results = run(
+        corpus,
+        n_queries=args.queries,
+        dimensionalities=[int(d) for d in args.dims.split(",")],
+        precisions=args.precisions.split(","),
+        k=args.k,
+    )
+    print_table(results, args.k)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "corpus_size": len(corpus),
+                    "full_dimensionality": int(corpus.shape[1]),
+                    "k": args.k,
+                    "latency_method": "numpy_exact_search",
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,727 @@
+"""
+Load generator for the chat and upload endpoints.
+
+By default the real FastAPI app (`main.app`) is served by uvicorn in this
+process and a Celery worker per ingestion lane runs in a thread with the
+solo pool, as in deployment, over an in-memory broker. Gemini is replaced by a fake that
+injects log-normal latency and 429 responses from a requests-per-minute quota
+(plus an optional random error rate), Chroma by the in-memory stand-in from
+`benchmarks.components`, the cross-encoder by a stub with a fixed cost per
+pair, and docling by a stub whose conversion time grows with the file size.
+
+Traffic runs in phases, e.g. chat alone and then chat while bulk uploads are
+ingested, so the effect of ingestion on query latency shows up side by side.
+Each phase reports p50/p95/p99 latency, throughput and errors per endpoint,
+and the Celery queue wait (overall and per lane) and processing times of the
+uploads.
+
+With `--url` the generator targets a running deployment instead; the fakes
+are not used and queue wait times are not available.
+
+Usage:
+    python -m benchmarks.load_test --chat-rate 5 --upload-rate 0.5 --duration 30
+    python -m benchmarks.load_test --phases mixed --chat-concurrency 8 --gemini-rpm 120
+    python -m benchmarks.load_test --url http://localhost:8000 --phases chat
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import math
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+import zlib
+from collections import Counter
+from contextlib import ExitStack
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from unittest import mock
+import httpx
+import numpy as np
+from google.api_core.exceptions import ResourceExhausted
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from .components import (
+    DATA_DIR,
+    StubChromaClient,
+    StubCrossEncoder,
+    stub_embedding,
+    synthetic_texts,
+)
+
+PHASES = {
+    "chat": {"chat"},
+    "upload": {"upload"},
+    "mixed": {"chat", "upload"},
+}
+
+QUESTIONS = [
+    "How many days of remote work are allowed per week?",
+    "Who approves travel expenses?",
+    "What is the password rotation policy?",
+    "When are performance reviews held?",
+    "How do I report a security incident?",
+    "What does the onboarding training cover?",
+    "How much holiday do new employees get?",
+    "Which budget covers team equipment?",
+]
+
+
+class FakeGemini:
+    """
+    Stands in for the Gemini API, shared by the embedding and chat clients.
+
+    Each call waits for a log-normal latency around the configured median.
+    Calls beyond the requests-per-minute quota, and a random share of the
+    others, fail with the 429 error the API returns.
+    """
+
+    def __init__(
+        self,
+        llm_latency_ms: float = 800.0,
+        embed_latency_ms: float = 100.0,
+        requests_per_minute: Optional[float] = None,
+        error_rate: float = 0.0,
+        seed: int = 0,
+    ):
+        self.llm_latency_ms = llm_latency_ms
+        self.embed_latency_ms = embed_latency_ms
+        self.requests_per_minute = requests_per_minute
+        self.error_rate = error_rate
+        self.stats: Counter = Counter()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens = requests_per_minute or 0.0
+        self._refilled_at = time.monotonic()
+
+    def _admit(self, kind: str) -> float:
+        """
+        Applies the quota and draws the latency of one call.
+
+        Args:
+            kind: "embed" or "generate".
+
+        Returns:
+            The latency in seconds.
+
+        Raises:
+            ResourceExhausted: If the call is rejected with a 429.
+        """
+        with self._lock:
+            if self.requests_per_minute:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.requests_per_minute,
+                    self._tokens
+                    + (now - self._refilled_at) * self.requests_per_minute / 60,
+                )
+                self._refilled_at = now
+            over_quota = bool(self.requests_per_minute) and self._tokens < 1
+            if over_quota or self._rng.random() < self.error_rate:
+                self.stats[f"{kind}_429"] += 1
+                raise ResourceExhausted(
+                    "Resource has been exhausted (e.g. check quota)."
+                )
+            if self.requests_per_minute:
+                self._tokens -= 1
+            self.stats[kind] += 1
+            median = (
+                self.llm_latency_ms if kind == "generate" else self.embed_latency_ms
+            )
+            return self._rng.lognormvariate(math.log(median / 1000), 0.5)
+
+    def embed_content(
+        self, model, content, task_type=None, output_dimensionality=None
+    ) -> Dict[str, Any]:
+        time.sleep(self._admit("embed"))
+        size = output_dimensionality or 768
+        if isinstance(content, str):
+            return {"embedding": stub_embedding(content, size)}
+        return {"embedding": [stub_embedding(text, size) for text in content]}
+
+    def generate(self, prompt: str) -> AIMessage:
+        time.sleep(self._admit("generate"))
+        text = " ".join(
+            synthetic_texts(1, words_per_text=80, seed=zlib.crc32(prompt.encode()))
+        )
+        input_tokens = len(prompt) // 4
+        output_tokens = len(text) // 4
+        return AIMessage(
+            content=text,
+            usage_metadata={
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens,
+            },
+        )
+
+
+class FakeGeminiChat(BaseChatModel):
+    """
+    A chat model backed by `FakeGemini`, retrying 429s with exponential
+    backoff like the Gemini LangChain client does.
+    """
+
+    gemini: Any
+    max_retries: int = 6
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-gemini"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        prompt = "\n".join(str(message.content) for message in messages)
+        delay = 1.0
+        for attempt in range(self.max_retries):
+            try:
+                message = self.gemini.generate(prompt)
+                return ChatResult(generations=[ChatGeneration(message=message)])
+            except ResourceExhausted:
+                if attempt == self.max_retries - 1:
+                    raise
+                time.sleep(delay)
+                delay = min(delay * 2, 60.0)
+
+
+class TimedCrossEncoder(StubCrossEncoder):
+    """
+    The stub cross-encoder with a fixed cost per (query, document) pair.
+    """
+
+    seconds_per_pair = 0.002
+
+    def predict(self, pairs):
+        time.sleep(self.seconds_per_pair * len(pairs))
+        return super().predict(pairs)
+
+
+class StubDocumentService:
+    """
+    Stands in for `DocumentService`, converting at a fixed rate per MB and
+    producing one chunk per 2 KB of file.
+    """
+
+    seconds_per_mb = 5.0
+
+    def load_and_chunk_documents(self, file_paths: List[str]) -> List[Any]:
+        chunks = []
+        for file_path in file_paths:
+            size = os.path.getsize(file_path)
+            time.sleep(self.seconds_per_mb * size / 2**20)
+            texts = synthetic_texts(
+                max(1, size // 2048), seed=zlib.crc32(str(file_path).encode())
+            )
+            chunks.extend(SimpleNamespace(text=text) for text in texts)
+        return chunks
+
+
+class TaskTracker:
+    """
+    Records when each Celery task is published, started and finished.
+    """
+
+    def __init__(self):
+        self.published: Dict[str, float] = {}
+        self.queues: Dict[str, str] = {}
+        self.started: Dict[str, float] = {}
+        self.finished: Dict[str, float] = {}
+        self.failed: set = set()
+
+    def connect(self):
+        from celery.signals import after_task_publish, task_postrun, task_prerun
+
+        after_task_publish.connect(self._on_publish, weak=False)
+        task_prerun.connect(self._on_prerun, weak=False)
+        task_postrun.connect(self._on_postrun, weak=False)
+
+    def _on_publish(self, headers=None, routing_key=None, **kwargs):
+        self.published[headers["id"]] = time.perf_counter()
+        self.queues[headers["id"]] = routing_key
+
+    def _on_prerun(self, task_id=None, **kwargs):
+        self.started[task_id] = time.perf_counter()
+
+    def _on_postrun(self, task_id=None, retval=None, **kwargs):
+        self.finished[task_id] = time.perf_counter()
+        if not isinstance(retval, dict) or retval.get("status") != "success":
+            self.failed.add(task_id)
+
+    def pending(self, task_ids: List[str]) -> int:
+        return sum(1 for task_id in task_ids if task_id not in self.finished)
+
+    def summary(self, task_ids: List[str]) -> Dict[str, Any]:
+        """
+        Summarizes the tasks of one phase.
+
+        Args:
+            task_ids: The ids returned by the phase's uploads.
+
+        Returns:
+            The queue wait, overall and per queue, and processing percentiles
+            and task counts.
+        """
+        waits = {
+            t: (self.started[t] - self.published[t]) * 1000
+            for t in task_ids
+            if t in self.started and t in self.published
+        }
+        by_queue: Dict[str, List[float]] = {}
+        for t, wait in waits.items():
+            by_queue.setdefault(self.queues[t], []).append(wait)
+        processing = [
+            (self.finished[t] - self.started[t]) * 1000
+            for t in task_ids
+            if t in self.finished and t in self.started
+        ]
+        return {
+            "tasks": len(task_ids),
+            "completed": sum(1 for t in task_ids if t in self.finished),
+            "failed": sum(1 for t in task_ids if t in self.failed),
+            "queue_wait_ms": percentiles(list(waits.values())),
+            "queue_wait_ms_by_queue": {
+                queue: percentiles(samples) for queue, samples in by_queue.items()
+            },
+            "processing_ms": percentiles(processing),
+        }
+
+
+def percentiles(samples: List[float]) -> Dict[str, Optional[float]]:
+    """
+    Computes the p50, p95 and p99 of a list of samples.
+
+    Args:
+        samples: The samples.
+
+    Returns:
+        The percentiles, None without samples.
+    """
+    if not samples:
+        return {"p50": None, "p95": None, "p99": None}
+    return {f"p{q}": float(np.percentile(samples, q)) for q in (50, 95, 99)}
+
+
+def start_local_stack(args: argparse.Namespace, gemini: FakeGemini) -> Dict[str, Any]:
+    """
+    Serves the real app and runs a Celery worker with local fakes.
+
+    Args:
+        args: The command line arguments.
+        gemini: The fake Gemini API.
+
+    Returns:
+        The base URL, the task tracker and the handles needed to stop the stack.
+    """
+    # The settings require an API key, which the fakes never use
+    os.environ.setdefault("GOOGLE_AI_API_KEY", "load-test")
+    TimedCrossEncoder.seconds_per_pair = args.rerank_ms_per_pair / 1000
+    StubDocumentService.seconds_per_mb = args.conversion_s_per_mb
+    chroma = StubChromaClient()
+
+    stack = ExitStack()
+    stack.enter_context(
+        mock.patch(
+            "repositories.vector_store_repository.chromadb.HttpClient",
+            lambda *a, **k: chroma,
+        )
+    )
+    stack.enter_context(
+        mock.patch(
+            "services.embedding_backends.genai.embed_content", gemini.embed_content
+        )
+    )
+    stack.enter_context(
+        mock.patch(
+            "services.generation_service.ChatGoogleGenerativeAI",
+            lambda **kwargs: FakeGeminiChat(gemini=gemini),
+        )
+    )
+    stack.enter_context(
+        mock.patch("services.reranking_service.CrossEncoder", TimedCrossEncoder)
+    )
+    if not args.real_documents:
+        stack.enter_context(
+            mock.patch("celery_worker.DocumentService", StubDocumentService)
+        )
+
+    import uvicorn
+    from celery.contrib.testing.worker import start_worker
+    import api.document_controller as controller
+    from celery_worker import celery
+    from main import app
+    from repositories import VectorStoreRepository
+    from settings import settings
+
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+    settings.WORKER_METRICS_PORT = 0
+    upload_dir = Path(stack.enter_context(tempfile.TemporaryDirectory()))
+    controller.UPLOAD_DIR = upload_dir
+
+    # Seed the store so queries search a realistic number of chunks
+    texts = synthetic_texts(args.corpus_chunks)
+    VectorStoreRepository().add_documents(
+        ids=[f"seed_chunk_{i}" for i in range(len(texts))],
+        documents=texts,
+        metadatas=[
+            {"document_id": "seed", "chunk_index": i, "source": "/data/seed.pdf"}
+            for i in range(len(texts))
+        ],
+        embeddings=[stub_embedding(text) for text in texts],
+    )
+
+    tracker = TaskTracker()
+    tracker.connect()
+    celery.conf.update(broker_url="memory://", result_backend="cache+memory://")
+    # One worker per ingestion lane, as deployed
+    for name, queues in (
+        ("fast", [settings.INGEST_FAST_QUEUE]),
+        ("heavy", [settings.INGEST_HEAVY_QUEUE, "celery"]),
+    ):
+        stack.enter_context(
+            start_worker(
+                celery,
+                pool="solo",
+                perform_ping_check=False,
+                loglevel="WARNING",
+                queues=queues,
+                hostname=f"{name}@load-test",
+            )
+        )
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(
+        uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning")
+    )
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+
+    def stop():
+        server.should_exit = True
+        thread.join()
+        stack.close()
+
+    return {"url": f"http://127.0.0.1:{port}", "tracker": tracker, "stop": stop}
+
+
+class EndpointStats:
+    """
+    Collects the outcome of every request sent to one endpoint.
+    """
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.errors: Counter = Counter()
+        self.requests = 0
+
+    def record(self, latency_ms: float, outcome: str):
+        self.requests += 1
+        if outcome == "ok":
+            self.latencies.append(latency_ms)
+        else:
+            self.errors[outcome] += 1
+
+    def summary(self, duration_s: float) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "ok": len(self.latencies),
+            "error_rate": (
+                sum(self.errors.values()) / self.requests if self.requests else 0.0
+            ),
+            "errors": dict(self.errors),
+            "throughput_rps": len(self.latencies) / duration_s,
+            "latency_ms": percentiles(self.latencies),
+        }
+
+
+async def timed_request(
+    stats: EndpointStats, send: Callable[[], Awaitable[httpx.Response]]
+) -> Optional[httpx.Response]:
+    """
+    Sends one request and records its latency and outcome.
+
+    Args:
+        stats: The stats of the endpoint.
+        send: Sends the request.
+
+    Returns:
+        The response, or None if the request failed without one.
+    """
+    start = time.perf_counter()
+    try:
+        response = await send()
+    except httpx.HTTPError as e:
+        stats.record((time.perf_counter() - start) * 1000, type(e).__name__)
+        return None
+    outcome = "ok" if response.is_success else str(response.status_code)
+    stats.record((time.perf_counter() - start) * 1000, outcome)
+    return response
+
+
+async def drive(
+    request: Callable[[], Awaitable[Any]],
+    duration_s: float,
+    rate: Optional[float],
+    concurrency: int,
+    rng: random.Random,
+):
+    """
+    Sends requests for a while, open-loop at a rate or closed-loop.
+
+    With a rate, arrivals follow a Poisson process and at most `concurrency`
+    requests are in flight; time spent waiting for a slot counts towards
+    the request latency only once it is sent, so watch the throughput too.
+    Without a rate, `concurrency` clients send requests back to back.
+
+    Args:
+        request: Sends one request.
+        duration_s: How long to send requests.
+        rate: The arrival rate in requests per second, if open-loop.
+        concurrency: The number of clients or in-flight requests.
+        rng: The random generator for arrival times.
+    """
+    deadline = time.perf_counter() + duration_s
+    if rate is None:
+
+        async def client():
+            while time.perf_counter() < deadline:
+                await request()
+
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        return
+
+    slots = asyncio.Semaphore(concurrency)
+
+    async def send():
+        async with slots:
+            await request()
+
+    in_flight = []
+    while True:
+        await asyncio.sleep(rng.expovariate(rate))
+        if time.perf_counter() >= deadline:
+            break
+        in_flight.append(asyncio.create_task(send()))
+    await asyncio.gather(*in_flight)
+
+
+async def run_phase(
+    name: str,
+    client: httpx.AsyncClient,
+    args: argparse.Namespace,
+    upload_files: List[Path],
+    tracker: Optional[TaskTracker],
+) -> Dict[str, Any]:
+    """
+    Runs one traffic phase.
+
+    Args:
+        name: The phase name, a key of `PHASES`.
+        client: The HTTP client.
+        args: The command line arguments.
+        upload_files: The files to upload, used in turn.
+        tracker: The Celery task tracker, when the worker runs locally.
+
+    Returns:
+        The phase report.
+    """
+    rng = random.Random(args.seed)
+    chat, upload = EndpointStats(), EndpointStats()
+    task_ids: List[str] = []
+    files = itertools.cycle(upload_files)
+    counter = itertools.count()
+
+    async def send_chat():
+        question = rng.choice(QUESTIONS)
+        await timed_request(
+            chat, lambda: client.post("/api/chat", json={"question": question})
+        )
+
+    async def send_upload():
+        path = next(files)
+        # A unique name per upload, so each one becomes its own document
+        filename = f"{path.stem}-{name}-{next(counter)}{path.suffix}"
+        content = path.read_bytes()
+        response = await timed_request(
+            upload,
+            lambda: client.post("/api/upload", files={"file": (filename, content)}),
+        )
+        if response is not None and response.is_success:
+            task_ids.append(response.json()["task_id"])
+
+    drivers = []
+    if "chat" in PHASES[name]:
+        drivers.append(
+            drive(send_chat, args.duration, args.chat_rate, args.chat_concurrency, rng)
+        )
+    if "upload" in PHASES[name]:
+        drivers.append(
+            drive(
+                send_upload,
+                args.duration,
+                args.upload_rate,
+                args.upload_concurrency,
+                rng,
+            )
+        )
+    start = time.perf_counter()
+    await asyncio.gather(*drivers)
+    elapsed = time.perf_counter() - start
+
+    report = {"phase": name, "duration_s": elapsed, "endpoints": {}}
+    if "chat" in PHASES[name]:
+        report["endpoints"]["chat"] = chat.summary(elapsed)
+    if "upload" in PHASES[name]:
+        report["endpoints"]["upload"] = upload.summary(elapsed)
+        if tracker is not None:
+            # Let the queue drain so the next phase starts from an idle worker
+            drain_deadline = time.perf_counter() + args.drain_timeout
+            while tracker.pending(task_ids) and time.perf_counter() < drain_deadline:
+                await asyncio.sleep(0.2)
+            report["tasks"] = {
+                **tracker.summary(task_ids),
+                "pending": tracker.pending(task_ids),
+            }
+    return report
+
+
+def print_report(reports: List[Dict[str, Any]]):
+    """
+    Prints the phase reports as aligned tables.
+
+    Args:
+        reports: The phase reports.
+    """
+
+    def ms(value: Optional[float]) -> str:
+        return f"{value:.0f}" if value is not None else "-"
+
+    header = f"{'phase':<8} {'endpoint':<8} {'reqs':>6} {'rps':>7} {'err %':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    print(header)
+    print("-" * len(header))
+    for report in reports:
+        for endpoint, s in report["endpoints"].items():
+            latency = s["latency_ms"]
+            print(
+                f"{report['phase']:<8} {endpoint:<8} {s['requests']:>6} "
+                f"{s['throughput_rps']:>7.2f} {s['error_rate'] * 100:>6.1f} "
+                f"{ms(latency['p50']):>8} {ms(latency['p95']):>8} {ms(latency['p99']):>8}"
+            )
+    for report in reports:
+        tasks = report.get("tasks")
+        if tasks:
+            wait, processing = tasks["queue_wait_ms"], tasks["processing_ms"]
+            print(
+                f"\n{report['phase']}: {tasks['completed']}/{tasks['tasks']} uploads "
+                f"processed, {tasks['failed']} failed, {tasks['pending']} pending; "
+                f"queue wait p50/p95/p99 {ms(wait['p50'])}/{ms(wait['p95'])}/"
+                f"{ms(wait['p99'])} ms, processing p50/p95 "
+                f"{ms(processing['p50'])}/{ms(processing['p95'])} ms"
+            )
+            for queue, wait in tasks["queue_wait_ms_by_queue"].items():
+                print(
+                    f"  {queue}: queue wait p50/p95/p99 {ms(wait['p50'])}/"
+                    f"{ms(wait['p95'])}/{ms(wait['p99'])} ms"
+                )
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    """
+    Runs every phase against the local stack or the given deployment.
+
+    Args:
+        args: The command line arguments.
+
+    Returns:
+        The full report.
+    """
+    gemini = FakeGemini(
+        llm_latency_ms=args.llm_latency_ms,
+        embed_latency_ms=args.embed_latency_ms,
+        requests_per_minute=args.gemini_rpm,
+        error_rate=args.gemini_error_rate,
+        seed=args.seed,
+    )
+    stack = None
+    url, tracker = args.url, None
+    if url is None:
+        stack = start_local_stack(args, gemini)
+        url, tracker = stack["url"], stack["tracker"]
+
+    upload_files = sorted(
+        path for path in Path(args.data_dir).iterdir() if path.is_file()
+    )
+    reports = []
+    try:
+        async with httpx.AsyncClient(base_url=url, timeout=args.timeout) as client:
+            for phase in args.phases.split(","):
+                reports.append(
+                    await run_phase(phase, client, args, upload_files, tracker)
+                )
+    finally:
+        if stack is not None:
+            stack["stop"]()
+
+    return {
+        "config": {
+            key: str(value) if isinstance(value, Path) else value
+            for key, value in vars(args).items()
+        },
+        "gemini": dict(gemini.stats) if args.url is None else None,
+        "phases": reports,
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", help="Target a running deployment instead")
+    parser.add_argument("--phases", default="chat,mixed")
+    parser.add_argument(
+        "--duration", type=float, default=30.0, help="Seconds per phase"
+    )
+    parser.add_argument("--chat-rate", type=float, help="Chat requests per second")
+    parser.add_argument("--chat-concurrency", type=int, default=4)
+    parser.add_argument("--upload-rate", type=float, help="Uploads per second")
+    parser.add_argument("--upload-concurrency", type=int, default=1)
+    parser.add_argument("--data-dir", type=Path, default=DATA_DIR)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--drain-timeout", type=float, default=120.0)
+    parser.add_argument("--llm-latency-ms", type=float, default=800.0)
+    parser.add_argument("--embed-latency-ms", type=float, default=100.0)
+    parser.add_argument("--gemini-rpm", type=float, help="Fake Gemini quota")
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0)
+    parser.add_argument("--rerank-ms-per-pair", type=float, default=2.0)
+    parser.add_argument("--conversion-s-per-mb", type=float, default=5.0)
+    parser.add_argument(
+        "--real-documents", action="store_true", help="Convert uploads with docling"
+    )
+    parser.add_argument("--corpus-chunks", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the report as JSON to this path")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args(argv)
+    for phase in args.phases.split(","):
+        if phase not in PHASES:
+            parser.error(f"unknown phase '{phase}', expected one of {list(PHASES)}")
+
+    report = asyncio.run(run(args))
+    print_report(report["phases"])
+    if report["gemini"]:
+        print(f"\nFake Gemini calls: {report['gemini']}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
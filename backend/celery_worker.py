@@ -1,12 +1,30 @@
+import os
+import signal
 import sys
+import tracemalloc
 from pathlib import Path
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 import logging
 from celery import Celery
+from celery.signals import task_postrun, worker_init
+from prometheus_client import start_http_server
 from settings import settings
 from services.document_service import DocumentService
 from services.embedding_service import EmbeddingService
+from services.ingestion_routing import IngestionRouter
+from services.reindex_service import ReindexService
+from services.task_events import TaskProgress
 from repositories.vector_store_repository import VectorStoreRepository
+from utils.metrics import (
+    INGEST_CHUNKS,
+    MB,
+    TASK_PEAK_RSS,
+    WORKER_RECYCLES,
+    WORKER_RSS,
+    collect_timings,
+    ingest_stage,
+)
+from utils.resource_usage import current_rss, track_resources
 
 
 # Configure logging
@@ -25,6 +43,85 @@ celery = Celery(
 
 celery.conf.update(settings.CELERY_CONFIG)
 
+# Allocations after the first task, which later reports are compared to
+_tracemalloc_baseline: Optional[tracemalloc.Snapshot] = None
+
+
+@worker_init.connect
+def start_metrics_exporter(**kwargs):
+    """
+    Expose the worker's Prometheus metrics over HTTP.
+
+    The exporter serves the metrics of the process it runs in, which covers
+    every task with the solo pool used in deployment.
+    """
+    if settings.WORKER_METRICS_PORT:
+        start_http_server(settings.WORKER_METRICS_PORT)
+        logger.info(f"Serving worker metrics on port {settings.WORKER_METRICS_PORT}")
+    if settings.WORKER_TRACEMALLOC:
+        tracemalloc.start(25)
+        logger.info("Tracing memory allocations")
+
+
+@task_postrun.connect
+def recycle_on_high_memory(task_id=None, task=None, retval=None, **kwargs):
+    """
+    Restart the worker once a task leaves it above `WORKER_MAX_RSS_MB`.
+
+    With the solo pool, SIGTERM makes the worker finish and exit, and the
+    container restarts it. With a process pool, it ends the child, which the
+    pool replaces. Memory that a task only used at its peak is returned, so
+    only what remains allocated triggers a restart.
+    """
+    rss = current_rss()
+    WORKER_RSS.set(rss)
+    usage = retval.get("resources") if isinstance(retval, dict) else None
+    if usage:
+        TASK_PEAK_RSS.labels(task.name).observe(usage["peak_rss_mb"] * MB)
+    if not settings.WORKER_MAX_RSS_MB:
+        return
+
+    limit = settings.WORKER_MAX_RSS_MB * MB
+    peak = usage["peak_rss_mb"] * MB if usage else rss
+    if tracemalloc.is_tracing():
+        _report_allocations(task_id, exceeded=max(rss, peak) > limit)
+    if rss > limit:
+        logger.warning(
+            f"Worker memory at {rss / MB:.0f} MB after task {task_id}, above "
+            f"{settings.WORKER_MAX_RSS_MB} MB: restarting"
+        )
+        WORKER_RECYCLES.inc()
+        os.kill(os.getpid(), signal.SIGTERM)
+
+
+def _report_allocations(task_id: str, exceeded: bool):
+    """
+    Write the allocations that grew since the first task, for a task that
+    crossed the memory threshold.
+
+    The first task only records the baseline, so models and caches loaded
+    on first use are not reported as growth.
+
+    Args:
+        task_id: The task that just finished
+        exceeded: Whether the task crossed the threshold
+    """
+    global _tracemalloc_baseline
+    if _tracemalloc_baseline is None:
+        _tracemalloc_baseline = tracemalloc.take_snapshot()
+        return
+    if not exceeded:
+        return
+
+    stats = tracemalloc.take_snapshot().compare_to(_tracemalloc_baseline, "lineno")
+    report_path = Path(settings.WORKER_PROFILE_DIR) / f"{task_id}.txt"
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+    report_path.write_text("\n".join(str(stat) for stat in stats[:50]))
+    logger.warning(
+        f"Largest allocation growth for task {task_id} (full report in "
+        f"{report_path}):\n" + "\n".join(str(stat) for stat in stats[:5])
+    )
+
 
 def sanitize_metadata_value(value: Any) -> Any:
     """
@@ -86,11 +183,89 @@ def sanitize_metadata(metadata: Dict[str, Any]) -> Dict[str, Any]:
 
 
 @celery.task(bind=True)
-def process_document_task(self, file_path: str) -> Dict[str, Any]:
+def process_document_task(
+    self,
+    file_path: str,
+    lane: Optional[str] = None,
+    user: Optional[str] = None,
+    enqueued_at: Optional[float] = None,
+) -> Dict[str, Any]:
     """
     Process document asynchronously following Clean Architecture principles.
 
+    Progress is published at each stage, and per batch of embedded chunks,
+    for the task status API.
+
+    Args:
+        file_path: Path to the uploaded document
+        lane: The ingestion lane the upload was routed to, if any
+        user: Who uploaded the document
+        enqueued_at: When the upload was queued, as a UNIX timestamp
+
+    Returns:
+        Processing result with status, details, per-stage timings, resource
+        usage, and the lane and time waited in it
+    """
+    # Retries come back through the queue without being counted again
+    queue_wait_s = None
+    if lane is not None and self.request.retries == 0:
+        queue_wait_s = IngestionRouter().started(lane, user, enqueued_at)
+    progress = TaskProgress(self, lane=lane)
+    with collect_timings() as timings, track_resources() as resources:
+        result = _process_document(self, progress, file_path)
+    result["timings"] = timings
+    result["resources"] = resources
+    result["lane"] = lane
+    result["queue_wait_s"] = queue_wait_s
+    progress.finish(result)
+    return result
+
+
+def _write_to_reindex_target(
+    vector_store_repository: VectorStoreRepository,
+    target: str,
+    ids: List[str],
+    texts: List[str],
+    metadatas: List[Dict[str, Any]],
+):
+    """
+    Store chunks in the collection a re-index is building or switched to,
+    embedded for that collection.
+
     Args:
+        vector_store_repository: The vector store repository
+        target: The re-index target or new active collection
+        ids: The chunk ids
+        texts: The chunk texts
+        metadatas: The chunk metadata
+    """
+    storage = vector_store_repository.storage(
+        vector_store_repository.get_collection(target)
+    )
+    embedding_service = EmbeddingService(
+        storage["embedding_model"], storage["embedding_dimensionality"]
+    )
+    with ingest_stage("dual_write_embedding"):
+        embeddings = embedding_service.generate_embeddings(texts)
+    if len(embeddings) != len(texts):
+        raise RuntimeError(
+            f"Failed to embed the chunks for re-index target {target}. "
+            f"Expected {len(texts)}, got {len(embeddings)}"
+        )
+    with ingest_stage("dual_write_upsert"):
+        vector_store_repository.add_documents(
+            ids, texts, metadatas, embeddings, collection_name=target
+        )
+    logger.info(f"Documents also stored in re-index target {target}")
+
+
+def _process_document(task, progress: TaskProgress, file_path: str) -> Dict[str, Any]:
+    """
+    Run the ingestion stages for a document.
+
+    Args:
+        task: The bound Celery task
+        progress: Publishes the task's progress
         file_path: Path to the uploaded document
 
     Returns:
@@ -100,25 +275,29 @@ def process_document_task(self, file_path: str) -> Dict[str, Any]:
         logger.info(f"Starting document processing for: {file_path}")
 
         # Update task state to PROGRESS
-        self.update_state(
-            state="PROGRESS",
-            meta={"current": 0, "total": 4, "status": "Initializing services..."},
-        )
+        progress.stage("initialization", "Initializing services...")
 
         # Initialize services following Clean Architecture
-        document_service = DocumentService()
-        embedding_service = EmbeddingService()
-        vector_store_repository = VectorStoreRepository()
+        with ingest_stage("initialization"):
+            document_service = DocumentService()
+            vector_store_repository = VectorStoreRepository()
+            reindex_service = ReindexService(vector_store_repository)
+            active_collection = vector_store_repository.active_collection_name(
+                max_age_s=0
+            )
+            storage = vector_store_repository.storage(
+                vector_store_repository.get_collection(active_collection)
+            )
+            embedding_service = EmbeddingService(
+                storage["embedding_model"], storage["embedding_dimensionality"]
+            )
 
         # Extract document ID from file path
         document_id = Path(file_path).stem
         logger.info(f"Processing document with ID: {document_id}")
 
         # Update progress
-        self.update_state(
-            state="PROGRESS",
-            meta={"current": 1, "total": 4, "status": "Processing document..."},
-        )
+        progress.stage("parsing", "Processing document...")
 
         # Use the correct method name from DocumentService
         # Based on the original error, it should be load_and_chunk_documents
@@ -132,13 +311,11 @@ def process_document_task(self, file_path: str) -> Dict[str, Any]:
             return {"status": "error", "error": error_msg, "file_path": file_path}
 
         # Update progress
-        self.update_state(
-            state="PROGRESS",
-            meta={
-                "current": 2,
-                "total": 4,
-                "status": f"Generating embeddings for {len(chunks)} chunks...",
-            },
+        progress.stage(
+            "embedding",
+            f"Generating embeddings for {len(chunks)} chunks...",
+            processed=0,
+            total=len(chunks),
         )
 
         # Extract texts and prepare data following Clean Architecture
@@ -164,12 +341,15 @@ def process_document_task(self, file_path: str) -> Dict[str, Any]:
         # Generate embeddings using the service layer
         logger.info("Starting embedding generation...")
         try:
-            embeddings = embedding_service.generate_embeddings(texts)
+            with ingest_stage("embedding"):
+                embeddings = embedding_service.generate_embeddings(
+                    texts, lambda done: progress.chunks(done, len(texts))
+                )
         except Exception as e:
             logger.error(f"Failed to generate embeddings for chunks: {str(e)}")
             # Retry the task with exponential backoff
-            raise self.retry(
-                countdown=60 * (2**self.request.retries), max_retries=3, exc=e
+            raise task.retry(
+                countdown=60 * (2**task.request.retries), max_retries=3, exc=e
             )
 
         # Verify we have embeddings
@@ -181,10 +361,7 @@ def process_document_task(self, file_path: str) -> Dict[str, Any]:
         logger.info(f"Generated {len(embeddings)} embeddings successfully")
 
         # Update progress
-        self.update_state(
-            state="PROGRESS",
-            meta={"current": 3, "total": 4, "status": "Storing in vector database..."},
-        )
+        progress.stage("upsert", "Storing in vector database...")
 
         # Final validation before storing
         logger.info("Validating data before storage...")
@@ -200,10 +377,29 @@ def process_document_task(self, file_path: str) -> Dict[str, Any]:
             for key, value in sample_metadata.items():
                 logger.info(f"  {key}: {type(value)} = {value}")
 
+        # A re-index may have started or switched collections while the
+        # document was embedded, so both are read again right before writing.
+        # The target is read before the active collection, so a switch in
+        # between still gets the chunks written to the new collection.
+        reindex_target = reindex_service.dual_write_target()
+        current_collection = vector_store_repository.active_collection_name(max_age_s=0)
+
         # Store in vector database through repository layer
-        vector_store_repository.add_documents(ids, texts, metadatas, embeddings)
+        with ingest_stage("upsert"):
+            vector_store_repository.add_documents(
+                ids, texts, metadatas, embeddings, collection_name=active_collection
+            )
+        INGEST_CHUNKS.inc(len(ids))
         logger.info("Documents stored in vector database successfully")
 
+        # Dual-write while a re-index builds the next collection, and catch
+        # up with a switch that happened during embedding
+        for target in dict.fromkeys([current_collection, reindex_target]):
+            if target is not None and target != active_collection:
+                _write_to_reindex_target(
+                    vector_store_repository, target, ids, texts, metadatas
+                )
+
         # Final result
         result = {
             "status": "success",
@@ -224,6 +420,28 @@ def process_document_task(self, file_path: str) -> Dict[str, Any]:
         error_result = {"status": "error", "error": str(e), "file_path": file_path}
 
         # Update task state to FAILURE
-        self.update_state(state="FAILURE", meta=error_result)
+        task.update_state(state="FAILURE", meta=error_result)
 
         return error_result
+
+
+@celery.task(bind=True)
+def reindex_collection_task(self) -> Dict[str, Any]:
+    """
+    Re-embed the vector store into a new collection and switch to it.
+
+    Resumes the unfinished re-index prepared by `ReindexService.start`,
+    reporting progress as task state.
+
+    Returns:
+        The final migration state
+    """
+
+    def report(state: Dict[str, Any]):
+        self.update_state(state="PROGRESS", meta=state)
+        logger.info(
+            f"Re-indexed {state['processed']}/{state['total']} chunks, "
+            f"ETA {state['eta_seconds']}s"
+        )
+
+    return ReindexService().run(self.request.id, on_progress=report)
@@ -1,12 +1,19 @@
 # from typing import Union
 import logging
 import sys
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 from config import setup_logging
 from repositories import VectorStoreRepository
 from contextlib import asynccontextmanager
 from settings import settings
 from api import document_router
+from services.admission_control import AdmissionRejected
+from services.cancellation import RequestCancelled
+from utils.metrics import collect_timings, format_server_timing
 
 setup_logging()
 
@@ -24,9 +31,69 @@ async def lifespan(app: FastAPI):
 
 app = FastAPI(lifespan=lifespan)
 
+
+class ServerTimingMiddleware:
+    """
+    Collects the stage timings of each request, and returns them in a
+    Server-Timing header if enabled.
+
+    Written as plain ASGI rather than with `@app.middleware("http")`, which
+    hides client disconnects from `Request.is_disconnected`.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        with collect_timings() as timings:
+
+            async def send_with_timing(message: Message):
+                if (
+                    message["type"] == "http.response.start"
+                    and settings.EXPOSE_TIMING_HEADER
+                    and timings
+                ):
+                    MutableHeaders(scope=message).append(
+                        "Server-Timing", format_server_timing(timings)
+                    )
+                await send(message)
+
+            await self.app(scope, receive, send_with_timing)
+
+
+app.add_middleware(ServerTimingMiddleware)
+
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected(request: Request, exc: AdmissionRejected):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": str(exc), "stage": exc.stage},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+@app.exception_handler(RequestCancelled)
+async def request_cancelled(request: Request, exc: RequestCancelled):
+    # A disconnected client never reads the response, 499 only shows in logs
+    return JSONResponse(
+        status_code=504 if exc.reason == "deadline" else 499,
+        content={"detail": str(exc), "stage": exc.stage},
+    )
+
+
 app.include_router(document_router, prefix="/api", tags=["api"])
 
 
 @app.get("/")
 async def read_root():
     return {"Hello": "from Internal Genius"}
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
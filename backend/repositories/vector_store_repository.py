@@ -1,22 +1,166 @@
+import logging
+import math
+import threading
+import time
+from typing import Any, Dict, List, Optional
 import chromadb
-from typing import List, Dict, Any
+import redis
+from redis.exceptions import RedisError
 from settings import settings
-import logging
+from utils.embedding_models import embedding_identity
+
+# The collection used until the first re-index
+DEFAULT_COLLECTION = "documents"
+# Name of the collection queries and ingestion use, shared through Redis
+ACTIVE_COLLECTION_KEY = "vector_store:active_collection"
+
+
+def configured_storage() -> Dict[str, Any]:
+    """
+    Describes how the settings ask vectors to be produced and stored.
+
+    New collections, including re-index targets, are created with it.
+
+    Returns:
+        The embedding backend, model and dimensionality.
+    """
+    return {
+        **embedding_identity(settings.EMBEDDING_MODEL),
+        "embedding_dimensionality": settings.EMBEDDING_DIMENSIONALITY,
+    }
 
 
 class VectorStoreRepository:
     """
     A repository for interacting with the ChromaDB vector store.
+
+    Unless pinned to a collection, the repository follows the active
+    collection recorded in Redis, which a re-index switches atomically. Each
+    collection records the embedding model and storage of its vectors, and
+    reads and writes follow the collection rather than the settings.
     """
 
-    def __init__(self):
+    def __init__(self, collection_name: Optional[str] = None):
         """
         Initializes the VectorStoreRepository.
+
+        Args:
+            collection_name: A collection to use instead of the active one.
         """
         self.client = chromadb.HttpClient(
             host=settings.CHROMA_HOST, port=settings.CHROMA_PORT
         )
-        self.collection = self.client.get_or_create_collection(name="documents")
+        self.collection_name = collection_name
+        self._redis: Optional[redis.Redis] = None
+        self._active_name: Optional[str] = None
+        self._active_checked_at = -math.inf
+        self._collections: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._warn_if_outdated()
+
+    @property
+    def collection(self):
+        """
+        The collection queries currently use.
+        """
+        return self.get_collection(self.active_collection_name())
+
+    def active_collection_name(self, max_age_s: Optional[float] = None) -> str:
+        """
+        Returns the name of the active collection.
+
+        The name is re-read from Redis at most every `max_age_s` seconds. If
+        Redis is unreachable, the last known name is kept.
+
+        Args:
+            max_age_s: How old the cached name may be, defaults to
+                `ACTIVE_COLLECTION_REFRESH_S`.
+
+        Returns:
+            The pinned collection if any, otherwise the active one.
+        """
+        if self.collection_name is not None:
+            return self.collection_name
+        if max_age_s is None:
+            max_age_s = settings.ACTIVE_COLLECTION_REFRESH_S
+        now = time.monotonic()
+        if now - self._active_checked_at >= max_age_s:
+            try:
+                name = self._client().get(ACTIVE_COLLECTION_KEY)
+                self._active_name = name.decode() if name else DEFAULT_COLLECTION
+            except RedisError as e:
+                logging.warning(f"Could not read the active collection: {e}")
+                self._active_name = self._active_name or DEFAULT_COLLECTION
+            self._active_checked_at = now
+        return self._active_name
+
+    def get_collection(self, name: str):
+        """
+        Returns a collection, creating it with the configured storage if it
+        does not exist.
+
+        Args:
+            name: The collection name.
+
+        Returns:
+            The Chroma collection.
+        """
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = self.client.get_or_create_collection(
+                    name=name, metadata=self._storage_metadata(configured_storage())
+                )
+            return self._collections[name]
+
+    def storage(self, collection) -> Dict[str, Any]:
+        """
+        Reads how a collection's vectors were produced and stored.
+
+        Collections created before this was recorded carry no metadata and
+        are treated as full-size `text-embedding-004` vectors.
+
+        Args:
+            collection: The Chroma collection.
+
+        Returns:
+            The embedding backend, model and dimensionality.
+        """
+        stored = collection.metadata or {}
+        legacy = embedding_identity("models/text-embedding-004")
+        return {
+            "embedding_backend": stored.get(
+                "embedding_backend", legacy["embedding_backend"]
+            ),
+            "embedding_model": stored.get("embedding_model", legacy["embedding_model"]),
+            "embedding_dimensionality": stored.get("embedding_dimensionality"),
+        }
+
+    def _storage_metadata(self, storage: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Builds the collection metadata describing how vectors are produced
+        and stored.
+
+        Args:
+            storage: The embedding backend, model and dimensionality.
+
+        Returns:
+            The metadata, without unset values which Chroma cannot store.
+        """
+        return {key: value for key, value in storage.items() if value is not None}
+
+    def _warn_if_outdated(self):
+        """
+        Warns when the active collection was built differently from what the
+        settings ask for, until a re-index applies them.
+        """
+        actual = self.storage(self.collection)
+        expected = configured_storage()
+        if actual != expected:
+            logging.warning(
+                f"Collection '{self.collection.name}' stores embeddings as "
+                f"{actual}, but the settings ask for {expected}. It is used as "
+                "is until a re-index into a new collection completes."
+            )
 
     def add_documents(
         self,
@@ -24,17 +168,23 @@ class VectorStoreRepository:
         documents: List[str],
         metadatas: List[Dict[str, Any]],
         embeddings: List[List[float]],
+        collection_name: Optional[str] = None,
     ):
         """
-        Adds documents to the vector store.
+        Adds documents to the vector store, replacing any with the same ids.
 
         Args:
             ids: A list of unique ids for the documents.
             documents: A list of document texts.
             metadatas: A list of metadata for the documents.
             embeddings: A list of embeddings for the documents.
+            collection_name: The collection to write to, defaults to the
+                active one as of now.
         """
-        self.collection.add(
+        collection = self.get_collection(
+            collection_name or self.active_collection_name(max_age_s=0)
+        )
+        collection.upsert(
             ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings
         )
 
@@ -54,7 +204,7 @@ class VectorStoreRepository:
         return self.collection.query(
             query_embeddings=query_embeddings,
             n_results=n_results,
-            include=["metadatas", "documents"],
+            include=["metadatas", "documents", "distances"],
         )
 
     def health_check(self) -> bool:
@@ -70,3 +220,13 @@ class VectorStoreRepository:
         except Exception as e:
             logging.error(f"Error checking vector store health: {e}")
             return False
+
+    def _client(self) -> redis.Redis:
+        """
+        Returns the Redis client, created on first use.
+        """
+        if self._redis is None:
+            self._redis = redis.Redis.from_url(
+                settings.REDIS_URL, socket_connect_timeout=1, socket_timeout=1
+            )
+        return self._redis
@@ -1,3 +1,36 @@
+from .chat_schemas import (
+    BatchChatRequest,
+    BatchChatResponse,
+    BatchChatResult,
+    ChatRequest,
+    ChatResponse,
+    Citation,
+    ContextReport,
+    SearchRequest,
+    SearchResponse,
+    SearchResult,
+)
+from .quota_schemas import QuotaBucket, QuotaResponse, QuotaState
+from .reindex_schemas import ReindexResponse, ReindexStatus
+from .task_schemas import TaskStatus
 from .upload_schemas import UploadResponse
 
-__all__ = ["UploadResponse"]
+__all__ = [
+    "BatchChatRequest",
+    "BatchChatResponse",
+    "BatchChatResult",
+    "ChatRequest",
+    "ChatResponse",
+    "Citation",
+    "ContextReport",
+    "QuotaBucket",
+    "QuotaResponse",
+    "QuotaState",
+    "ReindexResponse",
+    "ReindexStatus",
+    "SearchRequest",
+    "SearchResponse",
+    "SearchResult",
+    "TaskStatus",
+    "UploadResponse",
+]
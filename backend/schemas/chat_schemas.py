@@ -1,4 +1,5 @@
-from pydantic import BaseModel
+from typing import List, Optional, Tuple
+from pydantic import BaseModel, Field
 
 
 class ChatRequest(BaseModel):
@@ -7,6 +8,24 @@ class ChatRequest(BaseModel):
     """
 
     question: str
+    # Time the client is willing to wait, defaults to CHAT_DEADLINE_S
+    deadline_ms: Optional[int] = Field(None, gt=0)
+
+
+class ContextReport(BaseModel):
+    """
+    A Pydantic schema describing how the LLM context was assembled.
+    """
+
+    token_budget: int
+    context_tokens: int
+    prompt_tokens: int
+    candidates: int
+    included_chunk_ids: List[str]
+    spans: int
+    duplicate_chunk_ids: List[str]
+    truncated_chunk_ids: List[str]
+    dropped_chunk_ids: List[str]
 
 
 class ChatResponse(BaseModel):
@@ -15,3 +34,78 @@ class ChatResponse(BaseModel):
     """
 
     response: str
+    context: Optional[ContextReport] = None
+
+
+class Citation(BaseModel):
+    """
+    A Pydantic schema for a chunk cited in an answer's context.
+    """
+
+    source: str
+    chunk_id: str
+
+
+class BatchChatRequest(BaseModel):
+    """
+    A Pydantic schema for the batch chat request.
+    """
+
+    questions: List[str] = Field(..., min_length=1)
+    stream: bool = False
+
+
+class BatchChatResult(BaseModel):
+    """
+    A Pydantic schema for the answer to one question of a batch.
+    """
+
+    index: int
+    question: str
+    response: Optional[str] = None
+    citations: List[Citation] = []
+    context: Optional[ContextReport] = None
+    error: Optional[str] = None
+
+
+class BatchChatResponse(BaseModel):
+    """
+    A Pydantic schema for the batch chat response.
+    """
+
+    results: List[BatchChatResult]
+
+
+class SearchRequest(BaseModel):
+    """
+    A Pydantic schema for the retrieval-only search request.
+    """
+
+    query: str
+    top_k: int = Field(5, ge=1, le=20)
+    latency_budget_ms: Optional[float] = Field(None, gt=0)
+
+
+class SearchResult(BaseModel):
+    """
+    A Pydantic schema for one ranked chunk in a search response.
+    """
+
+    chunk_id: str
+    source: str
+    document_id: Optional[str] = None
+    chunk_index: Optional[int] = None
+    text: str
+    score: float
+    highlights: List[Tuple[int, int]] = []
+
+
+class SearchResponse(BaseModel):
+    """
+    A Pydantic schema for the retrieval-only search response.
+    """
+
+    query: str
+    results: List[SearchResult]
+    reranked: bool
+    took_ms: float
@@ -0,0 +1,33 @@
+from typing import List, Optional
+from pydantic import BaseModel
+
+
+class QuotaBucket(BaseModel):
+    """
+    A Pydantic schema for one token bucket of a Gemini quota.
+    """
+
+    unit: str
+    per_minute: int
+    available: Optional[float] = None
+
+
+class QuotaState(BaseModel):
+    """
+    A Pydantic schema for the state of a cluster-wide Gemini quota.
+    """
+
+    name: str
+    redis_available: bool
+    interactive_reserve: float
+    buckets: List[QuotaBucket]
+    waits: int
+    rejections: int
+
+
+class QuotaResponse(BaseModel):
+    """
+    A Pydantic schema for the quota state response.
+    """
+
+    quotas: List[QuotaState]
@@ -0,0 +1,30 @@
+from typing import Optional
+from pydantic import BaseModel
+
+
+class ReindexStatus(BaseModel):
+    """
+    A Pydantic schema for the progress of a re-index into a new collection.
+    """
+
+    source: str
+    target: str
+    status: str
+    running: bool
+    processed: int
+    total: int
+    chunks_per_second: Optional[float] = None
+    eta_seconds: Optional[float] = None
+    started_at: str
+    updated_at: str
+    completed_at: Optional[str] = None
+    error: Optional[str] = None
+
+
+class ReindexResponse(BaseModel):
+    """
+    A Pydantic schema for the response to starting a re-index.
+    """
+
+    task_id: str
+    migration: ReindexStatus
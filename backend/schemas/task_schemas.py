@@ -0,0 +1,27 @@
+from typing import Any, Dict, Optional
+from pydantic import BaseModel
+
+
+class TaskStatus(BaseModel):
+    """
+    A Pydantic schema for the status of an ingestion task.
+
+    The state is QUEUED, PROGRESS, SUCCESS or FAILURE, and the lane fast or
+    heavy. Chunk counts, throughput and the time remaining are known once the
+    document is split.
+    """
+
+    task_id: str
+    seq: int
+    state: str
+    lane: Optional[str] = None
+    estimated_cost_s: Optional[float] = None
+    stage: Optional[str] = None
+    message: Optional[str] = None
+    processed: Optional[int] = None
+    total: Optional[int] = None
+    chunks_per_second: Optional[float] = None
+    eta_seconds: Optional[float] = None
+    updated_at: str
+    error: Optional[str] = None
+    result: Optional[Dict[str, Any]] = None
@@ -1,8 +1,11 @@
 from pydantic import BaseModel
 
+
 class UploadResponse(BaseModel):
     """
     A Pydantic schema for the upload response.
     """
+
     task_id: str
     filename: str
+    lane: str
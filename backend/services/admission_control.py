@@ -0,0 +1,280 @@
+import heapq
+import itertools
+import math
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple
+from settings import settings
+from utils.metrics import (
+    ADMISSION_IN_FLIGHT,
+    ADMISSION_QUEUE_WAIT,
+    ADMISSION_REJECTIONS,
+)
+from .cancellation import check_cancelled, current_token, is_cancellable
+
+# Lower values are served first
+PRIORITIES = {"interactive": 0, "batch": 1}
+# Weight of the latest measurement in the per-call duration average
+DURATION_SMOOTHING = 0.2
+# How often a cancellable request waiting for a slot checks if it should stop
+CANCEL_POLL_INTERVAL_S = 0.1
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a request is shed instead of queued.
+
+    Attributes:
+        stage: The stage that rejected the request.
+        status_code: 429 when the stage's queue is full, 503 when the request
+            cannot get through the stage before its deadline.
+        retry_after: The suggested delay before retrying, in seconds.
+    """
+
+    def __init__(self, stage: str, status_code: int, retry_after: float, reason: str):
+        super().__init__(f"The {stage} stage is overloaded: {reason}")
+        self.stage = stage
+        self.status_code = status_code
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class StageLimiter:
+    """
+    Bounds the concurrent calls to one stage, with a bounded priority queue.
+
+    Waiters are served by priority, then arrival. A request is rejected
+    upfront if too many requests of its priority or higher are already
+    waiting, or if the expected wait means it cannot get through the stage
+    before its deadline.
+    """
+
+    def __init__(self, stage: str, max_concurrency: int, max_queue: int):
+        """
+        Initializes the StageLimiter.
+
+        Args:
+            stage: The stage name.
+            max_concurrency: The maximum number of concurrent calls.
+            max_queue: The maximum number of waiting calls.
+        """
+        self.stage = stage
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        # Moving average of the time a call holds its slot
+        self.seconds_per_call: Optional[float] = None
+        self._active = 0
+        self._waiting: List[Tuple[int, int]] = []
+        self._arrivals = itertools.count()
+        self._condition = threading.Condition()
+
+    def estimate_wait(self, ahead: int) -> Optional[float]:
+        """
+        Estimates how long a call waits for a slot.
+
+        Args:
+            ahead: The number of calls served before it.
+
+        Returns:
+            The estimated wait in seconds, or None before the first call.
+        """
+        if self.seconds_per_call is None:
+            return None
+        return (ahead // self.max_concurrency + 1) * self.seconds_per_call
+
+    @contextmanager
+    def slot(self, priority: str, deadline: Optional[float]) -> Iterator[None]:
+        """
+        Holds a slot of the stage for the duration of a call.
+
+        Args:
+            priority: The priority class of the request.
+            deadline: The `time.monotonic()` by which the request must finish.
+
+        Raises:
+            AdmissionRejected: If the request is shed.
+        """
+        self._acquire(priority, deadline)
+        ADMISSION_IN_FLIGHT.labels(self.stage).inc()
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            ADMISSION_IN_FLIGHT.labels(self.stage).dec()
+            self._release(time.monotonic() - start)
+
+    def _acquire(self, priority: str, deadline: Optional[float]):
+        """
+        Waits for a slot, or rejects the request.
+
+        Args:
+            priority: The priority class of the request.
+            deadline: The `time.monotonic()` by which the request must finish.
+
+        Raises:
+            AdmissionRejected: If the request is shed.
+            RequestCancelled: If the request is cancelled while waiting.
+        """
+        rank = PRIORITIES[priority]
+        start = time.monotonic()
+        with self._condition:
+            if self._active < self.max_concurrency and not self._waiting:
+                self._active += 1
+                ADMISSION_QUEUE_WAIT.labels(self.stage, priority).observe(0)
+                return
+
+            ahead = sum(1 for waiting_rank, _ in self._waiting if waiting_rank <= rank)
+            expected_wait = self.estimate_wait(ahead)
+            if ahead >= self.max_queue:
+                self._reject(priority, 429, expected_wait, "queue full")
+            if (
+                deadline is not None
+                and expected_wait is not None
+                and start + expected_wait + self.seconds_per_call > deadline
+            ):
+                self._reject(priority, 503, expected_wait, "deadline out of reach")
+
+            entry = (rank, next(self._arrivals))
+            heapq.heappush(self._waiting, entry)
+            try:
+                while self._waiting[0] != entry or self._active >= self.max_concurrency:
+                    timeout = None if deadline is None else deadline - time.monotonic()
+                    if timeout is not None and timeout <= 0:
+                        self._reject(
+                            priority,
+                            503,
+                            expected_wait or 1,
+                            "deadline passed in queue",
+                        )
+                    if is_cancellable():
+                        check_cancelled(self.stage)
+                        timeout = min(timeout or math.inf, CANCEL_POLL_INTERVAL_S)
+                    self._condition.wait(timeout)
+                self._active += 1
+            finally:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                # The next waiter may now be at the head of the queue
+                self._condition.notify_all()
+        ADMISSION_QUEUE_WAIT.labels(self.stage, priority).observe(
+            time.monotonic() - start
+        )
+
+    def _release(self, duration: float):
+        """
+        Frees a slot and records how long it was held.
+
+        Args:
+            duration: The seconds the slot was held.
+        """
+        with self._condition:
+            self._active -= 1
+            if self.seconds_per_call is None:
+                self.seconds_per_call = duration
+            else:
+                self.seconds_per_call += DURATION_SMOOTHING * (
+                    duration - self.seconds_per_call
+                )
+            self._condition.notify_all()
+
+    def _reject(
+        self, priority: str, status_code: int, retry_after: Optional[float], reason: str
+    ):
+        """
+        Counts and raises a rejection.
+
+        Raises:
+            AdmissionRejected: Always.
+        """
+        ADMISSION_REJECTIONS.labels(self.stage, priority, reason).inc()
+        raise AdmissionRejected(self.stage, status_code, retry_after or 1, reason)
+
+
+# Priority class and deadline of the current request
+_admission: ContextVar[Tuple[str, Optional[float]]] = ContextVar(
+    "admission", default=("batch", None)
+)
+_limiters: Dict[str, StageLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(stage: str) -> StageLimiter:
+    """
+    Returns the limiter of a stage, configured from the settings.
+
+    Args:
+        stage: "llm", "embedding" or "rerank".
+
+    Returns:
+        The process-wide limiter of the stage.
+    """
+    with _limiters_lock:
+        if stage not in _limiters:
+            limits = {
+                "llm": (settings.LLM_MAX_CONCURRENCY, settings.LLM_MAX_QUEUE),
+                "embedding": (
+                    settings.EMBEDDING_MAX_CONCURRENCY,
+                    settings.EMBEDDING_MAX_QUEUE,
+                ),
+                "rerank": (settings.RERANK_MAX_CONCURRENCY, settings.RERANK_MAX_QUEUE),
+            }
+            _limiters[stage] = StageLimiter(stage, *limits[stage])
+        return _limiters[stage]
+
+
+@contextmanager
+def admission(priority: str, timeout_s: Optional[float] = None) -> Iterator[None]:
+    """
+    Sets the priority class and deadline of the current request.
+
+    The context is inherited by the threads the request hands work to.
+
+    Args:
+        priority: A key of `PRIORITIES`.
+        timeout_s: The time the request has to finish, if limited.
+    """
+    deadline = None if timeout_s is None else time.monotonic() + timeout_s
+    token = _admission.set((priority, deadline))
+    try:
+        yield
+    finally:
+        _admission.reset(token)
+
+
+def current_admission() -> Tuple[str, Optional[float]]:
+    """
+    Returns the priority class and deadline of the current request.
+
+    A cancellable execution has the deadline of its token, which a shared
+    execution pushes back as callers with later deadlines join it.
+
+    Returns:
+        The priority class and the `time.monotonic()` deadline, if any.
+    """
+    priority, deadline = _admission.get()
+    token = current_token()
+    if token is not None:
+        deadline = token.deadline
+    return priority, deadline
+
+
+@contextmanager
+def stage_slot(stage: str) -> Iterator[None]:
+    """
+    Holds a slot of a stage for the current request.
+
+    Calls made outside of `admission`, such as ingestion in the worker, run
+    as batch traffic without a deadline.
+
+    Args:
+        stage: "llm", "embedding" or "rerank".
+
+    Raises:
+        AdmissionRejected: If the request is shed.
+        RequestCancelled: If the request is cancelled before it gets a slot.
+    """
+    check_cancelled(stage)
+    priority, deadline = current_admission()
+    with get_limiter(stage).slot(priority, deadline):
+        yield
@@ -0,0 +1,180 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+
+class RequestCancelled(Exception):
+    """
+    Raised inside a pipeline whose result is no longer wanted.
+
+    Attributes:
+        reason: "disconnect" when every client waiting for the result left,
+            "deadline" when the request ran out of time.
+        stage: Where the cancellation was noticed.
+    """
+
+    def __init__(self, reason: str, stage: str):
+        super().__init__(f"Request cancelled ({reason}) at {stage}")
+        self.reason = reason
+        self.stage = stage
+
+
+class CancellationToken:
+    """
+    Lets the event loop stop a pipeline running in worker threads.
+
+    Cancellation is cooperative: the pipeline checks the token between
+    stages, while it waits for a slot or for quota, and while it streams the
+    LLM answer.
+    """
+
+    def __init__(self, deadline: Optional[float] = None):
+        """
+        Initializes the CancellationToken.
+
+        Args:
+            deadline: The `time.monotonic()` after which the result is no
+                longer wanted, if any.
+        """
+        self.deadline = deadline
+        self.reason: Optional[str] = None
+        self._event = threading.Event()
+
+    def extend(self, deadline: Optional[float]):
+        """
+        Pushes the deadline back, for a caller that can wait longer.
+
+        Args:
+            deadline: The caller's `time.monotonic()` deadline, None if it
+                has none.
+        """
+        if self.deadline is not None and (deadline is None or deadline > self.deadline):
+            self.deadline = deadline
+
+    def cancel(self, reason: str):
+        """
+        Requests the pipeline to stop.
+
+        Args:
+            reason: Why the result is no longer wanted.
+        """
+        if self.reason is None:
+            self.reason = reason
+        self._event.set()
+
+    def check(self, stage: str):
+        """
+        Stops the execution if its result is no longer wanted.
+
+        Args:
+            stage: The stage about to run or running.
+
+        Raises:
+            RequestCancelled: If the token was cancelled or the deadline
+                passed.
+        """
+        if (
+            not self.cancelled
+            and self.deadline is not None
+            and time.monotonic() > self.deadline
+        ):
+            self.cancel("deadline")
+        if self.cancelled:
+            raise RequestCancelled(self.reason, stage)
+
+    @property
+    def cancelled(self) -> bool:
+        """
+        Whether the pipeline was asked to stop.
+        """
+        return self._event.is_set()
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Waits until the token is cancelled or the timeout passes.
+
+        Args:
+            timeout: The maximum wait in seconds.
+
+        Returns:
+            True if the token was cancelled.
+        """
+        return self._event.wait(timeout)
+
+
+# Token of the pipeline execution running in this context, if cancellable
+_token: ContextVar[Optional[CancellationToken]] = ContextVar("token", default=None)
+
+
+@contextmanager
+def cancellable(token: CancellationToken) -> Iterator[CancellationToken]:
+    """
+    Makes the work started in this context, including the threads it hands
+    work to, stop when the token is cancelled or the deadline passes.
+
+    Args:
+        token: The token of the execution.
+
+    Yields:
+        The token.
+    """
+    reset = _token.set(token)
+    try:
+        yield token
+    finally:
+        _token.reset(reset)
+
+
+def check_cancelled(stage: str):
+    """
+    Stops the current execution if its result is no longer wanted.
+
+    Work outside `cancellable`, such as batch requests and ingestion, is
+    never stopped.
+
+    Args:
+        stage: The stage about to run or running.
+
+    Raises:
+        RequestCancelled: If the token was cancelled or the deadline passed.
+    """
+    token = _token.get()
+    if token is not None:
+        token.check(stage)
+
+
+def is_cancellable() -> bool:
+    """
+    Whether the current execution can be cancelled.
+    """
+    return _token.get() is not None
+
+
+def current_token() -> Optional[CancellationToken]:
+    """
+    Returns the token of the current execution, if cancellable.
+    """
+    return _token.get()
+
+
+def sleep(seconds: float, stage: str):
+    """
+    Sleeps, waking up early to stop if the execution is cancelled.
+
+    Args:
+        seconds: The time to sleep.
+        stage: The stage that is waiting.
+
+    Raises:
+        RequestCancelled: If the execution is cancelled before the end.
+    """
+    token = _token.get()
+    if token is None:
+        time.sleep(seconds)
+        return
+    if token.deadline is not None:
+        seconds = min(seconds, max(0.0, token.deadline - time.monotonic()))
+    token.wait(seconds)
+    check_cancelled(stage)
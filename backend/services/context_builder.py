@@ -0,0 +1,296 @@
+import math
+import re
+from typing import Any, Dict, List, Optional, Set, Tuple, TypedDict
+from schemas.chat_schemas import ContextReport
+from settings import settings
+
+# Rough characters-per-token ratio for Gemini models on English text
+CHARS_PER_TOKEN = 4
+# A chunk is only truncated into the context if this many tokens still fit
+MIN_TRUNCATED_TOKENS = 64
+# Shortest and longest overlap removed when two adjacent chunks are merged
+MIN_OVERLAP_CHARS = 20
+MAX_OVERLAP_CHARS = 1000
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimates the number of LLM tokens in a text.
+
+    Args:
+        text: The text to measure.
+
+    Returns:
+        The estimated token count.
+    """
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+class ContextChunk(TypedDict):
+    """
+    A retrieved chunk considered for the LLM context.
+
+    Attributes:
+        chunk_id: The chunk id in the vector store.
+        source: The source document path.
+        document_id: The id of the document the chunk belongs to.
+        chunk_index: The position of the chunk in its document, if known.
+        text: The chunk text.
+        score: The reranker score, higher is better.
+    """
+
+    chunk_id: str
+    source: str
+    document_id: str
+    chunk_index: Optional[int]
+    text: str
+    score: float
+
+
+class ContextBuilder:
+    """
+    Assembles the LLM context from reranked chunks within a token budget.
+    """
+
+    def __init__(
+        self,
+        token_budget: Optional[int] = None,
+        duplicate_threshold: Optional[float] = None,
+    ):
+        """
+        Initializes the ContextBuilder.
+
+        Args:
+            token_budget: The maximum number of context tokens.
+            duplicate_threshold: The shingle similarity above which two chunks
+                are considered near-duplicates.
+        """
+        self.token_budget = token_budget or settings.CONTEXT_TOKEN_BUDGET
+        self.duplicate_threshold = (
+            duplicate_threshold or settings.CONTEXT_DUPLICATE_THRESHOLD
+        )
+
+    def build(
+        self, retrieved_docs: Dict[str, Any], prompt_overhead_tokens: int = 0
+    ) -> Tuple[str, ContextReport]:
+        """
+        Builds the context for the LLM prompt.
+
+        Chunks are taken in reranker score order, near-duplicates are skipped,
+        and chunks are added while the rendered context fits the budget.
+        Consecutive chunks of the same document are merged into one span.
+
+        Args:
+            retrieved_docs: The reranked documents from the vector store.
+            prompt_overhead_tokens: The tokens the prompt uses besides the
+                context, added to the reported prompt size.
+
+        Returns:
+            A tuple of the context string and a report of the decisions made.
+        """
+        candidates = sorted(
+            self._to_chunks(retrieved_docs), key=lambda c: c["score"], reverse=True
+        )
+        selected: List[ContextChunk] = []
+        shingles: List[Set[str]] = []
+        duplicates, truncated, dropped = [], [], []
+
+        for chunk in candidates:
+            chunk_shingles = self._shingles(chunk["text"])
+            if any(
+                self._similarity(chunk_shingles, kept) >= self.duplicate_threshold
+                for kept in shingles
+            ):
+                duplicates.append(chunk["chunk_id"])
+                continue
+
+            if estimate_tokens(self._render(selected + [chunk])) <= self.token_budget:
+                selected.append(chunk)
+                shingles.append(chunk_shingles)
+                continue
+
+            shortened = self._truncate(selected, chunk)
+            if shortened is not None:
+                selected.append(shortened)
+                shingles.append(chunk_shingles)
+                truncated.append(chunk["chunk_id"])
+            else:
+                dropped.append(chunk["chunk_id"])
+
+        context = self._render(selected)
+        report = ContextReport(
+            token_budget=self.token_budget,
+            context_tokens=estimate_tokens(context),
+            prompt_tokens=estimate_tokens(context) + prompt_overhead_tokens,
+            candidates=len(candidates),
+            included_chunk_ids=[chunk["chunk_id"] for chunk in selected],
+            spans=len(self._spans(selected)),
+            duplicate_chunk_ids=duplicates,
+            truncated_chunk_ids=truncated,
+            dropped_chunk_ids=dropped,
+        )
+        return context, report
+
+    def _to_chunks(self, retrieved_docs: Dict[str, Any]) -> List[ContextChunk]:
+        """
+        Converts Chroma-style results into context chunks.
+
+        Args:
+            retrieved_docs: The reranked documents from the vector store.
+
+        Returns:
+            A list of context chunks. Without reranker scores, the input order
+            is used as the score.
+        """
+        if not retrieved_docs.get("ids") or not retrieved_docs["ids"][0]:
+            return []
+        ids = retrieved_docs["ids"][0]
+        scores = (retrieved_docs.get("scores") or [None])[0] or [
+            float(-rank) for rank in range(len(ids))
+        ]
+        chunks = []
+        for i, chunk_id in enumerate(ids):
+            metadata = retrieved_docs["metadatas"][0][i] or {}
+            source = metadata.get("source", "unknown")
+            chunks.append(
+                ContextChunk(
+                    chunk_id=chunk_id,
+                    source=source,
+                    document_id=metadata.get("document_id", source),
+                    chunk_index=metadata.get("chunk_index"),
+                    text=retrieved_docs["documents"][0][i],
+                    score=float(scores[i]),
+                )
+            )
+        return chunks
+
+    def _truncate(
+        self, selected: List[ContextChunk], chunk: ContextChunk
+    ) -> Optional[ContextChunk]:
+        """
+        Shortens a chunk to the space left in the budget.
+
+        Args:
+            selected: The chunks already in the context.
+            chunk: The chunk that does not fit.
+
+        Returns:
+            The shortened chunk, or None if too little space is left.
+        """
+        empty = {**chunk, "text": ""}
+        remaining = self.token_budget - estimate_tokens(
+            self._render(selected + [empty])
+        )
+        if remaining < MIN_TRUNCATED_TOKENS:
+            return None
+        text = chunk["text"][: remaining * CHARS_PER_TOKEN]
+        # Cut back to the last full word
+        if " " in text:
+            text = text[: text.rfind(" ")]
+        return {**chunk, "text": text}
+
+    def _spans(self, chunks: List[ContextChunk]) -> List[List[ContextChunk]]:
+        """
+        Groups consecutive chunks of the same document into spans.
+
+        Args:
+            chunks: The selected chunks, best first.
+
+        Returns:
+            The spans, ordered by their best chunk.
+        """
+        ordered = sorted(
+            chunks,
+            key=lambda c: (
+                c["document_id"],
+                c["chunk_index"] if c["chunk_index"] is not None else -1,
+            ),
+        )
+        spans: List[List[ContextChunk]] = []
+        for chunk in ordered:
+            previous = spans[-1][-1] if spans else None
+            if (
+                previous is not None
+                and previous["document_id"] == chunk["document_id"]
+                and previous["chunk_index"] is not None
+                and chunk["chunk_index"] == previous["chunk_index"] + 1
+            ):
+                spans[-1].append(chunk)
+            else:
+                spans.append([chunk])
+        return sorted(
+            spans, key=lambda span: max(c["score"] for c in span), reverse=True
+        )
+
+    def _render(self, chunks: List[ContextChunk]) -> str:
+        """
+        Renders chunks into the context format expected by the system prompt.
+
+        Args:
+            chunks: The chunks to render.
+
+        Returns:
+            The context string.
+        """
+        context = ""
+        for span in self._spans(chunks):
+            chunk_ids = ", ".join(chunk["chunk_id"] for chunk in span)
+            text = span[0]["text"]
+            for chunk in span[1:]:
+                text = self._join(text, chunk["text"])
+            context += (
+                f"[Source: {span[0]['source']}, chunk_id: {chunk_ids}]\n{text}\n\n"
+            )
+        return context
+
+    def _join(self, left: str, right: str) -> str:
+        """
+        Joins two adjacent chunks, dropping the text they share.
+
+        Args:
+            left: The earlier chunk text.
+            right: The following chunk text.
+
+        Returns:
+            The joined text.
+        """
+        longest = min(len(left), len(right), MAX_OVERLAP_CHARS)
+        for size in range(longest, MIN_OVERLAP_CHARS - 1, -1):
+            if left.endswith(right[:size]):
+                return left + right[size:]
+        # Adjacent chunks often repeat the section heading as their first line
+        first_line, _, rest = right.partition("\n")
+        if rest and first_line.strip() and first_line.strip() in left:
+            right = rest
+        return f"{left}\n{right}"
+
+    def _shingles(self, text: str, size: int = 3) -> Set[str]:
+        """
+        Splits a text into overlapping word n-grams.
+
+        Args:
+            text: The text to split.
+            size: The number of words per shingle.
+
+        Returns:
+            The set of shingles.
+        """
+        words = re.findall(r"\w+", text.lower())
+        if len(words) < size:
+            return {" ".join(words)} if words else set()
+        return {" ".join(words[i : i + size]) for i in range(len(words) - size + 1)}
+
+    def _similarity(self, left: Set[str], right: Set[str]) -> float:
+        """
+        Computes the Jaccard similarity of two shingle sets.
+
+        Args:
+            left: The first shingle set.
+            right: The second shingle set.
+
+        Returns:
+            The similarity between 0 and 1.
+        """
+        if not left or not right:
+            return 0.0
+        return len(left & right) / len(left | right)
@@ -4,6 +4,7 @@ from typing import List
 from docling_core.types.doc import DoclingDocument
 from docling.document_converter import DocumentConverter
 from docling.chunking import HybridChunker
+from utils.metrics import ingest_stage
 
 
 class DocumentService:
@@ -30,7 +31,8 @@ class DocumentService:
         # supported_extensions = [".pdf", ".docx", ".md", ".txt"]
         for file_path in file_paths:
             try:
-                result = self.converter.convert(file_path)
+                with ingest_stage("conversion"):
+                    result = self.converter.convert(file_path)
                 documents.append(result.document)
             except Exception as e:
                 logging.error(f"Error loading document {file_path}: {e}")
@@ -38,7 +40,9 @@ class DocumentService:
         chunked_documents = []
         for doc in documents:
             try:
-                chunks = self.chunker.chunk(doc)
+                with ingest_stage("chunking"):
+                    # chunk() is lazy, so materialize it inside the timed stage
+                    chunks = list(self.chunker.chunk(doc))
                 chunked_documents.extend(chunks)
             except Exception as e:
                 logging.error(f"Error chunking document: {e}")
@@ -0,0 +1,365 @@
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+import google.generativeai as genai
+from settings import settings
+from utils.embedding_models import resolve_embedding_backend
+from utils.metrics import record_cache
+from utils.quantization import truncate_and_normalize
+from .admission_control import AdmissionRejected, stage_slot
+from .cancellation import RequestCancelled
+from .context_builder import estimate_tokens
+from .quota_limiter import get_quota_limiter
+
+
+class EmbeddingBackend:
+    """
+    Base class for the backends that turn texts into embeddings.
+
+    Backends hold a slot of the "embedding" admission stage around each
+    model call.
+    """
+
+    name = "base"
+
+    def __init__(self, model_name: str, dimensionality: Optional[int] = None):
+        """
+        Initializes the EmbeddingBackend.
+
+        Args:
+            model_name: The embedding model name.
+            dimensionality: The reduced embedding size, None for the full size.
+        """
+        self.model_name = model_name
+        self.dimensionality = dimensionality
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Generates embeddings for document chunks.
+
+        Args:
+            texts: A list of texts to embed.
+
+        Returns:
+            A list of embeddings.
+        """
+        raise NotImplementedError
+
+    def embed_query(self, query: str) -> List[float]:
+        """
+        Generates an embedding for a single query.
+
+        Args:
+            query: The query to embed.
+
+        Returns:
+            The embedding for the query.
+        """
+        raise NotImplementedError
+
+    def embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """
+        Generates embeddings for several queries.
+
+        Args:
+            queries: The queries to embed.
+
+        Returns:
+            A list of embeddings, one per query.
+        """
+        return [self.embed_query(query) for query in queries]
+
+    def _normalize(self, embeddings: List[List[float]]) -> List[List[float]]:
+        """
+        Re-normalizes reduced-dimension embeddings to unit length.
+
+        Args:
+            embeddings: A list of embeddings returned by the model.
+
+        Returns:
+            The embeddings, truncated and normalized when a reduced
+            dimensionality is set.
+        """
+        if self.dimensionality is None or len(embeddings) == 0:
+            return embeddings
+        return truncate_and_normalize(embeddings, self.dimensionality).tolist()
+
+
+class GeminiEmbeddingBackend(EmbeddingBackend):
+    """
+    An embedding backend that calls the Gemini embedding API.
+    """
+
+    name = "gemini"
+
+    def __init__(self, model_name: str, dimensionality: Optional[int] = None):
+        """
+        Initializes the GeminiEmbeddingBackend.
+
+        Args:
+            model_name: The Gemini embedding model name.
+            dimensionality: The reduced embedding size, None for the full size.
+        """
+        super().__init__(model_name, dimensionality)
+        genai.configure(api_key=settings.GOOGLE_AI_API_KEY)
+        self.quota = get_quota_limiter("embedding")
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Generates embeddings for document chunks in batches of 100.
+
+        Args:
+            texts: A list of texts to embed.
+
+        Returns:
+            A list of embeddings.
+        """
+        embeddings = []
+        batch_size = 100
+        for i in range(0, len(texts), batch_size):
+            batch = texts[i : i + batch_size]
+            try:
+                result = self._embed_batch_with_retry(batch)
+                embeddings.extend(result)
+            except (AdmissionRejected, RequestCancelled):
+                raise
+            except Exception as e:
+                logging.error(f"Error generating embedding for batch: {e}")
+            if not self.quota.enabled:
+                time.sleep(1)  # Wait for 1 second between batches
+        return embeddings
+
+    def _embed_batch_with_retry(
+        self, batch: List[str], max_retries=5, initial_delay=1
+    ) -> List[List[float]]:
+        """
+        Embeds a batch of texts with retry logic.
+
+        Args:
+            batch: A list of texts to embed.
+            max_retries: The maximum number of retries.
+            initial_delay: The initial delay between retries.
+
+        Returns:
+            A list of embeddings.
+        """
+        delay = initial_delay
+        for i in range(max_retries):
+            try:
+                self._acquire_quota(batch)
+                with stage_slot("embedding"):
+                    result = genai.embed_content(
+                        model=self.model_name,
+                        content=batch,
+                        task_type="retrieval_document",
+                        output_dimensionality=self.dimensionality,
+                    )
+                return self._normalize(result["embedding"])
+            except Exception as e:
+                if "Rate limit exceeded" in str(e) and i < max_retries - 1:
+                    logging.info(f"Rate limit exceeded. Retrying in {delay} seconds...")
+                    time.sleep(delay)
+                    delay *= 2  # Exponential backoff
+                else:
+                    raise e
+        return []  # Return an empty list if all retries fail
+
+    def _acquire_quota(self, texts: List[str]):
+        """
+        Takes one request and the texts' tokens from the shared quota. Called
+        before taking the "embedding" slot, so waiting on the quota does not
+        hold a slot.
+
+        Args:
+            texts: The texts of the next API call.
+        """
+        self.quota.acquire(sum(estimate_tokens(text) for text in texts))
+
+    def embed_query(self, query: str) -> List[float]:
+        """
+        Generates an embedding for a single query.
+
+        Args:
+            query: The query to embed.
+
+        Returns:
+            The embedding for the query.
+        """
+        self._acquire_quota([query])
+        with stage_slot("embedding"):
+            result = genai.embed_content(
+                model=self.model_name,
+                content=query,
+                task_type="retrieval_query",
+                output_dimensionality=self.dimensionality,
+            )
+        return self._normalize([result["embedding"]])[0]
+
+    def embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """
+        Generates embeddings for several queries, 100 per API call.
+
+        Args:
+            queries: The queries to embed.
+
+        Returns:
+            A list of embeddings, one per query.
+        """
+        embeddings = []
+        batch_size = 100
+        for i in range(0, len(queries), batch_size):
+            self._acquire_quota(queries[i : i + batch_size])
+            with stage_slot("embedding"):
+                result = genai.embed_content(
+                    model=self.model_name,
+                    content=queries[i : i + batch_size],
+                    task_type="retrieval_query",
+                    output_dimensionality=self.dimensionality,
+                )
+            embeddings.extend(self._normalize(result["embedding"]))
+        return embeddings
+
+
+class SentenceTransformerEmbeddingBackend(EmbeddingBackend):
+    """
+    An embedding backend that runs a sentence-transformers model on the CPU.
+    """
+
+    name = "sentence-transformers"
+
+    def __init__(
+        self,
+        model_name: str,
+        dimensionality: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        num_threads: Optional[int] = None,
+        use_onnx: Optional[bool] = None,
+    ):
+        """
+        Initializes the SentenceTransformerEmbeddingBackend.
+
+        The ONNX runtime requires the `optimum[onnxruntime]` package.
+
+        Args:
+            model_name: The sentence-transformers model name or path.
+            dimensionality: The reduced embedding size, None for the full size.
+            batch_size: The number of texts encoded per forward pass.
+            num_threads: The number of CPU threads used by torch.
+            use_onnx: Whether to run the model with the ONNX runtime.
+        """
+        # Imported lazily so Gemini-only deployments don't load torch
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        super().__init__(model_name, dimensionality)
+        self.batch_size = batch_size or settings.EMBEDDING_BATCH_SIZE
+        num_threads = num_threads or settings.EMBEDDING_NUM_THREADS
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        use_onnx = settings.EMBEDDING_ONNX if use_onnx is None else use_onnx
+        self.model = SentenceTransformer(
+            model_name, device="cpu", backend="onnx" if use_onnx else "torch"
+        )
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Generates embeddings for document chunks.
+
+        Texts are sorted by length before batching so each batch pads to a
+        similar length, then the embeddings are returned in input order.
+
+        Args:
+            texts: A list of texts to embed.
+
+        Returns:
+            A list of embeddings.
+        """
+        if not texts:
+            return []
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+        embeddings: List[List[float]] = [[] for _ in texts]
+        for start in range(0, len(order), self.batch_size):
+            batch_indices = order[start : start + self.batch_size]
+            vectors = self._encode([texts[i] for i in batch_indices])
+            for i, vector in zip(batch_indices, vectors):
+                embeddings[i] = vector
+        return embeddings
+
+    def embed_query(self, query: str) -> List[float]:
+        """
+        Generates an embedding for a single query.
+
+        Args:
+            query: The query to embed.
+
+        Returns:
+            The embedding for the query.
+        """
+        return self._encode([query])[0]
+
+    def embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """
+        Generates embeddings for several queries in length-sorted batches.
+
+        Args:
+            queries: The queries to embed.
+
+        Returns:
+            A list of embeddings, one per query.
+        """
+        return self.embed_documents(queries)
+
+    def _encode(self, texts: List[str]) -> List[List[float]]:
+        """
+        Encodes one batch of texts into unit-length embeddings.
+
+        Args:
+            texts: A list of texts to encode.
+
+        Returns:
+            A list of embeddings.
+        """
+        with stage_slot("embedding"):
+            vectors = self.model.encode(
+                texts,
+                batch_size=self.batch_size,
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+            )
+        return self._normalize(vectors.tolist())
+
+
+# Local models are expensive to load, so backends are shared per process
+_backends: Dict[Tuple[str, Optional[int]], EmbeddingBackend] = {}
+_backends_lock = threading.Lock()
+
+
+def create_embedding_backend(
+    model_name: Optional[str] = None, dimensionality: Optional[int] = None
+) -> EmbeddingBackend:
+    """
+    Returns the embedding backend serving the given model.
+
+    Args:
+        model_name: The embedding model name. Defaults to the configured model
+            and dimensionality.
+        dimensionality: The reduced embedding size, None for the full size.
+
+    Returns:
+        The embedding backend, created on first use.
+    """
+    if model_name is None:
+        model_name = settings.EMBEDDING_MODEL
+        dimensionality = settings.EMBEDDING_DIMENSIONALITY
+    key = (model_name, dimensionality)
+    with _backends_lock:
+        record_cache("embedding_backend", key in _backends)
+        if key not in _backends:
+            if resolve_embedding_backend(model_name) == GeminiEmbeddingBackend.name:
+                _backends[key] = GeminiEmbeddingBackend(model_name, dimensionality)
+            else:
+                _backends[key] = SentenceTransformerEmbeddingBackend(
+                    model_name, dimensionality
+                )
+        return _backends[key]
@@ -1,8 +1,9 @@
 import logging
-import time
-from typing import List
-import google.generativeai as genai
+from typing import Callable, Dict, List, Optional
 from settings import settings
+from .admission_control import AdmissionRejected
+from .cancellation import RequestCancelled
+from .embedding_backends import EmbeddingBackend, create_embedding_backend
 
 
 class EmbeddingService:
@@ -10,65 +11,58 @@ class EmbeddingService:
     A service for generating embeddings for text chunks.
     """
 
-    def __init__(self):
+    def __init__(
+        self, model_name: Optional[str] = None, dimensionality: Optional[int] = None
+    ):
         """
         Initializes the EmbeddingService.
-        """
-        genai.configure(api_key=settings.GOOGLE_AI_API_KEY)
-
-    def generate_embeddings(self, texts: List[str]) -> List[List[float]]:
-        """
-        Generates embeddings for the given texts.
 
         Args:
-            texts: A list of texts to embed.
+            model_name: The embedding model name. Defaults to the configured
+                model and dimensionality.
+            dimensionality: The reduced embedding size, None for the full size.
+        """
+        self.backend: EmbeddingBackend = create_embedding_backend(
+            model_name, dimensionality
+        )
 
-        Returns:
-            A list of embeddings.
+    @property
+    def identity(self) -> Dict[str, str]:
         """
-        embeddings = []
-        batch_size = 100
-        for i in range(0, len(texts), batch_size):
-            batch = texts[i : i + batch_size]
-            try:
-                result = self._embed_batch_with_retry(batch)
-                embeddings.extend(result)
-            except Exception as e:
-                logging.error(f"Error generating embedding for batch: {e}")
-            time.sleep(1)  # Wait for 1 second between batches
-        return embeddings
+        The backend and model producing this service's embeddings.
+        """
+        return {
+            "embedding_backend": self.backend.name,
+            "embedding_model": self.backend.model_name,
+        }
 
-    def _embed_batch_with_retry(
-        self, batch: List[str], max_retries=5, initial_delay=1
+    def generate_embeddings(
+        self,
+        texts: List[str],
+        on_progress: Optional[Callable[[int], None]] = None,
     ) -> List[List[float]]:
         """
-        Embeds a batch of texts with retry logic.
+        Generates embeddings for the given texts.
 
         Args:
-            batch: A list of texts to embed.
-            max_retries: The maximum number of retries.
-            initial_delay: The initial delay between retries.
+            texts: A list of texts to embed.
+            on_progress: Called with the number of texts embedded so far
+                after every `INGEST_PROGRESS_BATCH_SIZE` texts.
 
         Returns:
             A list of embeddings.
         """
-        delay = initial_delay
-        for i in range(max_retries):
-            try:
-                result = genai.embed_content(
-                    model=settings.EMBEDDING_MODEL,
-                    content=batch,
-                    task_type="retrieval_document",
-                )
-                return result["embedding"]
-            except Exception as e:
-                if "Rate limit exceeded" in str(e) and i < max_retries - 1:
-                    logging.info(f"Rate limit exceeded. Retrying in {delay} seconds...")
-                    time.sleep(delay)
-                    delay *= 2  # Exponential backoff
-                else:
-                    raise e
-        return []  # Return an empty list if all retries fail
+        if on_progress is None:
+            return self.backend.embed_documents(texts)
+
+        embeddings: List[List[float]] = []
+        batch_size = settings.INGEST_PROGRESS_BATCH_SIZE
+        for start in range(0, len(texts), batch_size):
+            embeddings.extend(
+                self.backend.embed_documents(texts[start : start + batch_size])
+            )
+            on_progress(len(embeddings))
+        return embeddings
 
     def embed_query(self, query: str) -> List[float]:
         """
@@ -81,12 +75,22 @@ class EmbeddingService:
             The embedding for the query.
         """
         try:
-            result = genai.embed_content(
-                model=settings.EMBEDDING_MODEL,
-                content=query,
-                task_type="retrieval_query",
-            )
-            return result["embedding"]
+            return self.backend.embed_query(query)
+        except (AdmissionRejected, RequestCancelled):
+            # Answered as 429/503 or 499/504, not as a failed search
+            raise
         except Exception as e:
             logging.error(f"Error generating embedding for query: {e}")
             return []
+
+    def embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """
+        Generates embeddings for several queries in as few calls as possible.
+
+        Args:
+            queries: The queries to embed.
+
+        Returns:
+            A list of embeddings, one per query.
+        """
+        return self.backend.embed_queries(queries)
@@ -1,7 +1,14 @@
-from typing import Dict, Any
+from typing import Any, List, Union
+from langchain_core.messages import AIMessageChunk, BaseMessage
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnableLambda
 from langchain_google_genai import ChatGoogleGenerativeAI
 from settings import settings
+from utils.metrics import LLM_TOKENS_AVOIDED, record_llm_usage
+from .admission_control import stage_slot
+from .cancellation import RequestCancelled, check_cancelled, is_cancellable
+from .context_builder import estimate_tokens
+from .quota_limiter import get_quota_limiter
 
 
 class GenerationService:
@@ -24,32 +31,108 @@ class GenerationService:
             temperature=settings.TEMPERATURE,
             api_key=settings.GOOGLE_AI_API_KEY,
         )
+        # Every LLM call holds a slot of the "llm" admission stage
+        self.limited_llm = RunnableLambda(self._call_llm)
         self.prompt_template = ChatPromptTemplate.from_template(self.system_prompt)
         self.hyde_prompt_template = ChatPromptTemplate.from_template(self.hyde_prompt)
 
-    def generate_response(self, retrieved_docs: Dict[str, Any], question: str) -> str:
+    def _call_llm(self, prompt: Any) -> BaseMessage:
+        """
+        Calls the LLM within the admission limits of the current request.
+
+        Cancellable requests stream the response, so generation stops as soon
+        as the request is cancelled.
+
+        Args:
+            prompt: The formatted prompt.
+
+        Returns:
+            The LLM response.
+
+        Raises:
+            RequestCancelled: If the request is cancelled.
+        """
+        quota = get_quota_limiter("llm")
+        estimated = (
+            estimate_tokens(prompt.to_string()) + settings.LLM_OUTPUT_TOKENS_ESTIMATE
+        )
+        # Waits for the quota before taking a slot, so a request waiting on
+        # the quota does not keep others from the slots
+        quota.acquire(estimated)
+        with stage_slot("llm"):
+            if is_cancellable():
+                response = self._stream_llm(prompt)
+            else:
+                response = self.llm.invoke(prompt)
+        usage = getattr(response, "usage_metadata", None) or {}
+        if usage.get("total_tokens"):
+            quota.settle(estimated, usage["total_tokens"])
+        return response
+
+    def _stream_llm(self, prompt: Any) -> BaseMessage:
+        """
+        Streams the LLM response, checking for cancellation between chunks.
+
+        Args:
+            prompt: The formatted prompt.
+
+        Returns:
+            The LLM response, merged from its chunks.
+
+        Raises:
+            RequestCancelled: If the request is cancelled, after closing the
+                stream.
+        """
+        check_cancelled("llm_stream")
+        response = None
+        chunks = self.llm.stream(prompt)
+        try:
+            for chunk in chunks:
+                response = chunk if response is None else response + chunk
+                try:
+                    check_cancelled("llm_stream")
+                except RequestCancelled:
+                    generated = estimate_tokens(str(response.content))
+                    LLM_TOKENS_AVOIDED.inc(
+                        max(0, settings.LLM_OUTPUT_TOKENS_ESTIMATE - generated)
+                    )
+                    raise
+        finally:
+            # Ends the HTTP stream, and the generation with it
+            chunks.close()
+        return response if response is not None else AIMessageChunk(content="")
+
+    def generate_response(self, context: str, question: str) -> str:
         """
         Generates a response to the user's question based on the provided context.
 
         Args:
-            retrieved_docs: The retrieved documents from the vector store.
+            context: The context assembled from the retrieved documents.
             question: The user's question.
 
         Returns:
             The generated response.
         """
-
-        context = ""
-        for i in range(len(retrieved_docs["ids"][0])):
-            source = retrieved_docs["metadatas"][0][i]["source"]
-            chunk_id = retrieved_docs["ids"][0][i]
-            text = retrieved_docs["documents"][0][i]
-            context += f"[Source: {source}, chunk_id: {chunk_id}]\n{text}\n\n"
-
-        chain = self.prompt_template | self.llm
+        chain = self.prompt_template | self.limited_llm
         response = chain.invoke({"context": context, "question": question})
+        record_llm_usage("answer", response)
         return response.content
 
+    def estimate_prompt_tokens(self, context: str, question: str) -> int:
+        """
+        Estimates the size of the final prompt sent to the LLM.
+
+        Args:
+            context: The context assembled from the retrieved documents.
+            question: The user's question.
+
+        Returns:
+            The estimated number of prompt tokens.
+        """
+        return estimate_tokens(
+            self.prompt_template.format(context=context, question=question)
+        )
+
     def generate_hypothetical_document(self, question: str) -> str:
         """
         Generates a hypothetical document to answer the user's question.
@@ -60,6 +143,76 @@ class GenerationService:
         Returns:
             The generated hypothetical document.
         """
-        chain = self.hyde_prompt_template | self.llm
+        chain = self.hyde_prompt_template | self.limited_llm
         response = chain.invoke({"question": question})
+        record_llm_usage("hyde", response)
         return response.content
+
+    def _contents(
+        self, call: str, responses: List[Union[BaseMessage, Exception]]
+    ) -> List[Union[str, Exception]]:
+        """
+        Extracts the text of batched LLM responses and counts their tokens.
+
+        Args:
+            call: The kind of LLM call, e.g. "hyde" or "answer".
+            responses: The LLM responses, or the exceptions raised.
+
+        Returns:
+            The response texts, with exceptions passed through.
+        """
+        contents = []
+        for response in responses:
+            if isinstance(response, Exception):
+                contents.append(response)
+            else:
+                record_llm_usage(call, response)
+                contents.append(response.content)
+        return contents
+
+    def generate_responses(
+        self, contexts: List[str], questions: List[str], max_concurrency: int
+    ) -> List[Union[str, Exception]]:
+        """
+        Generates responses for several questions with bounded concurrency.
+
+        Args:
+            contexts: The context assembled for each question.
+            questions: The user's questions.
+            max_concurrency: The maximum number of concurrent LLM calls.
+
+        Returns:
+            The generated responses, or the exception raised for a question.
+        """
+        chain = self.prompt_template | self.limited_llm
+        responses = chain.batch(
+            [
+                {"context": context, "question": question}
+                for context, question in zip(contexts, questions)
+            ],
+            config={"max_concurrency": max_concurrency},
+            return_exceptions=True,
+        )
+        return self._contents("answer", responses)
+
+    def generate_hypothetical_documents(
+        self, questions: List[str], max_concurrency: int
+    ) -> List[Union[str, Exception]]:
+        """
+        Generates hypothetical documents for several questions with bounded
+        concurrency.
+
+        Args:
+            questions: The user's questions.
+            max_concurrency: The maximum number of concurrent LLM calls.
+
+        Returns:
+            The generated documents, or the exception raised for a question.
+        """
+        chain = self.hyde_prompt_template | self.limited_llm
+        responses = chain.batch(
+            [{"question": question} for question in questions],
+            config={"max_concurrency": max_concurrency},
+            return_exceptions=True,
+        )
+        return self._contents("hyde", responses)
@@ -0,0 +1,205 @@
+import logging
+import re
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Dict, Optional
+import redis
+from redis.exceptions import RedisError
+from settings import settings
+from utils.metrics import INGEST_QUEUE_WAIT, INGEST_ROUTED
+
+# Uploads waiting in each lane, per user, as a Redis hash
+PENDING_KEY = "ingest:pending:{lane}"
+# Expiry of the waiting counts, refreshed by each upload, in case a task
+# never starts
+PENDING_TTL_S = 86400
+# Lowest Celery priority, 0 being served first
+LOWEST_PRIORITY = 9
+
+_PDF_PAGE = re.compile(rb"/Type\s*/Page(?![A-Za-z])")
+_PDF_PAGE_COUNT = re.compile(rb"/Type\s*/Pages\b[^>]*?/Count\s+(\d+)")
+_PDF_IMAGE = re.compile(rb"/Subtype\s*/Image\b")
+_PDF_FONT = re.compile(rb"/(?:Font|FontFile[23]?)\b")
+_PDF_STREAM = re.compile(
+    rb"<<((?:[^<>]|<<[^<>]*>>)*)>>\s*stream\r?\n(.*?)endstream", re.DOTALL
+)
+# Bound on the decompressed object streams read per upload
+MAX_OBJECT_STREAM_BYTES = 16 * 1024 * 1024
+
+
+def estimate_ingestion_cost(filename: str, content: bytes) -> Dict[str, Any]:
+    """
+    Estimates how long a document takes to ingest, without converting it.
+
+    PDFs are scanned for their page objects and resources, including those
+    compressed in object streams: a PDF with images but no fonts has no text
+    layer, so every page goes through OCR. Other formats, and PDFs whose
+    pages cannot be counted, are estimated from their size alone.
+
+    Args:
+        filename: The name of the uploaded file.
+        content: The file content.
+
+    Returns:
+        The size in MB, the page count (None if unknown), whether OCR is
+        needed, and the estimated processing time in seconds.
+    """
+    size_mb = len(content) / (1024 * 1024)
+    pages: Optional[int] = None
+    needs_ocr = False
+    if Path(filename).suffix.lower() == ".pdf":
+        objects = content + _object_streams(content)
+        pages = len(_PDF_PAGE.findall(objects))
+        if not pages:
+            counts = [int(count) for count in _PDF_PAGE_COUNT.findall(objects)]
+            pages = max(counts, default=None)
+        if not pages:
+            logging.warning(
+                f"Could not count the pages of {filename}, estimating its "
+                "ingestion cost from its size"
+            )
+        needs_ocr = bool(_PDF_IMAGE.search(objects)) and not _PDF_FONT.search(objects)
+
+    cost_s = size_mb * settings.INGEST_COST_S_PER_MB
+    if pages:
+        page_cost = (
+            settings.INGEST_COST_S_PER_OCR_PAGE
+            if needs_ocr
+            else settings.INGEST_COST_S_PER_PAGE
+        )
+        cost_s += pages * page_cost
+    return {
+        "size_mb": round(size_mb, 2),
+        "pages": pages,
+        "needs_ocr": needs_ocr,
+        "estimated_cost_s": round(cost_s, 1),
+    }
+
+
+def _object_streams(content: bytes) -> bytes:
+    """
+    Decompresses the object streams of a PDF, where PDF 1.5+ writers keep
+    most objects, pages included.
+
+    Args:
+        content: The PDF content.
+
+    Returns:
+        The objects of every readable stream, up to
+        `MAX_OBJECT_STREAM_BYTES`.
+    """
+    objects = b""
+    for stream in _PDF_STREAM.finditer(content):
+        dictionary = stream.group(1)
+        if b"/ObjStm" not in dictionary or b"/FlateDecode" not in dictionary:
+            continue
+        budget = MAX_OBJECT_STREAM_BYTES - len(objects)
+        if budget <= 0:
+            break
+        try:
+            objects += zlib.decompressobj().decompress(stream.group(2), budget)
+        except zlib.error:
+            continue
+    return objects
+
+
+def lane_queue(lane: str) -> str:
+    """
+    Returns the Celery queue of an ingestion lane.
+
+    Args:
+        lane: "fast" or "heavy".
+
+    Returns:
+        The queue name.
+    """
+    return (
+        settings.INGEST_HEAVY_QUEUE if lane == "heavy" else settings.INGEST_FAST_QUEUE
+    )
+
+
+class IngestionRouter:
+    """
+    Routes uploads to the fast or the heavy ingestion lane.
+
+    Each lane is a Celery queue served by its own workers, so a long
+    document only delays the documents of its lane. Within a lane, an
+    upload's priority drops with the number of uploads its user already has
+    waiting there, so a bulk upload does not hold back other users.
+    """
+
+    def __init__(self, client: Optional[redis.Redis] = None):
+        """
+        Initializes the IngestionRouter.
+
+        Args:
+            client: The Redis client, created on first use if not given.
+        """
+        self._redis = client
+
+    def route(self, filename: str, content: bytes, user: str) -> Dict[str, Any]:
+        """
+        Chooses the lane and priority of an upload, and counts it as waiting.
+
+        Args:
+            filename: The name of the uploaded file.
+            content: The file content.
+            user: Who uploaded the file.
+
+        Returns:
+            The cost estimate, with the lane, its queue and the priority.
+        """
+        cost = estimate_ingestion_cost(filename, content)
+        lane = (
+            "heavy"
+            if cost["estimated_cost_s"] >= settings.INGEST_HEAVY_COST_S
+            else "fast"
+        )
+        key = PENDING_KEY.format(lane=lane)
+        try:
+            pipeline = self._client().pipeline(transaction=True)
+            pipeline.hincrby(key, user, 1)
+            pipeline.expire(key, PENDING_TTL_S)
+            waiting = pipeline.execute()[0] - 1
+        except RedisError as e:
+            logging.warning(f"Could not count the uploads waiting for {user}: {e}")
+            waiting = 0
+        INGEST_ROUTED.labels(lane).inc()
+        return {
+            **cost,
+            "lane": lane,
+            "queue": lane_queue(lane),
+            "priority": min(max(waiting, 0), LOWEST_PRIORITY),
+        }
+
+    def started(self, lane: str, user: str, enqueued_at: float) -> float:
+        """
+        Records that a worker started an upload.
+
+        Args:
+            lane: The lane of the upload.
+            user: Who uploaded the file.
+            enqueued_at: When the upload was queued, as a UNIX timestamp.
+
+        Returns:
+            The seconds the upload waited in its lane.
+        """
+        queue_wait_s = max(0.0, time.time() - enqueued_at)
+        INGEST_QUEUE_WAIT.labels(lane).observe(queue_wait_s)
+        key = PENDING_KEY.format(lane=lane)
+        try:
+            self._client().hincrby(key, user, -1)
+        except RedisError as e:
+            logging.warning(f"Could not count the uploads waiting for {user}: {e}")
+        return queue_wait_s
+
+    def _client(self) -> redis.Redis:
+        """
+        Returns the Redis client, created on first use.
+        """
+        if self._redis is None:
+            self._redis = redis.Redis.from_url(
+                settings.REDIS_URL, socket_connect_timeout=1, socket_timeout=5
+            )
+        return self._redis
@@ -0,0 +1,298 @@
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+import redis
+from redis.exceptions import RedisError
+from settings import settings
+from utils.metrics import QUOTA_AVAILABLE, QUOTA_REJECTIONS, QUOTA_WAIT
+from .admission_control import AdmissionRejected, current_admission
+from . import cancellation
+
+# Refills every bucket from the Redis clock, then takes the cost from all of
+# them or from none. A bucket may not go below `floor` times its capacity,
+# which keeps that share for interactive requests.
+# KEYS: the bucket keys
+# ARGV: capacity, refill per ms and cost for each bucket, then the floor
+# Returns: 1 if taken, the ms to wait otherwise, and each bucket's level
+TAKE_SCRIPT = """
+local now_parts = redis.call("TIME")
+local now = tonumber(now_parts[1]) * 1000 + math.floor(tonumber(now_parts[2]) / 1000)
+local floor = tonumber(ARGV[#ARGV])
+local levels = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[3 * i - 2])
+    local rate = tonumber(ARGV[3 * i - 1])
+    local cost = tonumber(ARGV[3 * i])
+    local state = redis.call("HMGET", key, "level", "updated")
+    local level = tonumber(state[1]) or capacity
+    local updated = tonumber(state[2]) or now
+    level = math.min(capacity, level + math.max(0, now - updated) * rate)
+    levels[i] = level
+    local needed = cost + capacity * floor
+    if cost > 0 and level < needed then
+        wait = math.max(wait, (needed - level) / rate)
+    end
+end
+local result = {wait == 0 and 1 or 0, math.ceil(wait)}
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[3 * i - 2])
+    local rate = tonumber(ARGV[3 * i - 1])
+    if wait == 0 then
+        levels[i] = levels[i] - tonumber(ARGV[3 * i])
+    end
+    redis.call("HSET", key, "level", levels[i], "updated", now)
+    redis.call("PEXPIRE", key, math.ceil(capacity / rate) + 1000)
+    result[i + 2] = tostring(levels[i])
+end
+return result
+"""
+
+# Returns unused (or charges extra) tokens once the real usage is known
+SETTLE_SCRIPT = """
+if redis.call("EXISTS", KEYS[1]) == 1 then
+    redis.call("HINCRBYFLOAT", KEYS[1], "level", ARGV[1])
+end
+return 0
+"""
+
+
+class QuotaLimiter:
+    """
+    A Gemini quota shared by every API replica and worker through Redis.
+
+    The quota is a requests-per-minute and a tokens-per-minute token bucket,
+    updated atomically by a Lua script. Batch work, such as ingestion, may
+    not draw the buckets below `QUOTA_INTERACTIVE_RESERVE` of their size, so
+    interactive requests always find quota. Callers wait for quota until
+    their deadline, and are rejected with a 429 if it would come too late.
+    If Redis is unreachable, calls go through unlimited.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: Optional[int],
+        tokens_per_minute: Optional[int],
+        redis_url: str,
+    ):
+        """
+        Initializes the QuotaLimiter.
+
+        Args:
+            name: The quota name, e.g. "llm" or "embedding".
+            requests_per_minute: The request quota, None for unlimited.
+            tokens_per_minute: The token quota, None for unlimited.
+            redis_url: The Redis server shared by all processes.
+        """
+        self.name = name
+        self.buckets: List[Tuple[str, int]] = [
+            (unit, per_minute)
+            for unit, per_minute in (
+                ("requests", requests_per_minute),
+                ("tokens", tokens_per_minute),
+            )
+            if per_minute
+        ]
+        self.redis_url = redis_url
+        self.waits = 0
+        self.rejections = 0
+        self._redis: Optional[redis.Redis] = None
+
+    @property
+    def enabled(self) -> bool:
+        """
+        Whether any limit is configured.
+        """
+        return bool(self.buckets)
+
+    def acquire(self, tokens: int):
+        """
+        Takes one request and the given tokens from the quota, waiting for
+        them if needed.
+
+        Args:
+            tokens: The estimated tokens of the call.
+
+        Raises:
+            AdmissionRejected: If the quota cannot be obtained before the
+                deadline of the current request.
+            RequestCancelled: If the request is cancelled while waiting.
+        """
+        if not self.enabled:
+            return
+        priority, deadline = current_admission()
+        floor = settings.QUOTA_INTERACTIVE_RESERVE if priority == "batch" else 0.0
+        start = time.monotonic()
+        if deadline is None:
+            deadline = start + settings.QUOTA_MAX_WAIT_S
+
+        while True:
+            try:
+                wait_s = self._take(self._costs(tokens, floor), floor)
+            except RedisError as e:
+                logging.warning(f"Quota {self.name} unavailable, not limiting: {e}")
+                return
+            if wait_s is None:
+                break
+            if time.monotonic() + wait_s > deadline:
+                self.rejections += 1
+                QUOTA_REJECTIONS.labels(self.name, priority).inc()
+                raise AdmissionRejected(
+                    f"{self.name} quota", 429, wait_s, "quota exhausted"
+                )
+            self.waits += 1
+            cancellation.sleep(wait_s, f"{self.name} quota")
+        QUOTA_WAIT.labels(self.name, priority).observe(time.monotonic() - start)
+
+    def settle(self, estimated_tokens: int, actual_tokens: int):
+        """
+        Corrects the token bucket once the real usage of a call is known.
+
+        Args:
+            estimated_tokens: The tokens taken by `acquire`.
+            actual_tokens: The tokens the call used.
+        """
+        if not any(unit == "tokens" for unit, _ in self.buckets):
+            return
+        try:
+            self._client().eval(
+                SETTLE_SCRIPT,
+                1,
+                self._key("tokens"),
+                estimated_tokens - actual_tokens,
+            )
+        except RedisError as e:
+            logging.warning(f"Could not settle quota {self.name}: {e}")
+
+    def state(self) -> Dict[str, Any]:
+        """
+        Reads the current quota levels without taking anything.
+
+        Returns:
+            The quota name, its buckets and this process's waits and
+            rejections.
+        """
+        levels: List[Optional[float]] = [None] * len(self.buckets)
+        available = True
+        if self.enabled:
+            try:
+                result = self._run_take([0] * len(self.buckets), 0.0)
+                levels = [float(level) for level in result[2:]]
+            except RedisError:
+                available = False
+        return {
+            "name": self.name,
+            "redis_available": available,
+            "interactive_reserve": settings.QUOTA_INTERACTIVE_RESERVE,
+            "buckets": [
+                {"unit": unit, "per_minute": per_minute, "available": level}
+                for (unit, per_minute), level in zip(self.buckets, levels)
+            ],
+            "waits": self.waits,
+            "rejections": self.rejections,
+        }
+
+    def _costs(self, tokens: int, floor: float) -> List[float]:
+        """
+        Computes the cost of a call in each bucket.
+
+        A call larger than a bucket could ever hold is capped, so it waits
+        for a full bucket instead of forever.
+
+        Args:
+            tokens: The estimated tokens of the call.
+            floor: The share of each bucket the call may not use.
+
+        Returns:
+            The cost per bucket.
+        """
+        costs = []
+        for unit, per_minute in self.buckets:
+            cost = 1 if unit == "requests" else tokens
+            costs.append(min(cost, per_minute * (1 - floor)))
+        return costs
+
+    def _take(self, costs: List[float], floor: float) -> Optional[float]:
+        """
+        Takes the costs from the buckets if they all have enough.
+
+        Args:
+            costs: The cost per bucket.
+            floor: The share of each bucket that must remain.
+
+        Returns:
+            None if taken, otherwise the seconds until there is enough.
+        """
+        result = self._run_take(costs, floor)
+        if result[0] == 1:
+            return None
+        return int(result[1]) / 1000
+
+    def _run_take(self, costs: List[float], floor: float) -> List[Any]:
+        """
+        Runs the take script and publishes the bucket levels as metrics.
+
+        Args:
+            costs: The cost per bucket.
+            floor: The share of each bucket that must remain.
+
+        Returns:
+            The script result.
+        """
+        keys = [self._key(unit) for unit, _ in self.buckets]
+        args: List[float] = []
+        for (unit, per_minute), cost in zip(self.buckets, costs):
+            args.extend([per_minute, per_minute / 60_000, cost])
+        args.append(floor)
+        result = self._client().eval(TAKE_SCRIPT, len(keys), *keys, *args)
+        for (unit, _), level in zip(self.buckets, result[2:]):
+            QUOTA_AVAILABLE.labels(self.name, unit).set(float(level))
+        return result
+
+    def _key(self, unit: str) -> str:
+        """
+        Returns the Redis key of a bucket.
+        """
+        return f"quota:{self.name}:{unit}"
+
+    def _client(self) -> redis.Redis:
+        """
+        Returns the Redis client, created on first use.
+        """
+        if self._redis is None:
+            self._redis = redis.Redis.from_url(
+                self.redis_url, socket_connect_timeout=1, socket_timeout=1
+            )
+        return self._redis
+
+
+_limiters: Dict[str, QuotaLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_quota_limiter(name: str) -> QuotaLimiter:
+    """
+    Returns the quota limiter of a Gemini API, configured from the settings.
+
+    Args:
+        name: "llm" or "embedding".
+
+    Returns:
+        The process-wide quota limiter.
+    """
+    with _limiters_lock:
+        if name not in _limiters:
+            limits = {
+                "llm": (
+                    settings.LLM_REQUESTS_PER_MINUTE,
+                    settings.LLM_TOKENS_PER_MINUTE,
+                ),
+                "embedding": (
+                    settings.EMBEDDING_REQUESTS_PER_MINUTE,
+                    settings.EMBEDDING_TOKENS_PER_MINUTE,
+                ),
+            }
+            _limiters[name] = QuotaLimiter(name, *limits[name], settings.REDIS_URL)
+        return _limiters[name]
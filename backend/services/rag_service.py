@@ -1,9 +1,39 @@
-from typing import List, Dict, Any, TypedDict
+import logging
+import time
+from functools import wraps
+from typing import List, Dict, Any, Callable, Iterable, Optional, Tuple, TypedDict
 from langgraph.graph import StateGraph, END
+from schemas.chat_schemas import ContextReport
+from settings import settings
+from .cancellation import RequestCancelled, check_cancelled
+from .context_builder import ContextBuilder
 from .embedding_service import EmbeddingService
 from .generation_service import GenerationService
 from .reranking_service import RerankingService
 from repositories import VectorStoreRepository
+from utils.highlighting import find_highlights
+from utils.metrics import (
+    AVOIDED_STAGES,
+    CANCELLED_REQUESTS,
+    LLM_TOKENS_AVOIDED,
+    RAG_CANDIDATES,
+    instrument_stage,
+    timed_stage,
+)
+
+# Number of candidates fetched from the vector store before reranking
+RETRIEVAL_CANDIDATES = 20
+# The nodes of the pipeline, in order
+PIPELINE_STAGES = (
+    "generate_hypothetical_document",
+    "embed_query",
+    "retrieve_documents",
+    "rerank_documents",
+    "build_context",
+    "generate_response",
+)
+# The nodes that call the LLM
+LLM_STAGES = ("generate_hypothetical_document", "generate_response")
 
 
 class GraphState(TypedDict):
@@ -15,14 +45,20 @@ class GraphState(TypedDict):
         hypothetical_document: A hypothetical document generated to answer the question.
         embedding: The embedding of the user's question.
         documents: The retrieved documents.
+        context: The context assembled for the LLM.
+        context_report: How the context was assembled.
         response: The generated response.
+        top_k: The number of documents kept after reranking, if not the default.
     """
 
     question: str
     hypothetical_document: str
     embedding: List[float]
     documents: Dict[str, Any]
+    context: str
+    context_report: ContextReport
     response: str
+    top_k: int
 
 
 class RAGService:
@@ -38,6 +74,7 @@ class RAGService:
         self.generation_service = GenerationService()
         self.vector_store_repository = VectorStoreRepository()
         self.reranking_service = RerankingService()
+        self.context_builder = ContextBuilder()
         self.graph = self._build_graph()
 
     def _build_graph(self) -> StateGraph:
@@ -49,25 +86,88 @@ class RAGService:
         """
         workflow = StateGraph(GraphState)
 
-        # Define the nodes
-        workflow.add_node(
-            "generate_hypothetical_document", self.generate_hypothetical_document
-        )
-        workflow.add_node("embed_query", self.embed_query)
-        workflow.add_node("retrieve_documents", self.retrieve_documents)
-        workflow.add_node("rerank_documents", self.rerank_documents)
-        workflow.add_node("generate_response", self.generate_response)
+        # Define the nodes, each stopping the pipeline if it was cancelled
+        for stage in PIPELINE_STAGES:
+            workflow.add_node(stage, self._cancellable(stage, getattr(self, stage)))
 
         # Build the graph
         workflow.set_entry_point("generate_hypothetical_document")
         workflow.add_edge("generate_hypothetical_document", "embed_query")
         workflow.add_edge("embed_query", "retrieve_documents")
         workflow.add_edge("retrieve_documents", "rerank_documents")
-        workflow.add_edge("rerank_documents", "generate_response")
+        workflow.add_edge("rerank_documents", "build_context")
+        workflow.add_edge("build_context", "generate_response")
         workflow.add_edge("generate_response", END)
 
         return workflow.compile()
 
+    def _cancellable(
+        self, stage: str, node: Callable[[GraphState], GraphState]
+    ) -> Callable[[GraphState], GraphState]:
+        """
+        Wraps a node so a cancelled request stops before or during it, and
+        counts the work the cancellation avoided.
+
+        Args:
+            stage: The node name.
+            node: The node function.
+
+        Returns:
+            The wrapped node.
+        """
+
+        @wraps(node)
+        def wrapper(state: GraphState) -> GraphState:
+            try:
+                check_cancelled(stage)
+                return node(state)
+            except RequestCancelled as cancelled:
+                self._record_cancellation(stage, cancelled)
+                raise
+
+        return wrapper
+
+    def _record_cancellation(self, stage: str, cancelled: RequestCancelled):
+        """
+        Counts a cancelled execution and the stages it did not complete.
+
+        Args:
+            stage: The node that was about to run or running.
+            cancelled: The cancellation.
+        """
+        logging.info(f"Pipeline cancelled ({cancelled.reason}) at {stage}")
+        CANCELLED_REQUESTS.labels(cancelled.reason, stage).inc()
+        for avoided in PIPELINE_STAGES[PIPELINE_STAGES.index(stage) :]:
+            AVOIDED_STAGES.labels(avoided).inc()
+            # An interrupted stream counts the tokens it did not generate
+            interrupted = avoided == stage and cancelled.stage == "llm_stream"
+            if avoided in LLM_STAGES and not interrupted:
+                LLM_TOKENS_AVOIDED.inc(settings.LLM_OUTPUT_TOKENS_ESTIMATE)
+
+    def _query_embedding_service(self) -> EmbeddingService:
+        """
+        Returns the embedding service matching the active collection.
+
+        Queries must be embedded by the model that built the collection they
+        search, which changes when a re-index switches collections.
+
+        Returns:
+            The embedding service for queries.
+        """
+        storage = self.vector_store_repository.storage(
+            self.vector_store_repository.collection
+        )
+        backend = self.embedding_service.backend
+        if (storage["embedding_model"], storage["embedding_dimensionality"]) != (
+            backend.model_name,
+            backend.dimensionality,
+        ):
+            self.embedding_service = EmbeddingService(
+                storage["embedding_model"], storage["embedding_dimensionality"]
+            )
+        return self.embedding_service
+
+    @instrument_stage("generate_hypothetical_document")
     def generate_hypothetical_document(self, state: GraphState) -> GraphState:
         """
         Generates a hypothetical document to answer the user's question.
@@ -84,6 +184,7 @@ class RAGService:
         )
         return {**state, "hypothetical_document": hypothetical_document}
 
+    @instrument_stage("embed_query")
     def embed_query(self, state: GraphState) -> GraphState:
         """
         Embeds the user's question.
@@ -95,9 +196,10 @@ class RAGService:
             The updated graph state.
         """
         hypothetical_document = state["hypothetical_document"]
-        embedding = self.embedding_service.embed_query(hypothetical_document)
+        embedding = self._query_embedding_service().embed_query(hypothetical_document)
         return {**state, "embedding": embedding}
 
+    @instrument_stage("retrieve_documents")
     def retrieve_documents(self, state: GraphState) -> GraphState:
         """
         Retrieves documents from the vector store.
@@ -109,9 +211,13 @@ class RAGService:
             The updated graph state.
         """
         embedding = state["embedding"]
-        documents = self.vector_store_repository.query([embedding], n_results=20)
+        documents = self.vector_store_repository.query(
+            [embedding], n_results=RETRIEVAL_CANDIDATES
+        )
+        RAG_CANDIDATES.labels("retrieved").observe(len(documents["ids"][0]))
         return {**state, "documents": documents}
 
+    @instrument_stage("rerank_documents")
     def rerank_documents(self, state: GraphState) -> GraphState:
         """
         Re-ranks the retrieved documents.
@@ -127,12 +233,70 @@ class RAGService:
         reranked_documents = self.reranking_service.rerank_documents(
             question, documents
         )
-        # I will take only the top 5 documents after reranking
-        reranked_documents["documents"][0] = reranked_documents["documents"][0][:5]
-        reranked_documents["metadatas"][0] = reranked_documents["metadatas"][0][:5]
-        reranked_documents["ids"][0] = reranked_documents["ids"][0][:5]
+        top_k = state.get("top_k")
+        reranked_documents = self._keep_top_k(reranked_documents, top_k)
+        RAG_CANDIDATES.labels("reranked").observe(len(reranked_documents["ids"][0]))
         return {**state, "documents": reranked_documents}
 
+    def _keep_top_k(
+        self, documents: Dict[str, Any], top_k: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        Keeps only the top documents of each query.
+
+        Args:
+            documents: The ranked documents.
+            top_k: The number of documents to keep, `RERANK_TOP_K` by default.
+
+        Returns:
+            The documents, cut to `top_k` per query.
+        """
+        top_k = top_k or settings.RERANK_TOP_K
+        for key in ("documents", "metadatas", "ids", "scores", "distances"):
+            if key in documents:
+                documents[key] = [results[:top_k] for results in documents[key]]
+        return documents
+
+    @instrument_stage("build_context")
+    def build_context(self, state: GraphState) -> GraphState:
+        """
+        Assembles the LLM context from the re-ranked documents.
+
+        Args:
+            state: The current graph state.
+
+        Returns:
+            The updated graph state.
+        """
+        context, report = self._build_context(state["question"], state["documents"])
+        return {**state, "context": context, "context_report": report}
+
+    def _build_context(
+        self, question: str, documents: Dict[str, Any]
+    ) -> Tuple[str, ContextReport]:
+        """
+        Assembles and logs the LLM context for one question.
+
+        Args:
+            question: The user's question.
+            documents: The re-ranked documents for the question.
+
+        Returns:
+            A tuple of the context string and its report.
+        """
+        overhead = self.generation_service.estimate_prompt_tokens("", question)
+        context, report = self.context_builder.build(documents, overhead)
+        RAG_CANDIDATES.labels("context").observe(len(report.included_chunk_ids))
+        logging.info(
+            f"Context: {report.prompt_tokens} prompt tokens, "
+            f"{len(report.included_chunk_ids)}/{report.candidates} chunks in "
+            f"{report.spans} spans, {len(report.duplicate_chunk_ids)} duplicates, "
+            f"{len(report.truncated_chunk_ids)} truncated, "
+            f"{len(report.dropped_chunk_ids)} dropped"
+        )
+        return context, report
+
+    @instrument_stage("generate_response")
     def generate_response(self, state: GraphState) -> GraphState:
         """
         Generates a response to the user's question.
@@ -144,10 +308,22 @@ class RAGService:
             The updated graph state.
         """
         question = state["question"]
-        documents = state["documents"]
-        response = self.generation_service.generate_response(documents, question)
+        context = state["context"]
+        response = self.generation_service.generate_response(context, question)
         return {**state, "response": response}
 
+    def run(self, question: str) -> GraphState:
+        """
+        Runs the RAG pipeline and returns the final graph state.
+
+        Args:
+            question: The user's question.
+
+        Returns:
+            The final graph state, including the response and context report.
+        """
+        return self.graph.invoke({"question": question})
+
     def invoke(self, question: str) -> str:
         """
         Invokes the RAG pipeline with the user's question.
@@ -158,5 +334,211 @@ class RAGService:
         Returns:
             The generated response.
         """
-        result = self.graph.invoke({"question": question})
-        return result["response"]
+        return self.run(question)["response"]
+
+    def batch(
+        self, questions: List[str], max_concurrency: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Runs the RAG pipeline for many questions, one vectorized call per stage.
+
+        HyDE and the final generation run with bounded concurrency, the query
+        embeddings, vector search and reranking each run once for the whole
+        batch. A question whose LLM call fails gets an error instead of an
+        answer without failing the rest of the batch.
+
+        Args:
+            questions: The user's questions.
+            max_concurrency: The maximum number of concurrent LLM calls.
+
+        Returns:
+            One result per question, with the answer, citations and context
+            report, or the error.
+        """
+        max_concurrency = max_concurrency or settings.BATCH_CHAT_MAX_CONCURRENCY
+        results: List[Dict[str, Any]] = [{"question": q} for q in questions]
+
+        with timed_stage("generate_hypothetical_document"):
+            hypothetical_documents = (
+                self.generation_service.generate_hypothetical_documents(
+                    questions, max_concurrency
+                )
+            )
+        active = self._collect_errors(
+            results, range(len(questions)), hypothetical_documents
+        )
+        if not active:
+            return results
+
+        with timed_stage("embed_query"):
+            embeddings = self._query_embedding_service().embed_queries(
+                [hypothetical_documents[i] for i in active]
+            )
+        with timed_stage("retrieve_documents"):
+            retrieved = self.vector_store_repository.query(
+                embeddings, n_results=RETRIEVAL_CANDIDATES
+            )
+        with timed_stage("rerank_documents"):
+            reranked = self._keep_top_k(
+                self.reranking_service.rerank_batch(
+                    [questions[i] for i in active], retrieved
+                )
+            )
+
+        contexts = []
+        with timed_stage("build_context"):
+            for position, i in enumerate(active):
+                documents = {
+                    key: [values[position]] for key, values in reranked.items()
+                }
+                context, report = self._build_context(questions[i], documents)
+                contexts.append(context)
+                results[i]["context"] = report
+                results[i]["citations"] = self._citations(documents, report)
+
+        with timed_stage("generate_response"):
+            responses = self.generation_service.generate_responses(
+                contexts, [questions[i] for i in active], max_concurrency
+            )
+        responses_by_index = dict(zip(active, responses))
+        for i in self._collect_errors(results, active, responses):
+            results[i]["response"] = responses_by_index[i]
+        return results
+
+    def _collect_errors(
+        self, results: List[Dict[str, Any]], indices: Iterable[int], outputs: List[Any]
+    ) -> List[int]:
+        """
+        Records failed LLM calls on their results.
+
+        Args:
+            results: The batch results, updated in place.
+            indices: The question index of each output.
+            outputs: The LLM outputs, exceptions for failed calls.
+
+        Returns:
+            The question indices whose call succeeded.
+        """
+        succeeded = []
+        for i, output in zip(indices, outputs):
+            if isinstance(output, Exception):
+                logging.error(f"Batch question {i} failed: {output}")
+                results[i]["error"] = str(output)
+            else:
+                succeeded.append(i)
+        return succeeded
+
+    def _citations(
+        self, documents: Dict[str, Any], report: ContextReport
+    ) -> List[Dict[str, str]]:
+        """
+        Lists the chunks that made it into a question's context.
+
+        Args:
+            documents: The re-ranked documents for the question.
+            report: The context report for the question.
+
+        Returns:
+            The source and chunk id of each included chunk.
+        """
+        sources = {
+            chunk_id: metadata.get("source", "unknown")
+            for chunk_id, metadata in zip(
+                documents["ids"][0], documents["metadatas"][0]
+            )
+        }
+        return [
+            {"source": sources[chunk_id], "chunk_id": chunk_id}
+            for chunk_id in report.included_chunk_ids
+        ]
+
+    def search(
+        self, query: str, top_k: int, latency_budget_ms: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """
+        Finds the passages most relevant to a query without calling the LLM.
+
+        The query is embedded directly instead of through HyDE. The reranker
+        is skipped when its estimated latency would exceed what is left of
+        the budget; the results are then ranked by vector similarity.
+
+        Args:
+            query: The search query.
+            top_k: The number of passages to return.
+            latency_budget_ms: The time the search may take, in milliseconds.
+
+        Returns:
+            The ranked passages with scores and highlighted spans, whether
+            they were reranked, and the time taken.
+        """
+        start = time.perf_counter()
+        state: GraphState = {
+            "question": query,
+            "hypothetical_document": query,
+            "top_k": top_k,
+        }
+        state = self.retrieve_documents(self.embed_query(state))
+
+        n_candidates = len(state["documents"]["ids"][0])
+        reranked = self._rerank_fits_budget(start, n_candidates, latency_budget_ms)
+        if reranked:
+            state = self.rerank_documents(state)
+            documents = state["documents"]
+            scores = documents.get("scores", [[]])[0]
+        else:
+            documents = self._keep_top_k(state["documents"], top_k)
+            # Unit-length embeddings: squared L2 distance d maps to cosine 1 - d/2
+            scores = [1 - distance / 2 for distance in documents["distances"][0]]
+
+        results = []
+        for i, chunk_id in enumerate(documents["ids"][0]):
+            metadata = documents["metadatas"][0][i] or {}
+            text = documents["documents"][0][i]
+            results.append(
+                {
+                    "chunk_id": chunk_id,
+                    "source": metadata.get("source", "unknown"),
+                    "document_id": metadata.get("document_id"),
+                    "chunk_index": metadata.get("chunk_index"),
+                    "text": text,
+                    "score": float(scores[i]),
+                    "highlights": find_highlights(query, text),
+                }
+            )
+        return {
+            "query": query,
+            "results": results,
+            "reranked": reranked,
+            "took_ms": (time.perf_counter() - start) * 1000,
+        }
+
+    def _rerank_fits_budget(
+        self, start: float, n_candidates: int, latency_budget_ms: Optional[float]
+    ) -> bool:
+        """
+        Decides whether reranking can finish within the latency budget.
+
+        Args:
+            start: The `time.perf_counter` value when the request started.
+            n_candidates: The number of candidates to rerank.
+            latency_budget_ms: The time the request may take, in milliseconds.
+
+        Returns:
+            True if there is something to rerank and the budget allows it.
+        """
+        if n_candidates == 0:
+            return False
+        if latency_budget_ms is None:
+            return True
+        estimate = self.reranking_service.estimate_latency(n_candidates)
+        if estimate is None:
+            # No measurement yet, rerank once to learn the model's speed
+            return True
+        elapsed = time.perf_counter() - start
+        fits = elapsed + estimate <= latency_budget_ms / 1000
+        if not fits:
+            logging.info(
+                f"Skipping reranking: {elapsed * 1000:.0f} ms elapsed, "
+                f"{estimate * 1000:.0f} ms estimated, budget {latency_budget_ms} ms"
+            )
+        return fits
@@ -0,0 +1,334 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional
+import redis
+from redis.exceptions import RedisError
+from repositories import VectorStoreRepository
+from repositories.vector_store_repository import (
+    ACTIVE_COLLECTION_KEY,
+    DEFAULT_COLLECTION,
+    configured_storage,
+)
+from settings import settings
+from .embedding_service import EmbeddingService
+
+# Progress of the current or last re-index, as a Redis hash
+MIGRATION_KEY = "vector_store:migration"
+# Held by the job copying the collection, so only one runs at a time
+MIGRATION_LOCK_KEY = "vector_store:migration_lock"
+# Numbers the re-index target collections
+COLLECTION_VERSION_KEY = "vector_store:collection_version"
+# How long the lock outlives a job that stopped reporting progress
+LOCK_TTL_S = 600
+
+
+class ReindexConflict(Exception):
+    """
+    Raised when a re-index cannot start in the current state.
+    """
+
+
+class ReindexService:
+    """
+    A service for re-embedding the vector store into a new collection.
+
+    The job pages through the stored chunks of the active collection,
+    re-embeds them with the configured model and storage, and writes them to
+    a new versioned collection. Ingestion writes to both collections while the
+    job runs. Progress is checkpointed in Redis after every batch of pages,
+    so a failed or interrupted job resumes where it stopped. Once every chunk
+    is copied, the active collection is switched in a single transaction and
+    the previous collection is kept for rollback.
+    """
+
+    def __init__(self, repository: Optional[VectorStoreRepository] = None):
+        """
+        Initializes the ReindexService.
+
+        Args:
+            repository: The vector store repository, created if not given.
+        """
+        self.repository = repository or VectorStoreRepository()
+        self._redis: Optional[redis.Redis] = None
+
+    def status(self) -> Optional[Dict[str, Any]]:
+        """
+        Reads the progress of the current or last re-index.
+
+        Returns:
+            The migration state, or None if no re-index was ever started.
+        """
+        state = self._client().hgetall(MIGRATION_KEY)
+        if not state:
+            return None
+        state = {key.decode(): value.decode() for key, value in state.items()}
+        for key in ("processed", "total"):
+            state[key] = int(state[key])
+        for key in ("chunks_per_second", "eta_seconds"):
+            state[key] = float(state[key]) if state.get(key) else None
+        state["error"] = state.get("error") or None
+        state["running"] = bool(self._client().exists(MIGRATION_LOCK_KEY))
+        return state
+
+    def start(self) -> Dict[str, Any]:
+        """
+        Prepares a re-index into a new collection, or the resumption of an
+        unfinished one.
+
+        Returns:
+            The migration state to hand to `run`.
+
+        Raises:
+            ReindexConflict: If a job is already running, or the active
+                collection already uses the configured storage.
+        """
+        state = self.status()
+        if state is not None and state["running"]:
+            raise ReindexConflict(f"A re-index into {state['target']} is running")
+        if state is not None and state["status"] != "completed":
+            return state
+
+        source = self.repository.active_collection_name(max_age_s=0)
+        source_collection = self.repository.get_collection(source)
+        if self.repository.storage(source_collection) == configured_storage():
+            raise ReindexConflict(
+                f"Collection '{source}' already uses the configured embedding storage"
+            )
+
+        version = self._client().incr(COLLECTION_VERSION_KEY)
+        target = f"{DEFAULT_COLLECTION}_v{version}"
+        self.repository.get_collection(target)
+        now = _now()
+        pipeline = self._client().pipeline(transaction=True)
+        pipeline.delete(MIGRATION_KEY)
+        pipeline.hset(
+            MIGRATION_KEY,
+            mapping={
+                "source": source,
+                "target": target,
+                "status": "pending",
+                "processed": 0,
+                "total": source_collection.count(),
+                "started_at": now,
+                "updated_at": now,
+            },
+        )
+        pipeline.execute()
+        return self.status()
+
+    def dual_write_target(self) -> Optional[str]:
+        """
+        Returns the collection that new chunks must also be written to.
+
+        Ingestion must call this before resolving the active collection, so
+        a switch in between leaves no chunk behind.
+
+        Returns:
+            The target of an unfinished re-index, if any.
+        """
+        try:
+            state = self._client().hmget(MIGRATION_KEY, "status", "target")
+        except RedisError as e:
+            logging.warning(f"Could not read the re-index state: {e}")
+            return None
+        status, target = state
+        if status is None or status.decode() == "completed":
+            return None
+        return target.decode()
+
+    def run(
+        self,
+        owner: str,
+        on_progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Copies the remaining chunks into the target collection, then makes
+        it the active one.
+
+        Args:
+            owner: An id of the job, such as its Celery task id.
+            on_progress: Called with the migration state after each batch of
+                pages.
+
+        Returns:
+            The final migration state.
+
+        Raises:
+            ReindexConflict: If there is nothing to resume, or another job
+                holds the lock.
+        """
+        state = self.status()
+        if state is None or state["status"] == "completed":
+            raise ReindexConflict("No re-index to run")
+        if not self._client().set(MIGRATION_LOCK_KEY, owner, nx=True, ex=LOCK_TTL_S):
+            raise ReindexConflict(f"A re-index into {state['target']} is running")
+
+        try:
+            self._copy(state, owner, on_progress)
+        except Exception as e:
+            logging.exception(f"Re-index into {state['target']} failed")
+            self._save(status="failed", error=str(e))
+            raise
+        finally:
+            if self._client().get(MIGRATION_LOCK_KEY) == owner.encode():
+                self._client().delete(MIGRATION_LOCK_KEY)
+        return self.status()
+
+    def _copy(
+        self,
+        state: Dict[str, Any],
+        owner: str,
+        on_progress: Optional[Callable[[Dict[str, Any]], None]],
+    ):
+        """
+        Copies pages of chunks until the target holds the whole source, then
+        switches the active collection.
+
+        New chunks are appended to the source while the job runs, so the end
+        is re-read after every batch of pages. Chunks are never deleted, so
+        offsets stay valid across restarts.
+
+        Args:
+            state: The migration state to resume from.
+            owner: The id of the job holding the lock.
+            on_progress: Called with the migration state after each batch.
+        """
+        source = self.repository.get_collection(state["source"])
+        target = self.repository.get_collection(state["target"])
+        storage = self.repository.storage(target)
+        embedding_service = EmbeddingService(
+            storage["embedding_model"], storage["embedding_dimensionality"]
+        )
+        page_size = settings.REINDEX_PAGE_SIZE
+        concurrency = settings.REINDEX_CONCURRENCY
+        offset = state["processed"]
+        resumed_at, start = offset, time.monotonic()
+        self._save(status="running", error="")
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            while True:
+                total = source.count()
+                if offset >= total:
+                    break
+                offsets = range(
+                    offset, min(total, offset + page_size * concurrency), page_size
+                )
+                copied = sum(
+                    pool.map(
+                        lambda page_offset: self._copy_page(
+                            source, target, embedding_service, page_offset
+                        ),
+                        offsets,
+                    )
+                )
+                if copied == 0:
+                    break
+                offset += copied
+
+                rate = (offset - resumed_at) / max(time.monotonic() - start, 1e-6)
+                self._save(
+                    processed=offset,
+                    total=total,
+                    chunks_per_second=round(rate, 2),
+                    eta_seconds=round((total - offset) / rate, 1),
+                )
+                self._client().expire(MIGRATION_LOCK_KEY, LOCK_TTL_S)
+                if on_progress is not None:
+                    on_progress(self.status())
+
+        self._switch(state["target"], offset)
+        logging.info(
+            f"Switched the vector store from {state['source']} to {state['target']}"
+        )
+
+    def _copy_page(
+        self, source, target, embedding_service: EmbeddingService, offset: int
+    ) -> int:
+        """
+        Re-embeds one page of the source into the target.
+
+        Args:
+            source: The collection being re-indexed.
+            target: The collection being filled.
+            embedding_service: The service producing the target's embeddings.
+            offset: The position of the page in the source.
+
+        Returns:
+            The number of chunks copied.
+
+        Raises:
+            RuntimeError: If some chunks could not be embedded.
+        """
+        page = source.get(
+            limit=settings.REINDEX_PAGE_SIZE,
+            offset=offset,
+            include=["documents", "metadatas"],
+        )
+        if not page["ids"]:
+            return 0
+        embeddings = embedding_service.generate_embeddings(page["documents"])
+        if len(embeddings) != len(page["ids"]):
+            raise RuntimeError(
+                f"Embedded {len(embeddings)} of {len(page['ids'])} chunks "
+                f"at offset {offset}"
+            )
+        self.repository.add_documents(
+            page["ids"],
+            page["documents"],
+            page["metadatas"],
+            embeddings,
+            collection_name=target.name,
+        )
+        return len(page["ids"])
+
+    def _switch(self, target: str, processed: int):
+        """
+        Makes the target the active collection and completes the migration
+        in one transaction.
+
+        Args:
+            target: The re-indexed collection.
+            processed: The number of chunks copied.
+        """
+        pipeline = self._client().pipeline(transaction=True)
+        pipeline.set(ACTIVE_COLLECTION_KEY, target)
+        pipeline.hset(
+            MIGRATION_KEY,
+            mapping={
+                "status": "completed",
+                "processed": processed,
+                "total": processed,
+                "eta_seconds": 0,
+                "updated_at": _now(),
+                "completed_at": _now(),
+            },
+        )
+        pipeline.execute()
+
+    def _save(self, **fields: Any):
+        """
+        Updates fields of the migration state.
+
+        Args:
+            **fields: The fields to set.
+        """
+        self._client().hset(MIGRATION_KEY, mapping={**fields, "updated_at": _now()})
+
+    def _client(self) -> redis.Redis:
+        """
+        Returns the Redis client, created on first use.
+        """
+        if self._redis is None:
+            self._redis = redis.Redis.from_url(
+                settings.REDIS_URL, socket_connect_timeout=1, socket_timeout=5
+            )
+        return self._redis
+
+
+def _now() -> str:
+    """
+    Returns the current time as an ISO 8601 string.
+    """
+    return datetime.now(timezone.utc).isoformat()
@@ -0,0 +1,302 @@
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import time
+import unicodedata
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+import redis.asyncio
+from redis.exceptions import RedisError
+from settings import settings
+from utils.metrics import COALESCED_REQUESTS
+from .cancellation import CancellationToken, RequestCancelled
+
+# Deletes the lock only if this replica still owns it
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+def normalize_question(question: str) -> str:
+    """
+    Normalizes a question so trivially different spellings share a key.
+
+    Args:
+        question: The user's question.
+
+    Returns:
+        The question case-folded, with collapsed whitespace and without
+        trailing punctuation.
+    """
+    text = unicodedata.normalize("NFKC", question).casefold()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip(" ?!.")
+
+
+def coalescing_key(question: str, **filters: Any) -> str:
+    """
+    Builds the key under which identical requests are coalesced.
+
+    Args:
+        question: The user's question.
+        **filters: Any request options that change the answer.
+
+    Returns:
+        A stable hash of the normalized question and the filters.
+    """
+    payload = json.dumps(
+        {"question": normalize_question(question), **filters},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class RequestCoalescer:
+    """
+    Runs a single execution for concurrent requests with the same key.
+
+    Within a process, callers with the same key attach to the in-flight
+    execution. The execution runs in its own task, with its own cancellation
+    token, so it survives the cancellation of the request that started it
+    while others wait on it, and runs until the latest deadline among them.
+    With Redis, replicas also coordinate: the first one to take the key's
+    lock executes and publishes the result for a few seconds, the others
+    poll for it and execute themselves if the lock disappears without one.
+    A published result is only taken by the replicas that waited on the
+    execution producing it, so a later request is never answered from it.
+    """
+
+    def __init__(self, namespace: str, redis_url: Optional[str] = None):
+        """
+        Initializes the RequestCoalescer.
+
+        Args:
+            namespace: Prefix of the Redis keys, one per kind of request.
+            redis_url: The Redis server shared by the replicas, if any.
+        """
+        self.namespace = namespace
+        self.redis_url = redis_url
+        self._redis = None
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        # Number of callers waiting on each execution
+        self._waiters: Dict[asyncio.Task, int] = {}
+        self._tokens: Dict[asyncio.Task, CancellationToken] = {}
+
+    async def run(
+        self,
+        key: str,
+        execute: Callable[[CancellationToken], Awaitable[Any]],
+        deadline: Optional[float] = None,
+    ) -> Any:
+        """
+        Returns the result of `execute`, shared with concurrent callers.
+
+        The execution is cancelled once every caller waiting on it has left.
+        Its token's deadline is the latest of its callers', while each caller
+        stops waiting at its own deadline.
+
+        Args:
+            key: The coalescing key of the request.
+            execute: Produces the result, stopping when the given token is
+                cancelled or its deadline passes. With Redis, the result
+                must be JSON-serializable.
+            deadline: The `time.monotonic()` by which the caller needs the
+                result, if any.
+
+        Returns:
+            The result.
+
+        Raises:
+            RequestCancelled: If the caller's deadline passes first.
+        """
+        task = self._in_flight.get(key)
+        if task is not None and not self._tokens[task].cancelled:
+            COALESCED_REQUESTS.labels("local").inc()
+            self._tokens[task].extend(deadline)
+        else:
+            token = CancellationToken(deadline)
+            task = asyncio.ensure_future(
+                self._execute(key, lambda: execute(token), token)
+            )
+            self._in_flight[key] = task
+            self._tokens[task] = token
+            task.add_done_callback(lambda done: self._forget(key, done))
+
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            timeout = None if deadline is None else deadline - time.monotonic()
+            # Unlike awaiting the task, waiting on it never cancels it
+            done, _ = await asyncio.wait({task}, timeout=timeout)
+            if not done:
+                raise RequestCancelled("deadline", "coalescing")
+            return task.result()
+        except (asyncio.CancelledError, RequestCancelled):
+            if self._waiters[task] == 1 and not task.done():
+                task.cancel()
+            raise
+        finally:
+            self._waiters[task] -= 1
+            if self._waiters[task] == 0:
+                del self._waiters[task]
+
+    def _forget(self, key: str, task: asyncio.Task):
+        """
+        Removes a finished execution, unless a newer one replaced it.
+
+        Args:
+            key: The coalescing key of the execution.
+            task: The finished execution.
+        """
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        del self._tokens[task]
+
+    async def _execute(
+        self,
+        key: str,
+        execute: Callable[[], Awaitable[Any]],
+        token: CancellationToken,
+    ) -> Any:
+        """
+        Executes the request, coordinating with other replicas if configured.
+
+        Args:
+            key: The coalescing key of the request.
+            execute: Produces the result.
+            token: The cancellation token of the execution.
+
+        Returns:
+            The result.
+        """
+        client = self._client()
+        if client is None:
+            return await execute()
+        try:
+            return await self._execute_shared(client, key, execute, token)
+        except RedisError as e:
+            logging.warning(f"Redis unavailable, not coalescing across replicas: {e}")
+            return await execute()
+
+    async def _execute_shared(
+        self,
+        client,
+        key: str,
+        execute: Callable[[], Awaitable[Any]],
+        token: CancellationToken,
+    ) -> Any:
+        """
+        Executes the request once across replicas.
+
+        Args:
+            client: The Redis client.
+            key: The coalescing key of the request.
+            execute: Produces the result.
+            token: The cancellation token of the execution, checked while
+                waiting for another replica.
+
+        Returns:
+            The result, computed here or by another replica.
+
+        Raises:
+            RequestCancelled: If the execution is cancelled while waiting.
+        """
+        lock_key = f"{self.namespace}:lock:{key}"
+        result_key = f"{self.namespace}:result:{key}"
+        owner = uuid.uuid4().hex
+        lock_ttl_ms = int(settings.COALESCING_LOCK_TTL_S * 1000)
+        # Lock owners seen while waiting, whose results this request can take
+        waited_on: Set[str] = set()
+
+        while True:
+            if await client.set(lock_key, owner, nx=True, px=lock_ttl_ms):
+                break
+            holder = await client.get(lock_key)
+            if holder is not None:
+                waited_on.add(holder.decode())
+            cached = await self._published(client, result_key, waited_on)
+            if cached is not None:
+                return cached
+            token.check("coalescing")
+            await asyncio.sleep(settings.COALESCING_POLL_INTERVAL_S)
+
+        try:
+            # The previous owner may have published its result just before
+            # releasing the lock
+            cached = await self._published(client, result_key, waited_on)
+            if cached is not None:
+                await self._release(client, lock_key, owner)
+                return cached
+            result = await execute()
+        except BaseException:
+            await self._release(client, lock_key, owner)
+            raise
+
+        try:
+            await client.set(
+                result_key,
+                json.dumps({"owner": owner, "result": result}),
+                px=int(settings.COALESCING_RESULT_TTL_S * 1000),
+            )
+        except RedisError as e:
+            logging.warning(f"Could not share a coalesced result: {e}")
+        await self._release(client, lock_key, owner)
+        return result
+
+    async def _published(
+        self, client, result_key: str, waited_on: Set[str]
+    ) -> Optional[Any]:
+        """
+        Reads the result published by an execution this request waited on.
+
+        Args:
+            client: The Redis client.
+            result_key: The Redis key of the result.
+            waited_on: The lock owners seen while waiting.
+
+        Returns:
+            The result, or None if none was published by those owners.
+        """
+        cached = await client.get(result_key) if waited_on else None
+        if cached is None:
+            return None
+        published = json.loads(cached)
+        if published["owner"] not in waited_on:
+            return None
+        COALESCED_REQUESTS.labels("redis").inc()
+        return published["result"]
+
+    async def _release(self, client, lock_key: str, owner: str):
+        """
+        Releases the lock of a key if this replica still owns it.
+
+        Args:
+            client: The Redis client.
+            lock_key: The Redis key of the lock.
+            owner: The value written when the lock was taken.
+        """
+        try:
+            await client.eval(RELEASE_LOCK_SCRIPT, 1, lock_key, owner)
+        except RedisError as e:
+            # The lock expires on its own
+            logging.warning(f"Could not release coalescing lock {lock_key}: {e}")
+
+    def _client(self):
+        """
+        Returns the Redis client, created on first use.
+
+        Returns:
+            The async Redis client, or None without a Redis URL.
+        """
+        if self.redis_url is None:
+            return None
+        if self._redis is None:
+            self._redis = redis.asyncio.from_url(
+                self.redis_url, socket_connect_timeout=1, socket_timeout=5
+            )
+        return self._redis
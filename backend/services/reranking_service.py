@@ -1,5 +1,13 @@
-from typing import List, Dict, Any
+import time
+from typing import List, Dict, Any, Optional
 from sentence_transformers import CrossEncoder
+from .admission_control import stage_slot
+from .cancellation import check_cancelled
+
+# Weight of the latest measurement in the per-pair latency average
+LATENCY_SMOOTHING = 0.2
+# Pairs scored per model call, between which cancellation is checked
+PREDICT_BATCH_SIZE = 32
 
 
 class RerankingService:
@@ -12,6 +20,22 @@ class RerankingService:
         Initializes the RerankingService.
         """
         self.model = CrossEncoder("cross-encoder/ms-marco-MiniLM-L6-v2", max_length=512)
+        # Moving average of the model time per (query, document) pair
+        self.seconds_per_pair: Optional[float] = None
+
+    def estimate_latency(self, n_pairs: int) -> Optional[float]:
+        """
+        Estimates how long reranking a number of pairs will take.
+
+        Args:
+            n_pairs: The number of (query, document) pairs.
+
+        Returns:
+            The estimated duration in seconds, or None before the first call.
+        """
+        if self.seconds_per_pair is None:
+            return None
+        return self.seconds_per_pair * n_pairs
 
     def rerank_documents(
         self, query: str, retrieved_docs: Dict[str, Any]
@@ -24,28 +48,81 @@ class RerankingService:
             retrieved_docs: The documents retrieved from the vector store.
 
         Returns:
-            A dictionary of re-ranked documents in the same format as the input.
+            A dictionary of re-ranked documents in the same format as the input,
+            with the reranker scores under "scores".
         """
         if not retrieved_docs["documents"] or not retrieved_docs["documents"][0]:
             return retrieved_docs
 
-        doc_texts = retrieved_docs["documents"][0]
-        metadatas = retrieved_docs["metadatas"][0]
-        ids = retrieved_docs["ids"][0]
+        return self.rerank_batch([query], retrieved_docs)
+
+    def rerank_batch(
+        self, queries: List[str], retrieved_docs: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """
+        Re-ranks the results of several queries with a single model call.
+
+        Args:
+            queries: The user's queries.
+            retrieved_docs: The documents retrieved from the vector store, one
+                result list per query.
+
+        Returns:
+            A dictionary of re-ranked documents in the same format as the input,
+            with the reranker scores under "scores".
+        """
+        pairs = [
+            [query, doc_text]
+            for query, doc_texts in zip(queries, retrieved_docs["documents"])
+            for doc_text in doc_texts
+        ]
+        all_scores = list(self._predict(pairs)) if pairs else []
 
-        pairs = [[query, doc_text] for doc_text in doc_texts]
-        scores = self.model.predict(pairs)
+        reranked = {"documents": [], "metadatas": [], "ids": [], "scores": []}
+        offset = 0
+        for i in range(len(queries)):
+            doc_texts = retrieved_docs["documents"][i]
+            metadatas = retrieved_docs["metadatas"][i]
+            ids = retrieved_docs["ids"][i]
+            scores = all_scores[offset : offset + len(doc_texts)]
+            offset += len(doc_texts)
 
-        # Combine documents with their scores and sort
-        scored_docs = sorted(
-            zip(scores, doc_texts, metadatas, ids), key=lambda x: x[0], reverse=True
-        )
+            # Combine documents with their scores and sort
+            scored_docs = sorted(
+                zip(scores, doc_texts, metadatas, ids),
+                key=lambda x: x[0],
+                reverse=True,
+            )
+            reranked["scores"].append([float(doc[0]) for doc in scored_docs])
+            reranked["documents"].append([doc[1] for doc in scored_docs])
+            reranked["metadatas"].append([doc[2] for doc in scored_docs])
+            reranked["ids"].append([doc[3] for doc in scored_docs])
+        return reranked
 
-        # Unzip the sorted documents
-        scores, doc_texts, metadatas, ids = zip(*scored_docs)
+    def _predict(self, pairs: List[List[str]]) -> List[float]:
+        """
+        Scores (query, document) pairs and records the time it took.
 
-        return {
-            "documents": [list(doc_texts)],
-            "metadatas": [list(metadatas)],
-            "ids": [list(ids)],
-        }
+        A cancelled request stops between batches of pairs, freeing its slot
+        for other requests.
+
+        Args:
+            pairs: The pairs to score.
+
+        Returns:
+            One relevance score per pair.
+        """
+        with stage_slot("rerank"):
+            start = time.perf_counter()
+            scores: List[float] = []
+            for i in range(0, len(pairs), PREDICT_BATCH_SIZE):
+                check_cancelled("rerank")
+                scores.extend(self.model.predict(pairs[i : i + PREDICT_BATCH_SIZE]))
+            per_pair = (time.perf_counter() - start) / len(pairs)
+        if self.seconds_per_pair is None:
+            self.seconds_per_pair = per_pair
+        else:
+            self.seconds_per_pair += LATENCY_SMOOTHING * (
+                per_pair - self.seconds_per_pair
+            )
+        return scores
@@ -0,0 +1,320 @@
+import json
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, Optional
+import redis
+import redis.asyncio
+from redis.exceptions import RedisError
+from settings import settings
+
+# Numbers an event, keeps it as the task's status and publishes it. The
+# number lets a subscriber skip the events already covered by the status it
+# read, and resume after the last event it received.
+PUBLISH_SCRIPT = """
+local seq = redis.call("HINCRBY", KEYS[1], "seq", 1)
+local event = '{"seq": ' .. seq .. ', ' .. string.sub(ARGV[1], 2)
+redis.call("HSET", KEYS[1], "event", event)
+redis.call("EXPIRE", KEYS[1], ARGV[2])
+redis.call("PUBLISH", KEYS[2], event)
+return seq
+"""
+# States after which a task publishes no more events
+TERMINAL_STATES = ("SUCCESS", "FAILURE")
+
+
+class TaskStatusUnavailable(Exception):
+    """
+    Raised when the status of a task cannot be read.
+    """
+
+
+def _status_key(task_id: str) -> str:
+    return f"task_status:{task_id}"
+
+
+def _events_channel(task_id: str) -> str:
+    return f"task_events:{task_id}"
+
+
+def _publish_args(event: Dict[str, Any]) -> tuple:
+    """
+    Builds the arguments of `PUBLISH_SCRIPT` for an event.
+
+    Args:
+        event: The event, with at least its task_id.
+
+    Returns:
+        The number of keys, the keys and the arguments.
+    """
+    task_id = event["task_id"]
+    return (
+        2,
+        _status_key(task_id),
+        _events_channel(task_id),
+        json.dumps(event),
+        settings.TASK_STATUS_TTL_S,
+    )
+
+
+class TaskProgress:
+    """
+    Publishes the progress of an ingestion task as it runs.
+
+    Each event is kept in Redis as the task's status and published on the
+    task's channel, where the API streams it to subscribed clients.
+    Publishing is best effort: ingestion goes on if Redis is unavailable.
+    """
+
+    def __init__(self, task, client: Optional[redis.Redis] = None, **fields: Any):
+        """
+        Initializes the TaskProgress.
+
+        Args:
+            task: The bound Celery task. Stage changes are also stored as its
+                PROGRESS state in the result backend.
+            client: The Redis client, created on first use if not given.
+            **fields: Fields of every event, such as the ingestion lane.
+        """
+        self.task = task
+        self.task_id = task.request.id
+        self._redis = client
+        self._status: Dict[str, Any] = {"task_id": self.task_id, **fields}
+        self._chunks_started = time.monotonic()
+        self._chunks_at_start = 0
+
+    def stage(
+        self,
+        stage: str,
+        message: str,
+        processed: Optional[int] = None,
+        total: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """
+        Reports that the task entered a stage.
+
+        Args:
+            stage: The stage name.
+            message: A human-readable description of the stage.
+            processed: The chunks already processed, if known.
+            total: The chunks of the document, if known.
+
+        Returns:
+            The published event.
+        """
+        # Throughput is measured from the start of the stage
+        self._chunks_started = time.monotonic()
+        self._chunks_at_start = processed or 0
+        fields = {"processed": processed, "total": total}
+        event = self._publish(
+            state="PROGRESS",
+            stage=stage,
+            message=message,
+            chunks_per_second=None,
+            eta_seconds=None,
+            **{key: value for key, value in fields.items() if value is not None},
+        )
+        self.task.update_state(state="PROGRESS", meta=event)
+        return event
+
+    def chunks(self, processed: int, total: int) -> Dict[str, Any]:
+        """
+        Reports the chunks processed so far by the current stage.
+
+        The throughput is measured since the start of the stage, and the
+        time remaining assumes the remaining chunks go at the same pace.
+
+        Args:
+            processed: The chunks processed.
+            total: The chunks to process.
+
+        Returns:
+            The published event.
+        """
+        elapsed = time.monotonic() - self._chunks_started
+        rate = (processed - self._chunks_at_start) / elapsed if elapsed > 0 else 0.0
+        return self._publish(
+            processed=processed,
+            total=total,
+            chunks_per_second=round(rate, 2) if rate else None,
+            eta_seconds=round((total - processed) / rate, 1) if rate else None,
+        )
+
+    def finish(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Reports the outcome of the task.
+
+        Args:
+            result: The task result, with its "status" and any "error".
+
+        Returns:
+            The published event.
+        """
+        succeeded = result.get("status") == "success"
+        return self._publish(
+            state="SUCCESS" if succeeded else "FAILURE",
+            stage=None,
+            message="Document processed" if succeeded else "Processing failed",
+            eta_seconds=0 if succeeded else None,
+            error=result.get("error"),
+            result=result,
+        )
+
+    def _publish(self, **fields: Any) -> Dict[str, Any]:
+        """
+        Updates the task's status and publishes it.
+
+        Args:
+            **fields: The fields that changed.
+
+        Returns:
+            The task's status, numbered if it was published.
+        """
+        self._status.update(fields, updated_at=_now())
+        try:
+            seq = self._client().eval(PUBLISH_SCRIPT, *_publish_args(self._status))
+        except RedisError as e:
+            logging.warning(f"Could not publish the status of task {self.task_id}: {e}")
+            return dict(self._status)
+        return {"seq": seq, **self._status}
+
+    def _client(self) -> redis.Redis:
+        """
+        Returns the Redis client, created on first use.
+        """
+        if self._redis is None:
+            self._redis = redis.Redis.from_url(
+                settings.REDIS_URL, socket_connect_timeout=1, socket_timeout=5
+            )
+        return self._redis
+
+
+class TaskStatusService:
+    """
+    A service for reading the status of ingestion tasks and following their
+    progress, from the events published by `TaskProgress`.
+    """
+
+    def __init__(self, redis_url: Optional[str] = None):
+        """
+        Initializes the TaskStatusService.
+
+        Args:
+            redis_url: The Redis server the workers publish to. Defaults to
+                the configured one.
+        """
+        self.redis_url = redis_url or settings.REDIS_URL
+        self._redis = None
+
+    async def queued(self, task_id: str, **fields: Any):
+        """
+        Records a task as queued, so its status is known before a worker
+        picks it up. Must be called before the task is sent.
+
+        Args:
+            task_id: The id the task will be sent with.
+            **fields: Other fields of the status, such as the ingestion lane.
+        """
+        event = {
+            "task_id": task_id,
+            "state": "QUEUED",
+            **fields,
+            "updated_at": _now(),
+        }
+        try:
+            await self._client().eval(PUBLISH_SCRIPT, *_publish_args(event))
+        except RedisError as e:
+            logging.warning(f"Could not record task {task_id} as queued: {e}")
+
+    async def status(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Reads the last status of a task.
+
+        Args:
+            task_id: The task id.
+
+        Returns:
+            The last event of the task, or None if the task is unknown or
+            finished more than `TASK_STATUS_TTL_S` ago.
+
+        Raises:
+            TaskStatusUnavailable: If Redis is unavailable.
+        """
+        try:
+            event = await self._client().hget(_status_key(task_id), "event")
+        except RedisError as e:
+            raise TaskStatusUnavailable(
+                f"Could not read the status of task {task_id}: {e}"
+            ) from e
+        return json.loads(event) if event is not None else None
+
+    async def events(
+        self, task_id: str, after: int = 0
+    ) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """
+        Follows the progress of a task until it ends.
+
+        The current status comes first, then every later event. None is
+        yielded when no event came for `TASK_EVENTS_KEEPALIVE_S`, so the
+        caller can keep its connection alive. The events end early if Redis
+        becomes unavailable, and a client resuming from the last one it
+        received misses none.
+
+        Args:
+            task_id: The task id.
+            after: The number of the last event already received, when
+                resuming.
+
+        Yields:
+            The events of the task, or None while it is quiet.
+        """
+        pubsub = self._client().pubsub()
+        try:
+            # Subscribe before reading the status, so no event falls in
+            # between
+            await pubsub.subscribe(_events_channel(task_id))
+            event = await self.status(task_id)
+            while event is not None:
+                if event["seq"] > after:
+                    after = event["seq"]
+                    yield event
+                if event["state"] in TERMINAL_STATES:
+                    return
+                message = await pubsub.get_message(
+                    ignore_subscribe_messages=True,
+                    timeout=settings.TASK_EVENTS_KEEPALIVE_S,
+                )
+                if message is not None:
+                    event = json.loads(message["data"])
+                    continue
+                yield None
+                # Catches up on events missed by the subscription, and ends
+                # the stream once the status expired
+                event = await self.status(task_id)
+        except (RedisError, TaskStatusUnavailable) as e:
+            logging.warning(f"Stopped following task {task_id}: {e}")
+        finally:
+            try:
+                await pubsub.unsubscribe()
+            except RedisError:
+                pass
+            await pubsub.aclose()
+
+    def _client(self):
+        """
+        Returns the async Redis client, created on first use.
+        """
+        if self._redis is None:
+            # Waiting for events sets its own read timeout, the keep-alive
+            # interval, so socket_timeout only bounds the other commands
+            self._redis = redis.asyncio.from_url(
+                self.redis_url, socket_connect_timeout=1, socket_timeout=5
+            )
+        return self._redis
+
+
+def _now() -> str:
+    """
+    Returns the current time as an ISO 8601 string.
+    """
+    return datetime.now(timezone.utc).isoformat()
@@ -1,3 +1,4 @@
+from typing import Optional
 from pydantic_settings import BaseSettings
 
 
@@ -9,10 +10,85 @@ class Settings(BaseSettings):
     GOOGLE_AI_API_KEY: str
     CHROMA_HOST: str = "chroma"
     CHROMA_PORT: int = 8000
+    # Gemini models ("models/...") use the API, anything else runs locally
+    # through sentence-transformers
     EMBEDDING_MODEL: str = "models/text-embedding-004"
+    # Local embedding backend tuning
+    EMBEDDING_BATCH_SIZE: int = 32
+    EMBEDDING_NUM_THREADS: Optional[int] = None
+    EMBEDDING_ONNX: bool = False
+    # Reduced output size requested from the embedding model (None = full size)
+    EMBEDDING_DIMENSIONALITY: Optional[int] = None
+    # Re-indexing into a new collection: chunks read per page, pages embedded
+    # concurrently, and how often the API re-reads the active collection
+    REINDEX_PAGE_SIZE: int = 200
+    REINDEX_CONCURRENCY: int = 4
+    ACTIVE_COLLECTION_REFRESH_S: float = 5.0
     LLM_MODEL: str = "Gemini 2.0 Flash-Lite"
     TEMPERATURE: float = 0.3
+    # Chunks kept after reranking and the LLM context assembled from them
+    RERANK_TOP_K: int = 5
+    CONTEXT_TOKEN_BUDGET: int = 3000
+    CONTEXT_DUPLICATE_THRESHOLD: float = 0.85
+    # Batch chat: concurrent LLM calls and questions processed per step
+    BATCH_CHAT_MAX_CONCURRENCY: int = 4
+    BATCH_CHAT_CHUNK_SIZE: int = 32
+    # Concurrent /chat requests with the same question share one execution,
+    # across replicas through Redis if enabled
+    CHAT_COALESCING: bool = True
+    CHAT_COALESCING_ACROSS_REPLICAS: bool = False
+    COALESCING_LOCK_TTL_S: float = 120.0
+    COALESCING_RESULT_TTL_S: float = 5.0
+    COALESCING_POLL_INTERVAL_S: float = 0.05
+    # Admission control: concurrent calls and waiting calls per stage, and
+    # the time a request has to complete before it is shed
+    LLM_MAX_CONCURRENCY: int = 8
+    LLM_MAX_QUEUE: int = 32
+    EMBEDDING_MAX_CONCURRENCY: int = 8
+    EMBEDDING_MAX_QUEUE: int = 64
+    RERANK_MAX_CONCURRENCY: int = 2
+    RERANK_MAX_QUEUE: int = 32
+    CHAT_DEADLINE_S: float = 30.0
+    BATCH_CHAT_DEADLINE_S: float = 300.0
+    # How often /chat checks whether its client is still connected
+    DISCONNECT_POLL_INTERVAL_S: float = 0.25
+    # Gemini quotas shared by all replicas and workers through Redis (None
+    # means unlimited). Batch work leaves QUOTA_INTERACTIVE_RESERVE of each
+    # quota to interactive requests and waits at most QUOTA_MAX_WAIT_S.
+    LLM_REQUESTS_PER_MINUTE: Optional[int] = None
+    LLM_TOKENS_PER_MINUTE: Optional[int] = None
+    EMBEDDING_REQUESTS_PER_MINUTE: Optional[int] = None
+    EMBEDDING_TOKENS_PER_MINUTE: Optional[int] = None
+    QUOTA_INTERACTIVE_RESERVE: float = 0.2
+    QUOTA_MAX_WAIT_S: float = 300.0
+    # Output tokens assumed for an LLM call until its usage is known
+    LLM_OUTPUT_TOKENS_ESTIMATE: int = 512
     SYSTEM_PROMPT_PATH: str = "prompts/system_prompt.md"
+    # Add per-stage timings to API responses as a Server-Timing header
+    EXPOSE_TIMING_HEADER: bool = False
+    # Port of the worker's Prometheus exporter (0 disables it)
+    WORKER_METRICS_PORT: int = 9100
+    # Restart the worker once a task leaves it above this resident memory
+    # (None disables), optionally writing a tracemalloc report of what grew
+    WORKER_MAX_RSS_MB: Optional[int] = None
+    WORKER_TRACEMALLOC: bool = False
+    WORKER_PROFILE_DIR: str = "/data/profiles"
+    # Ingestion lanes: uploads whose estimated processing time reaches
+    # INGEST_HEAVY_COST_S go to the heavy queue, the others to the fast one.
+    # The estimate adds a cost per MB, per page, and per page needing OCR.
+    INGEST_FAST_QUEUE: str = "ingest_fast"
+    INGEST_HEAVY_QUEUE: str = "ingest_heavy"
+    INGEST_HEAVY_COST_S: float = 60.0
+    INGEST_COST_S_PER_MB: float = 1.0
+    INGEST_COST_S_PER_PAGE: float = 0.5
+    INGEST_COST_S_PER_OCR_PAGE: float = 5.0
+    # Ingestion status: how long it is kept, chunks embedded between progress
+    # events, and the keep-alive interval of the status event stream
+    TASK_STATUS_TTL_S: int = 3600
+    INGEST_PROGRESS_BATCH_SIZE: int = 200
+    TASK_EVENTS_KEEPALIVE_S: float = 15.0
+    # Redis used for coordination between replicas
+    REDIS_URL: str = "redis://redis:6379/0"
     CELERY_BROKER_URL: str = "redis://redis:6379/0"
     CELERY_RESULT_BACKEND: str = "redis://redis:6379/0"
 
@@ -25,6 +101,17 @@ class Settings(BaseSettings):
         "enable_utc": True,
         "task_track_started": True,
         "result_expires": 3600,
+        # Message priorities, kept by Redis in one list per step, let uploads
+        # of users with fewer queued documents go first within each queue.
+        # queue_order_strategy only orders the queues a worker consumes.
+        "broker_transport_options": {
+            "priority_steps": list(range(10)),
+            "sep": ":",
+            "queue_order_strategy": "priority",
+        },
+        # Workers reserve one message at a time, so a higher-priority upload
+        # is not held behind messages already fetched
+        "worker_prefetch_multiplier": 1,
     }
 
     class Config:
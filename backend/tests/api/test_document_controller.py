@@ -0,0 +1,222 @@
+import asyncio
+import json
+import time
+import pytest
+from services.admission_control import AdmissionRejected
+from services.cancellation import RequestCancelled, check_cancelled
+from services.embedding_service import EmbeddingService
+
+
+@pytest.fixture
+def app(mocker):
+    """
+    Fixture for the real FastAPI app, with its middleware, without a Chroma
+    server or the reranking model.
+    """
+    mocker.patch("repositories.vector_store_repository.chromadb.HttpClient")
+    mocker.patch("services.reranking_service.CrossEncoder")
+    from main import app
+
+    return app
+
+
+@pytest.fixture
+def controller(app):
+    """
+    Fixture for the controller module of the app.
+    """
+    import api.document_controller as controller
+
+    return controller
+
+
+async def _call(app, method, path, body=None, headers=(), disconnect_after=None):
+    """
+    Sends a request straight to the ASGI app, as the server would.
+
+    Args:
+        app: The ASGI app.
+        method: The HTTP method.
+        path: The request path.
+        body: The JSON body, if any.
+        headers: Extra request headers.
+        disconnect_after: Seconds after which the client disconnects.
+
+    Returns:
+        The status code, headers and body of the response.
+    """
+    content = json.dumps(body).encode() if body is not None else b""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"content-type", b"application/json"), *headers],
+        "client": ("127.0.0.1", 50000),
+        "server": ("testserver", 80),
+    }
+    requests = [{"type": "http.request", "body": content, "more_body": False}]
+    gone = asyncio.Event()
+    if disconnect_after is not None:
+        asyncio.get_running_loop().call_later(disconnect_after, gone.set)
+    response = {"headers": {}, "body": b""}
+
+    async def receive():
+        if requests:
+            return requests.pop(0)
+        await gone.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = {
+                key.decode(): value.decode() for key, value in message["headers"]
+            }
+        elif message["type"] == "http.response.body":
+            response["body"] += message.get("body", b"")
+
+    await app(scope, receive, send)
+    return response["status"], response["headers"], response["body"]
+
+
+@pytest.mark.asyncio
+async def test_chat_stops_when_the_client_disconnects(app, controller, mocker):
+    """
+    Tests that the pipeline stops once the client left, through the app's
+    middleware.
+    """
+    # Arrange
+    stages = []
+
+    def run(question):
+        for stage in range(100):
+            check_cancelled(f"stage_{stage}")
+            stages.append(stage)
+            time.sleep(0.01)
+        return {"response": "too late", "context_report": {}}
+
+    mocker.patch.object(controller.rag_service, "run", side_effect=run)
+
+    # Act
+    status, _, body = await _call(
+        app,
+        "POST",
+        "/api/chat",
+        {"question": "What is the leave policy?"},
+        disconnect_after=0.1,
+    )
+    await asyncio.sleep(0.1)
+
+    # Assert
+    assert status == 499
+    assert json.loads(body)["stage"] == "client"
+    assert 0 < len(stages) < 50
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "error, status, retry_after",
+    [
+        (AdmissionRejected("embedding quota", 429, 2.0, "quota exhausted"), 429, "2"),
+        (RequestCancelled("deadline", "embedding quota"), 504, None),
+    ],
+)
+async def test_search_reports_shed_and_cancelled_embeddings(
+    app, controller, mocker, error, status, retry_after
+):
+    """
+    Tests that a query embedding rejected for quota or cancelled is answered
+    as such, instead of searching with an empty embedding.
+    """
+    # Arrange
+    mocker.patch("services.embedding_service.create_embedding_backend")
+    embedding_service = EmbeddingService()
+    embedding_service.backend.embed_query.side_effect = error
+    mocker.patch.object(
+        controller.rag_service,
+        "_query_embedding_service",
+        return_value=embedding_service,
+    )
+
+    # Act
+    response_status, headers, _ = await _call(
+        app, "POST", "/api/search", {"query": "leave policy"}
+    )
+
+    # Assert
+    assert response_status == status
+    assert headers.get("retry-after") == retry_after
+
+
+@pytest.mark.asyncio
+async def test_batch_chat_gives_each_chunk_its_own_deadline(app, controller, mocker):
+    """
+    Tests that the chunks of a batch do not share one deadline, so late
+    chunks are not shed for the time spent on earlier ones.
+    """
+    # Arrange
+    mocker.patch.object(controller.settings, "BATCH_CHAT_CHUNK_SIZE", 1)
+    mocker.patch.object(controller.settings, "BATCH_CHAT_DEADLINE_S", 0.2)
+
+    def batch(questions):
+        _, deadline = controller.current_admission()
+        assert deadline > time.monotonic()
+        time.sleep(0.15)
+        return [{"question": q, "response": "answer"} for q in questions]
+
+    mocker.patch.object(controller.rag_service, "batch", side_effect=batch)
+
+    # Act
+    status, _, body = await _call(
+        app, "POST", "/api/chat/batch", {"questions": ["a", "b", "c"]}
+    )
+
+    # Assert
+    assert status == 200
+    assert [r["response"] for r in json.loads(body)["results"]] == ["answer"] * 3
+
+
+@pytest.mark.asyncio
+async def test_streamed_batch_chat_reports_shed_chunks_per_question(
+    app, controller, mocker
+):
+    """
+    Tests that a chunk shed after the stream started gets an error line for
+    each of its questions, and the later chunks are still answered.
+    """
+    # Arrange
+    mocker.patch.object(controller.settings, "BATCH_CHAT_CHUNK_SIZE", 2)
+
+    def batch(questions):
+        if "c" in questions:
+            raise AdmissionRejected("batch", 503, 1, "deadline too close")
+        return [{"question": q, "response": "answer"} for q in questions]
+
+    mocker.patch.object(controller.rag_service, "batch", side_effect=batch)
+
+    # Act
+    status, _, body = await _call(
+        app,
+        "POST",
+        "/api/chat/batch",
+        {"questions": ["a", "b", "c", "d", "e"], "stream": True},
+    )
+
+    # Assert
+    lines = [json.loads(line) for line in body.decode().splitlines()]
+    assert status == 200
+    assert [line["index"] for line in lines] == [0, 1, 2, 3, 4]
+    assert [line["response"] for line in lines] == [
+        "answer",
+        "answer",
+        None,
+        None,
+        "answer",
+    ]
+    assert "overloaded" in lines[2]["error"] and "overloaded" in lines[3]["error"]
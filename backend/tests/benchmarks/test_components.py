@@ -0,0 +1,54 @@
+from benchmarks.components import StubCollection, compare
+
+
+def test_compare_flags_regressions_against_baseline():
+    """
+    Tests that medians beyond the tolerance are reported as regressions or
+    improvements, and unknown or skipped benchmarks are labelled.
+    """
+    # Arrange
+    baseline = {
+        "steady": {"median_ms": 10.0},
+        "slower": {"median_ms": 10.0},
+        "faster": {"median_ms": 10.0},
+    }
+    results = {
+        "steady": {"median_ms": 11.0},
+        "slower": {"median_ms": 13.0},
+        "faster": {"median_ms": 7.0},
+        "added": {"median_ms": 1.0},
+        "documents": {"skipped": "docling unavailable"},
+    }
+
+    # Act
+    rows = compare(results, baseline, tolerance=0.25)
+
+    # Assert
+    assert {row["name"]: row["status"] for row in rows} == {
+        "steady": "ok",
+        "slower": "regression",
+        "faster": "improvement",
+        "added": "new",
+        "documents": "skipped",
+    }
+
+
+def test_stub_collection_returns_nearest_vectors():
+    """
+    Tests that the Chroma stand-in answers queries in the Chroma format.
+    """
+    collection = StubCollection("documents")
+    collection.add(
+        ids=["a", "b"],
+        documents=["doc a", "doc b"],
+        metadatas=[{"source": "a"}, {"source": "b"}],
+        embeddings=[[1.0, 0.0], [0.0, 1.0]],
+    )
+
+    result = collection.query(
+        [[0.9, 0.1]], n_results=1, include=["documents", "distances"]
+    )
+
+    assert result["ids"] == [["a"]]
+    assert result["documents"] == [["doc a"]]
+    assert collection.payload_bytes > 0
@@ -0,0 +1,28 @@
+import pytest
+from google.api_core.exceptions import ResourceExhausted
+from benchmarks.load_test import FakeGemini, percentiles
+
+
+def test_fake_gemini_rejects_calls_over_quota():
+    """
+    Tests that the fake Gemini answers 429 once the per-minute quota is spent.
+    """
+    # Arrange
+    gemini = FakeGemini(llm_latency_ms=1, embed_latency_ms=1, requests_per_minute=2)
+
+    # Act
+    gemini.embed_content("models/text-embedding-004", "first")
+    gemini.embed_content("models/text-embedding-004", ["second", "third"])
+
+    # Assert
+    with pytest.raises(ResourceExhausted):
+        gemini.generate("over quota")
+    assert gemini.stats == {"embed": 2, "generate_429": 1}
+
+
+def test_percentiles():
+    """
+    Tests the latency percentiles, with and without samples.
+    """
+    assert percentiles([float(i) for i in range(1, 101)])["p50"] == 50.5
+    assert percentiles([]) == {"p50": None, "p95": None, "p99": None}
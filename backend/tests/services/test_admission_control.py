@@ -0,0 +1,87 @@
+import threading
+import time
+import pytest
+from services.admission_control import AdmissionRejected, StageLimiter
+
+
+def wait_for_waiters(limiter: StageLimiter, count: int):
+    """
+    Waits until the limiter has the given number of queued calls.
+    """
+    while len(limiter._waiting) < count:
+        time.sleep(0.001)
+
+
+def test_interactive_calls_are_served_before_batch_calls():
+    """
+    Tests that a queued interactive call overtakes an earlier batch call.
+    """
+    # Arrange
+    limiter = StageLimiter("llm", max_concurrency=1, max_queue=10)
+    order = []
+
+    def call(name, priority):
+        with limiter.slot(priority, deadline=None):
+            order.append(name)
+
+    # Act
+    with limiter.slot("interactive", deadline=None):
+        batch = threading.Thread(target=call, args=("batch", "batch"))
+        batch.start()
+        wait_for_waiters(limiter, 1)
+        interactive = threading.Thread(target=call, args=("chat", "interactive"))
+        interactive.start()
+        wait_for_waiters(limiter, 2)
+    batch.join()
+    interactive.join()
+
+    # Assert
+    assert order == ["chat", "batch"]
+
+
+def test_full_queue_rejects_with_429():
+    """
+    Tests that calls beyond the queue bound are rejected, except for those of
+    a higher priority than the queued ones.
+    """
+    limiter = StageLimiter("rerank", max_concurrency=1, max_queue=1)
+
+    def queued_call():
+        with limiter.slot("batch", deadline=None):
+            pass
+
+    with limiter.slot("interactive", deadline=None):
+        waiter = threading.Thread(target=queued_call)
+        waiter.start()
+        wait_for_waiters(limiter, 1)
+
+        with pytest.raises(AdmissionRejected) as rejected:
+            with limiter.slot("batch", deadline=None):
+                pass
+        # Queued batch calls do not fill the queue for interactive ones, which
+        # wait until their deadline instead
+        with pytest.raises(AdmissionRejected) as timed_out:
+            with limiter.slot("interactive", deadline=time.monotonic() + 0.01):
+                pass
+    waiter.join()
+
+    assert rejected.value.status_code == 429
+    assert rejected.value.retry_after >= 1
+    assert timed_out.value.status_code == 503
+
+
+def test_unreachable_deadline_rejects_with_503():
+    """
+    Tests that a call is shed upfront when the expected wait exceeds its
+    deadline.
+    """
+    limiter = StageLimiter("llm", max_concurrency=1, max_queue=10)
+    limiter.seconds_per_call = 2.0
+
+    with limiter.slot("interactive", deadline=None):
+        with pytest.raises(AdmissionRejected) as rejected:
+            with limiter.slot("interactive", deadline=time.monotonic() + 1):
+                pass
+
+    assert rejected.value.status_code == 503
+    assert rejected.value.retry_after == 2
@@ -0,0 +1,46 @@
+import threading
+import time
+import pytest
+from services.cancellation import (
+    CancellationToken,
+    RequestCancelled,
+    cancellable,
+    check_cancelled,
+    sleep,
+)
+
+
+def test_check_cancelled_only_stops_cancellable_work():
+    """
+    Tests that work outside `cancellable` is never stopped, and that work
+    inside it stops once the deadline passes.
+    """
+    # Arrange
+    token = CancellationToken(deadline=time.monotonic() - 1)
+
+    # Act
+    check_cancelled("ingestion")
+    with cancellable(token):
+        with pytest.raises(RequestCancelled) as cancelled:
+            check_cancelled("retrieve_documents")
+
+    # Assert
+    assert cancelled.value.reason == "deadline"
+    assert cancelled.value.stage == "retrieve_documents"
+    check_cancelled("after")
+
+
+def test_sleep_wakes_up_when_cancelled():
+    """
+    Tests that a cancellable sleep ends early when another thread cancels it.
+    """
+    token = CancellationToken()
+    threading.Timer(0.05, token.cancel, args=("disconnect",)).start()
+    start = time.monotonic()
+
+    with cancellable(token):
+        with pytest.raises(RequestCancelled) as cancelled:
+            sleep(5, "gemini quota")
+
+    assert time.monotonic() - start < 1
+    assert cancelled.value.reason == "disconnect"
@@ -0,0 +1,118 @@
+from services.context_builder import ContextBuilder, estimate_tokens
+
+
+def make_docs(chunks):
+    """
+    Builds reranked documents in the vector store format from
+    (chunk_id, document_id, chunk_index, text, score) tuples.
+    """
+    return {
+        "ids": [[c[0] for c in chunks]],
+        "metadatas": [
+            [
+                {
+                    "source": f"/data/{c[1]}.pdf",
+                    "document_id": c[1],
+                    "chunk_index": c[2],
+                }
+                for c in chunks
+            ]
+        ],
+        "documents": [[c[3] for c in chunks]],
+        "scores": [[c[4] for c in chunks]],
+    }
+
+
+def test_build_merges_adjacent_chunks_of_the_same_document():
+    """
+    Tests that consecutive chunks of a document share a single header.
+    """
+    # Arrange
+    builder = ContextBuilder(token_budget=1000, duplicate_threshold=0.85)
+    docs = make_docs(
+        [
+            ("a_chunk_1", "a", 1, "The second part of the policy.", 0.9),
+            ("a_chunk_0", "a", 0, "The first part of the policy.", 0.8),
+            ("b_chunk_4", "b", 4, "An unrelated paragraph about holidays.", 0.5),
+        ]
+    )
+
+    # Act
+    context, report = builder.build(docs)
+
+    # Assert
+    assert context.startswith(
+        "[Source: /data/a.pdf, chunk_id: a_chunk_0, a_chunk_1]\n"
+        "The first part of the policy.\nThe second part of the policy.\n\n"
+    )
+    assert "[Source: /data/b.pdf, chunk_id: b_chunk_4]" in context
+    assert report.spans == 2
+    assert report.included_chunk_ids == ["a_chunk_1", "a_chunk_0", "b_chunk_4"]
+
+
+def test_build_removes_near_duplicates():
+    """
+    Tests that a near-copy of a better-scored chunk is left out.
+    """
+    # Arrange
+    builder = ContextBuilder(token_budget=1000, duplicate_threshold=0.8)
+    text = "Employees accrue two days of paid leave for every month worked in the year."
+    docs = make_docs(
+        [
+            ("a_chunk_0", "a", 0, text, 0.9),
+            ("copy_chunk_0", "copy", 0, text + " ", 0.7),
+        ]
+    )
+
+    # Act
+    context, report = builder.build(docs)
+
+    # Assert
+    assert report.duplicate_chunk_ids == ["copy_chunk_0"]
+    assert "copy_chunk_0" not in context
+
+
+def test_build_enforces_the_token_budget():
+    """
+    Tests that lower-scored chunks are truncated or dropped to fit the budget.
+    """
+    # Arrange
+    builder = ContextBuilder(token_budget=200, duplicate_threshold=0.85)
+    docs = make_docs(
+        [
+            ("a_chunk_0", "a", 0, "alpha " * 100, 0.9),
+            ("b_chunk_0", "b", 0, "beta " * 200, 0.8),
+            ("c_chunk_0", "c", 0, "gamma " * 200, 0.1),
+        ]
+    )
+
+    # Act
+    context, report = builder.build(docs, prompt_overhead_tokens=50)
+
+    # Assert
+    assert estimate_tokens(context) <= 200
+    assert report.context_tokens <= 200
+    assert report.prompt_tokens == report.context_tokens + 50
+    assert report.included_chunk_ids == ["a_chunk_0"]
+    assert report.dropped_chunk_ids == ["b_chunk_0", "c_chunk_0"]
+
+
+def test_build_truncates_when_enough_budget_is_left():
+    """
+    Tests that a chunk is cut to fit when enough of the budget remains.
+    """
+    # Arrange
+    builder = ContextBuilder(token_budget=300, duplicate_threshold=0.85)
+    docs = make_docs(
+        [
+            ("a_chunk_0", "a", 0, "alpha " * 50, 0.9),
+            ("b_chunk_0", "b", 0, "beta " * 400, 0.8),
+        ]
+    )
+
+    # Act
+    context, report = builder.build(docs)
+
+    # Assert
+    assert report.truncated_chunk_ids == ["b_chunk_0"]
+    assert estimate_tokens(context) <= 300
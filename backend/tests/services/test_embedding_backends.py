@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+from contextlib import contextmanager
+from unittest.mock import MagicMock
+from services.embedding_backends import (
+    GeminiEmbeddingBackend,
+    SentenceTransformerEmbeddingBackend,
+    _backends,
+    create_embedding_backend,
+)
+
+
+@pytest.fixture
+def mocked_sentence_transformer(mocker):
+    """
+    Fixture to mock the SentenceTransformer model.
+    """
+    mock_model = MagicMock()
+    # Encode each text as a one-hot vector keyed on its length
+    mock_model.encode.side_effect = lambda texts, **kwargs: np.array(
+        [np.eye(8)[len(text) % 8] for text in texts]
+    )
+    mocker.patch("sentence_transformers.SentenceTransformer", return_value=mock_model)
+    mocker.patch.dict(_backends, clear=True)
+    return mock_model
+
+
+def test_embed_documents_sorts_by_length_and_keeps_order(mocked_sentence_transformer):
+    """
+    Tests that texts are batched longest first and returned in input order.
+    """
+    # Arrange
+    backend = SentenceTransformerEmbeddingBackend("local-model", batch_size=2)
+    texts = ["a", "abcd", "ab", "abc"]
+
+    # Act
+    embeddings = backend.embed_documents(texts)
+
+    # Assert
+    batches = [
+        call.args[0] for call in mocked_sentence_transformer.encode.call_args_list
+    ]
+    assert batches == [["abcd", "abc"], ["ab", "a"]]
+    assert [int(np.argmax(e)) for e in embeddings] == [1, 4, 2, 3]
+
+
+def test_create_embedding_backend_selects_by_model_name(mocked_sentence_transformer):
+    """
+    Tests that Gemini models use the API and other models run locally.
+    """
+    assert isinstance(
+        create_embedding_backend("models/text-embedding-004"), GeminiEmbeddingBackend
+    )
+    local_backend = create_embedding_backend("sentence-transformers/all-MiniLM-L6-v2")
+    assert isinstance(local_backend, SentenceTransformerEmbeddingBackend)
+    assert (
+        create_embedding_backend("sentence-transformers/all-MiniLM-L6-v2")
+        is local_backend
+    )
+
+
+def test_gemini_waits_for_quota_before_taking_a_slot(mocker):
+    """
+    Tests that a call waiting on the shared quota does not hold an embedding
+    slot, which would keep requests with quota left from the slots.
+    """
+    # Arrange
+    calls = []
+
+    @contextmanager
+    def stage_slot(stage):
+        calls.append(f"{stage} slot")
+        yield
+        calls.append(f"{stage} released")
+
+    genai = mocker.patch("services.embedding_backends.genai")
+    genai.embed_content.side_effect = lambda **kwargs: calls.append("api") or {
+        "embedding": [1.0, 0.0]
+    }
+    mocker.patch("services.embedding_backends.stage_slot", stage_slot)
+    backend = GeminiEmbeddingBackend("models/text-embedding-004")
+    backend.quota = MagicMock()
+    backend.quota.acquire.side_effect = lambda tokens: calls.append("quota")
+
+    # Act
+    backend.embed_query("what is the leave policy?")
+
+    # Assert
+    assert calls == ["quota", "embedding slot", "api", "embedding released"]
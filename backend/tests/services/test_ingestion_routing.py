@@ -0,0 +1,117 @@
+import zlib
+import pytest
+from unittest.mock import MagicMock
+from redis.exceptions import ConnectionError
+from services.ingestion_routing import IngestionRouter, estimate_ingestion_cost
+
+
+def _pdf(pages, scanned=False):
+    """
+    Builds the objects of a PDF with text pages, or image-only pages.
+    """
+    resource = b"/XObject << /Im0 5 0 R >>" if scanned else b"/Font << /F1 4 0 R >>"
+    objects = [b"<< /Type /Pages /Kids [] /Count %d >>" % pages]
+    objects += [b"<< /Type /Page /Resources << %s >> >>" % resource] * pages
+    if scanned:
+        objects.append(b"<< /Type /XObject /Subtype /Image /Width 2480 >>")
+    return b"%PDF-1.7\n" + b"\nendobj\n".join(objects)
+
+
+def _packed_pdf(pages):
+    """
+    Builds a PDF whose objects are compressed in an object stream, as PDF
+    1.5+ writers do.
+    """
+    stream = zlib.compress(_pdf(pages))
+    return (
+        b"%%PDF-1.7\n1 0 obj\n<< /Type /ObjStm /N %d /First 12 /Filter /FlateDecode "
+        b"/Length %d >>\nstream\n%s\nendstream\nendobj\n"
+        % (pages + 1, len(stream), stream)
+    )
+
+
+@pytest.mark.parametrize(
+    "filename, content, pages, needs_ocr, cost_s",
+    [
+        ("memo.pdf", _pdf(2), 2, False, 1.0),
+        ("scan.pdf", _pdf(800, scanned=True), 800, True, 4000.1),
+        ("packed.pdf", _packed_pdf(30), 30, False, 15.0),
+        # Page objects in streams that cannot be read leave the page count
+        (
+            "counted.pdf",
+            b"%PDF-1.7 << /Type /Pages /Kids [3 0 R] /Count 40 >>",
+            40,
+            False,
+            20.0,
+        ),
+        ("notes.txt", b"x" * 3 * 1024 * 1024, None, False, 3.0),
+    ],
+)
+def test_estimate_ingestion_cost(filename, content, pages, needs_ocr, cost_s):
+    """
+    Tests that the estimate accounts for pages and OCR in PDFs, and for the
+    size of every document.
+    """
+    cost = estimate_ingestion_cost(filename, content)
+
+    assert cost["pages"] == pages
+    assert cost["needs_ocr"] == needs_ocr
+    assert cost["estimated_cost_s"] == cost_s
+
+
+def test_route_separates_lanes_and_lowers_repeat_uploaders():
+    """
+    Tests that long documents go to the heavy lane, and that a user's
+    priority drops with the uploads they already have waiting.
+    """
+    # Arrange
+    client = MagicMock()
+    pipeline = client.pipeline.return_value
+    pipeline.execute.side_effect = [[1, True], [1, True], [4, True], [15, True]]
+    router = IngestionRouter(client)
+
+    # Act
+    heavy = router.route("scan.pdf", _pdf(800, scanned=True), "alice")
+    first = router.route("memo.pdf", _pdf(1), "bob")
+    fourth = router.route("memo.pdf", _pdf(1), "bob")
+    flooding = router.route("memo.pdf", _pdf(1), "bob")
+
+    # Assert
+    assert (heavy["lane"], heavy["queue"], heavy["priority"]) == (
+        "heavy",
+        "ingest_heavy",
+        0,
+    )
+    assert (first["lane"], first["queue"], first["priority"]) == (
+        "fast",
+        "ingest_fast",
+        0,
+    )
+    assert fourth["priority"] == 3
+    assert flooding["priority"] == 9
+    pipeline.hincrby.assert_called_with("ingest:pending:fast", "bob", 1)
+
+
+def test_route_without_redis_keeps_the_lane():
+    """
+    Tests that uploads are still routed when the waiting counts are
+    unavailable.
+    """
+    client = MagicMock()
+    client.pipeline.return_value.execute.side_effect = ConnectionError("down")
+
+    route = IngestionRouter(client).route("memo.pdf", _pdf(1), "bob")
+
+    assert (route["lane"], route["priority"]) == ("fast", 0)
+
+
+def test_estimate_logs_when_pages_are_unknown(caplog):
+    """
+    Tests that a PDF whose pages cannot be counted is estimated from its
+    size, and that the fallback is logged.
+    """
+    cost = estimate_ingestion_cost("broken.pdf", b"%PDF-1.7 garbage")
+
+    assert cost["pages"] is None
+    assert cost["estimated_cost_s"] == 0.0
+    assert "Could not count the pages of broken.pdf" in caplog.text
@@ -0,0 +1,71 @@
+import pytest
+from redis.exceptions import ConnectionError
+from services.admission_control import AdmissionRejected, admission
+from services.quota_limiter import QuotaLimiter
+
+
+@pytest.fixture
+def limiter(mocker):
+    """
+    Fixture for a quota limiter that never sleeps.
+    """
+    mocker.patch("services.quota_limiter.time.sleep")
+    return QuotaLimiter("llm", 60, 10_000, "redis://localhost:6379/0")
+
+
+def test_acquire_waits_for_quota(limiter, mocker):
+    """
+    Tests that acquire retries after the wait the buckets report.
+    """
+    # Arrange
+    take = mocker.patch.object(limiter, "_take", side_effect=[0.5, None])
+
+    # Act
+    with admission("interactive"):
+        limiter.acquire(100)
+
+    # Assert
+    assert take.call_count == 2
+    assert limiter.waits == 1
+    take.assert_called_with([1, 100], 0.0)
+
+
+def test_batch_work_leaves_the_interactive_reserve(limiter, mocker, monkeypatch):
+    """
+    Tests that calls outside an interactive request keep the reserve and
+    are capped to what a bucket can hold above it.
+    """
+    monkeypatch.setattr("settings.settings.QUOTA_INTERACTIVE_RESERVE", 0.2)
+    take = mocker.patch.object(limiter, "_take", return_value=None)
+
+    with admission("batch"):
+        limiter.acquire(50_000)
+
+    take.assert_called_once_with([1, 8_000], 0.2)
+
+
+def test_acquire_rejects_when_quota_comes_too_late(limiter, mocker):
+    """
+    Tests that an interactive call is rejected if the quota frees up after
+    its deadline.
+    """
+    mocker.patch.object(limiter, "_take", return_value=30.0)
+
+    with admission("interactive", timeout_s=5):
+        with pytest.raises(AdmissionRejected) as rejected:
+            limiter.acquire(100)
+
+    assert rejected.value.status_code == 429
+    assert rejected.value.retry_after == 30
+    assert limiter.rejections == 1
+
+
+def test_acquire_fails_open_without_redis(limiter, mocker):
+    """
+    Tests that calls go through when Redis is unreachable.
+    """
+    mocker.patch.object(limiter, "_take", side_effect=ConnectionError("down"))
+
+    limiter.acquire(100)
+
+    assert limiter.rejections == 0
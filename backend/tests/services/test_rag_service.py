@@ -0,0 +1,96 @@
+import pytest
+from services.rag_service import RAGService
+
+
+@pytest.fixture
+def rag_service(mocker):
+    """
+    Fixture for a RAGService whose services and repository are mocked.
+    """
+    for name in (
+        "EmbeddingService",
+        "GenerationService",
+        "VectorStoreRepository",
+        "RerankingService",
+    ):
+        mocker.patch(f"services.rag_service.{name}")
+    service = RAGService()
+    service.generation_service.estimate_prompt_tokens.return_value = 10
+    return service
+
+
+def test_batch_runs_each_stage_once(rag_service):
+    """
+    Tests that batch vectorizes the stages and isolates a failed question.
+    """
+    # Arrange
+    rag_service.generation_service.generate_hypothetical_documents.return_value = [
+        "hyde 1",
+        RuntimeError("quota exceeded"),
+        "hyde 3",
+    ]
+    rag_service.embedding_service.embed_queries.return_value = [[0.1], [0.3]]
+    retrieved = {
+        "ids": [["a_chunk_0"], ["c_chunk_0"]],
+        "documents": [["text a"], ["text c"]],
+        "metadatas": [
+            [{"source": "/data/a.pdf", "document_id": "a", "chunk_index": 0}],
+            [{"source": "/data/c.pdf", "document_id": "c", "chunk_index": 0}],
+        ],
+    }
+    rag_service.vector_store_repository.query.return_value = retrieved
+    rag_service.reranking_service.rerank_batch.return_value = {
+        **retrieved,
+        "scores": [[0.9], [0.8]],
+    }
+    rag_service.generation_service.generate_responses.return_value = [
+        "answer 1",
+        "answer 3",
+    ]
+
+    # Act
+    results = rag_service.batch(["q1", "q2", "q3"], max_concurrency=2)
+
+    # Assert
+    rag_service.embedding_service.embed_queries.assert_called_once_with(
+        ["hyde 1", "hyde 3"]
+    )
+    rag_service.vector_store_repository.query.assert_called_once_with(
+        [[0.1], [0.3]], n_results=20
+    )
+    rag_service.reranking_service.rerank_batch.assert_called_once_with(
+        ["q1", "q3"], retrieved
+    )
+    assert [r.get("response") for r in results] == ["answer 1", None, "answer 3"]
+    assert results[1]["error"] == "quota exceeded"
+    assert results[2]["citations"] == [
+        {"source": "/data/c.pdf", "chunk_id": "c_chunk_0"}
+    ]
+
+
+def test_search_skips_reranking_over_budget(rag_service):
+    """
+    Tests that search falls back to vector scores when reranking would not fit.
+    """
+    # Arrange
+    rag_service.embedding_service.embed_query.return_value = [0.1]
+    rag_service.vector_store_repository.query.return_value = {
+        "ids": [["a_chunk_0", "b_chunk_0"]],
+        "documents": [["Leave policy for staff.", "Unrelated text."]],
+        "metadatas": [[{"source": "/data/a.pdf"}, {"source": "/data/b.pdf"}]],
+        "distances": [[0.2, 0.6]],
+    }
+    rag_service.reranking_service.estimate_latency.return_value = 1.0
+
+    # Act
+    result = rag_service.search("leave policy", top_k=1, latency_budget_ms=50)
+
+    # Assert
+    rag_service.embedding_service.embed_query.assert_called_once_with("leave policy")
+    rag_service.reranking_service.rerank_documents.assert_not_called()
+    rag_service.generation_service.generate_response.assert_not_called()
+    assert result["reranked"] is False
+    assert len(result["results"]) == 1
+    assert result["results"][0]["chunk_id"] == "a_chunk_0"
+    assert result["results"][0]["score"] == 0.9
+    assert result["results"][0]["highlights"] == [(0, 12)]
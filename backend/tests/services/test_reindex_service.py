@@ -0,0 +1,147 @@
+import pytest
+from unittest.mock import MagicMock
+from redis.exceptions import ConnectionError
+from services.reindex_service import ReindexService
+
+
+class FakeCollection:
+    """
+    A source collection that grows while it is being re-indexed.
+    """
+
+    def __init__(self, name, size, counts):
+        self.name = name
+        self.ids = [f"doc_chunk_{i}" for i in range(size)]
+        self.counts = iter(counts)
+
+    def count(self):
+        return next(self.counts)
+
+    def get(self, limit, offset, include):
+        ids = self.ids[offset : offset + limit]
+        return {
+            "ids": ids,
+            "documents": [f"text of {id}" for id in ids],
+            "metadatas": [{"document_id": "doc"} for _ in ids],
+        }
+
+
+@pytest.fixture
+def reindex_service(mocker, monkeypatch):
+    """
+    Fixture for a ReindexService with a mocked repository, Redis and
+    embedding service.
+    """
+    monkeypatch.setattr("settings.settings.REINDEX_PAGE_SIZE", 2)
+    monkeypatch.setattr("settings.settings.REINDEX_CONCURRENCY", 2)
+    embedding_service = mocker.patch(
+        "services.reindex_service.EmbeddingService"
+    ).return_value
+    embedding_service.generate_embeddings.side_effect = lambda texts: [
+        [0.1] for _ in texts
+    ]
+    service = ReindexService(repository=MagicMock())
+    service.repository.storage.return_value = {
+        "embedding_model": "models/gemini-embedding-001",
+        "embedding_dimensionality": 768,
+    }
+    service._redis = MagicMock()
+    mocker.patch.object(service, "_save")
+    mocker.patch.object(service, "_switch")
+    mocker.patch.object(service, "status", return_value={"processed": 4})
+    return service
+
+
+def _use_collections(service, source, target):
+    service.repository.get_collection.side_effect = lambda name: {
+        source.name: source,
+        target.name: target,
+    }[name]
+
+
+def test_copy_follows_a_growing_source_then_switches(reindex_service):
+    """
+    Tests that chunks added during the re-index are copied before the switch.
+    """
+    # Arrange
+    source = FakeCollection("documents", 7, counts=[5, 7, 7])
+    target = MagicMock()
+    target.name = "documents_v1"
+    _use_collections(reindex_service, source, target)
+    progress = []
+
+    # Act
+    reindex_service._copy(
+        {"source": "documents", "target": "documents_v1", "processed": 0},
+        "task-1",
+        progress.append,
+    )
+
+    # Assert
+    written = [
+        call.args[0] for call in reindex_service.repository.add_documents.call_args_list
+    ]
+    assert sorted(id for ids in written for id in ids) == sorted(source.ids)
+    assert all(
+        call.kwargs["collection_name"] == "documents_v1"
+        for call in reindex_service.repository.add_documents.call_args_list
+    )
+    saved = [call.kwargs for call in reindex_service._save.call_args_list[1:]]
+    assert [(s["processed"], s["total"]) for s in saved] == [(4, 5), (7, 7)]
+    assert saved[-1]["eta_seconds"] == 0
+    assert len(progress) == 2
+    reindex_service._switch.assert_called_once_with("documents_v1", 7)
+
+
+def test_copy_resumes_from_the_checkpoint(reindex_service):
+    """
+    Tests that a resumed re-index only copies the chunks after its offset.
+    """
+    source = FakeCollection("documents", 6, counts=[6, 6])
+    target = MagicMock()
+    target.name = "documents_v2"
+    _use_collections(reindex_service, source, target)
+
+    reindex_service._copy(
+        {"source": "documents", "target": "documents_v2", "processed": 4},
+        "task-2",
+        None,
+    )
+
+    reindex_service.repository.add_documents.assert_called_once()
+    assert reindex_service.repository.add_documents.call_args.args[0] == [
+        "doc_chunk_4",
+        "doc_chunk_5",
+    ]
+    reindex_service._switch.assert_called_once_with("documents_v2", 6)
+
+
+def test_copy_page_rejects_partial_embeddings(reindex_service):
+    """
+    Tests that a page is not written when some chunks failed to embed.
+    """
+    source = FakeCollection("documents", 2, counts=[])
+    embedding_service = MagicMock()
+    embedding_service.generate_embeddings.return_value = [[0.1]]
+
+    with pytest.raises(RuntimeError):
+        reindex_service._copy_page(source, MagicMock(), embedding_service, 0)
+
+    reindex_service.repository.add_documents.assert_not_called()
+
+
+def test_dual_write_target(reindex_service):
+    """
+    Tests that ingestion dual-writes only while a re-index is unfinished.
+    """
+    reindex_service._redis.hmget.side_effect = [
+        [b"running", b"documents_v3"],
+        [b"completed", b"documents_v3"],
+        [None, None],
+        ConnectionError("redis down"),
+    ]
+
+    assert reindex_service.dual_write_target() == "documents_v3"
+    assert reindex_service.dual_write_target() is None
+    assert reindex_service.dual_write_target() is None
+    assert reindex_service.dual_write_target() is None
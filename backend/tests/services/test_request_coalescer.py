@@ -0,0 +1,203 @@
+import asyncio
+import json
+import time
+import pytest
+from services.cancellation import RequestCancelled, cancellable, check_cancelled
+from services.request_coalescer import (
+    RequestCoalescer,
+    coalescing_key,
+    normalize_question,
+)
+
+
+def test_coalescing_key_normalizes_questions():
+    """
+    Tests that spelling variants share a key but filters separate them.
+    """
+    assert normalize_question("  What is  the Leave POLICY?? ") == (
+        "what is the leave policy"
+    )
+    assert coalescing_key("What is the leave policy?") == coalescing_key(
+        "what is the leave policy"
+    )
+    assert coalescing_key("leave policy", source="a.pdf") != coalescing_key(
+        "leave policy"
+    )
+
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_share_one_execution():
+    """
+    Tests that identical in-flight requests attach to a single execution.
+    """
+    # Arrange
+    coalescer = RequestCoalescer("test")
+    calls = []
+
+    async def execute(token):
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"response": "answer"}
+
+    # Act
+    results = await asyncio.gather(
+        *(coalescer.run("key", execute) for _ in range(5)),
+        coalescer.run("other", execute),
+    )
+
+    # Assert
+    assert len(calls) == 2
+    assert results == [{"response": "answer"}] * 6
+    assert coalescer._in_flight == {}
+
+
+@pytest.mark.asyncio
+async def test_execution_survives_cancelled_leader():
+    """
+    Tests that cancelling the request that started an execution does not
+    cancel it for the requests waiting on it.
+    """
+    coalescer = RequestCoalescer("test")
+
+    async def execute(token):
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    leader = asyncio.ensure_future(coalescer.run("key", execute))
+    await asyncio.sleep(0)
+    follower = asyncio.ensure_future(coalescer.run("key", execute))
+    await asyncio.sleep(0)
+    leader.cancel()
+
+    assert await follower == "answer"
+
+
+@pytest.mark.asyncio
+async def test_execution_cancelled_when_every_caller_leaves():
+    """
+    Tests that an execution nobody waits for anymore is cancelled.
+    """
+    coalescer = RequestCoalescer("test")
+    started = asyncio.Event()
+
+    async def execute(token):
+        started.set()
+        await asyncio.sleep(10)
+
+    callers = [asyncio.ensure_future(coalescer.run("key", execute)) for _ in range(2)]
+    await started.wait()
+    execution = coalescer._in_flight["key"]
+    callers[0].cancel()
+    await asyncio.sleep(0)
+    assert not execution.cancelled()
+
+    callers[1].cancel()
+    await asyncio.gather(*callers, return_exceptions=True)
+    await asyncio.sleep(0)
+
+    assert execution.cancelled()
+    assert coalescer._waiters == {}
+
+
+@pytest.mark.asyncio
+async def test_execution_runs_until_the_latest_deadline():
+    """
+    Tests that a shared execution is not stopped by the deadline of the
+    request that started it while a later caller can still wait, though
+    that request itself stops waiting.
+    """
+    # Arrange
+    coalescer = RequestCoalescer("test")
+    now = time.monotonic()
+    tokens = []
+
+    async def execute(token):
+        tokens.append(token)
+        await asyncio.sleep(0.1)
+        with cancellable(token):
+            check_cancelled("llm")
+        return "answer"
+
+    # Act
+    leader = asyncio.ensure_future(coalescer.run("key", execute, now + 0.05))
+    await asyncio.sleep(0)
+    follower = asyncio.ensure_future(coalescer.run("key", execute, now + 10))
+    results = await asyncio.gather(leader, follower, return_exceptions=True)
+
+    # Assert
+    assert isinstance(results[0], RequestCancelled)
+    assert results[1] == "answer"
+    assert len(tokens) == 1
+    assert tokens[0].deadline == now + 10
+
+
+@pytest.mark.asyncio
+async def test_caller_stops_waiting_at_its_own_deadline():
+    """
+    Tests that a caller joining a slower execution fails at its deadline,
+    while the execution goes on for the caller that can wait.
+    """
+    coalescer = RequestCoalescer("test")
+
+    async def execute(token):
+        await asyncio.sleep(0.3)
+        return "answer"
+
+    leader = asyncio.ensure_future(coalescer.run("key", execute))
+    await asyncio.sleep(0)
+    start = time.monotonic()
+    with pytest.raises(RequestCancelled) as cancelled:
+        await coalescer.run("key", execute, time.monotonic() + 0.05)
+
+    assert cancelled.value.reason == "deadline"
+    assert time.monotonic() - start < 0.2
+    assert await leader == "answer"
+
+
+class FakeRedis:
+    """
+    A Redis where another replica holds the lock of every key, and may have
+    published a result.
+    """
+
+    def __init__(self, holder, published=None):
+        self.holder = holder
+        self.published = published
+
+    async def set(self, key, value, nx=False, px=None):
+        return False
+
+    async def get(self, key):
+        if ":lock:" in key:
+            return self.holder.encode()
+        return None if self.published is None else json.dumps(self.published)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "published, result",
+    [
+        ({"owner": "replica-2", "result": "answer"}, "answer"),
+        # Published by an execution that ended before this request arrived
+        ({"owner": "replica-1", "result": "stale"}, None),
+        (None, None),
+    ],
+)
+async def test_waiting_on_another_replica(mocker, published, result):
+    """
+    Tests that a replica takes the result of the execution it waited on, but
+    not an older one, and stops polling at its deadline.
+    """
+    mocker.patch("services.request_coalescer.settings.COALESCING_POLL_INTERVAL_S", 0.01)
+    coalescer = RequestCoalescer("test", "redis://localhost")
+    coalescer._redis = FakeRedis("replica-2", published)
+
+    async def execute(token):
+        return "computed here"
+
+    answer = coalescer.run("key", execute, time.monotonic() + 0.1)
+    if result is None:
+        with pytest.raises(RequestCancelled):
+            await answer
+    else:
+        assert await answer == result
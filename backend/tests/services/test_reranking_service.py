@@ -56,6 +56,7 @@ def test_rerank_documents(mocked_cross_encoder):
     assert reranked_docs["ids"][0] == expected_order_ids
     assert reranked_docs["documents"][0] == expected_order_docs
     assert reranked_docs["metadatas"][0] == expected_order_metadatas
+    assert reranked_docs["scores"][0] == [0.9, 0.5, 0.1]
     mocked_cross_encoder.predict.assert_called_once_with(
         [
             ["What is the capital of France?", "Paris is the capital of France."],
@@ -89,3 +90,27 @@ def test_reranking_service_model_loading():
         RerankingService()
     except Exception as e:
         pytest.fail(f"Failed to initialize RerankingService: {e}")
+
+
+def test_rerank_batch(mocked_cross_encoder):
+    """
+    Tests that rerank_batch scores every query's documents in one model call.
+    """
+    # Arrange
+    reranking_service = RerankingService()
+    retrieved_docs = {
+        "ids": [["1", "2"], ["3", "4"]],
+        "documents": [["doc 1", "doc 2"], ["doc 3", "doc 4"]],
+        "metadatas": [[{}, {}], [{}, {}]],
+    }
+    mocked_cross_encoder.predict.return_value = [0.1, 0.9, 0.8, 0.2]
+
+    # Act
+    reranked_docs = reranking_service.rerank_batch(["q1", "q2"], retrieved_docs)
+
+    # Assert
+    assert reranked_docs["ids"] == [["2", "1"], ["3", "4"]]
+    assert reranked_docs["scores"] == [[0.9, 0.1], [0.8, 0.2]]
+    mocked_cross_encoder.predict.assert_called_once_with(
+        [["q1", "doc 1"], ["q1", "doc 2"], ["q2", "doc 3"], ["q2", "doc 4"]]
+    )
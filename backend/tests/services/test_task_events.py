@@ -0,0 +1,118 @@
+import json
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from redis.exceptions import ConnectionError
+from services.task_events import (
+    TaskProgress,
+    TaskStatusService,
+    TaskStatusUnavailable,
+)
+
+
+def _event(seq, state="PROGRESS", **fields):
+    return {"seq": seq, "task_id": "task-1", "state": state, **fields}
+
+
+class FakePubSub:
+    """
+    A subscription receiving the given messages, None meaning a timeout.
+    """
+
+    def __init__(self, messages):
+        self.messages = iter(messages)
+        self.closed = False
+
+    async def subscribe(self, channel):
+        self.channel = channel
+
+    async def get_message(self, ignore_subscribe_messages, timeout):
+        message = next(self.messages)
+        return None if message is None else {"data": json.dumps(message)}
+
+    async def unsubscribe(self):
+        pass
+
+    async def aclose(self):
+        self.closed = True
+
+
+def test_task_progress_reports_throughput_and_time_remaining(mocker):
+    """
+    Tests that chunk progress is published with the throughput since the
+    start of the stage, from the first report on, and the time its
+    remaining chunks should take.
+    """
+    # Arrange
+    task = MagicMock()
+    task.request.id = "task-1"
+    client = MagicMock()
+    client.eval.return_value = 7
+    progress = TaskProgress(task, client)
+    mocker.patch("services.task_events.time.monotonic", side_effect=[100.0, 102.0])
+
+    # Act
+    stage = progress.stage("embedding", "Embedding...", processed=0, total=400)
+    event = progress.chunks(100, 400)
+
+    # Assert
+    task.update_state.assert_called_once_with(state="PROGRESS", meta=stage)
+    assert event["seq"] == 7
+    assert event["stage"] == "embedding"
+    assert event["chunks_per_second"] == 50
+    assert event["eta_seconds"] == 6
+    _, key, channel, data, _ = client.eval.call_args.args[1:]
+    assert (key, channel) == ("task_status:task-1", "task_events:task-1")
+    assert json.loads(data)["processed"] == 100
+
+
+@pytest.mark.asyncio
+async def test_events_resume_from_the_status_and_end_with_the_task():
+    """
+    Tests that a subscriber gets the current status, then only newer events,
+    keep-alives while the task is quiet, and nothing after it ends.
+    """
+    service = TaskStatusService("redis://localhost")
+    pubsub = FakePubSub(
+        [_event(2), None, _event(3, processed=10), _event(4, "SUCCESS"), _event(5)]
+    )
+    service._redis = MagicMock()
+    service._redis.pubsub.return_value = pubsub
+    service.status = AsyncMock(side_effect=[_event(2), _event(2)])
+
+    events = [event async for event in service.events("task-1", after=1)]
+
+    assert [event and event["seq"] for event in events] == [2, None, 3, 4]
+    assert pubsub.channel == "task_events:task-1"
+    assert pubsub.closed
+
+
+@pytest.mark.asyncio
+async def test_status_and_events_survive_redis_outages():
+    """
+    Tests that an unreadable status is reported as unavailable, and that a
+    subscriber's events end quietly when Redis fails midway.
+    """
+    service = TaskStatusService("redis://localhost")
+    service._redis = MagicMock()
+    service._redis.hget = AsyncMock(side_effect=ConnectionError("down"))
+    pubsub = FakePubSub([None])
+    service._redis.pubsub.return_value = pubsub
+
+    with pytest.raises(TaskStatusUnavailable):
+        await service.status("task-1")
+    service.status = AsyncMock(side_effect=[_event(2), ConnectionError("down")])
+    events = [event async for event in service.events("task-1")]
+
+    assert [event and event["seq"] for event in events] == [2, None]
+    assert pubsub.closed
+
+
+def test_status_client_times_out():
+    """
+    Tests that reading a status fails fast when Redis hangs, as the sync
+    clients do, instead of holding the request.
+    """
+    client = TaskStatusService("redis://localhost")._client()
+
+    kwargs = client.connection_pool.connection_kwargs
+    assert (kwargs["socket_connect_timeout"], kwargs["socket_timeout"]) == (1, 5)
@@ -0,0 +1,22 @@
+from utils.highlighting import find_highlights
+
+
+def test_find_highlights_matches_whole_words_case_insensitively():
+    """
+    Tests that query words are found regardless of case and stopwords are ignored.
+    """
+    text = "Remote work is allowed. The remote-work policy covers Workers."
+
+    highlights = find_highlights("What is the remote work policy?", text)
+
+    assert [text[start:end] for start, end in highlights] == [
+        "Remote work",
+        "remote-work policy",
+    ]
+
+
+def test_find_highlights_without_terms():
+    """
+    Tests that a query made only of stopwords highlights nothing.
+    """
+    assert find_highlights("what is the", "The answer is here.") == []
@@ -0,0 +1,52 @@
+import pytest
+from utils.metrics import (
+    RAG_STAGE_DURATION,
+    RAG_STAGE_ERRORS,
+    collect_timings,
+    format_server_timing,
+    timed_stage,
+)
+
+
+def test_timed_stage_records_request_timings():
+    """
+    Tests that timed stages add up in the current request timings and the
+    stage histogram.
+    """
+    # Arrange
+    before = RAG_STAGE_DURATION.labels("test_stage")._sum.get()
+
+    # Act
+    with collect_timings() as timings:
+        with timed_stage("test_stage"):
+            pass
+        with timed_stage("test_stage"):
+            pass
+
+    # Assert
+    assert list(timings) == ["test_stage"]
+    assert timings["test_stage"] >= 0
+    assert RAG_STAGE_DURATION.labels("test_stage")._sum.get() >= before
+
+
+def test_timed_stage_counts_errors():
+    """
+    Tests that an exception in a stage is counted and re-raised.
+    """
+    errors = RAG_STAGE_ERRORS.labels("failing_stage")
+    before = errors._value.get()
+
+    with pytest.raises(ValueError):
+        with timed_stage("failing_stage"):
+            raise ValueError("boom")
+
+    assert errors._value.get() == before + 1
+
+
+def test_format_server_timing():
+    """
+    Tests the Server-Timing header format.
+    """
+    header = format_server_timing({"retrieve": 0.0123, "generate": 1.5})
+
+    assert header == "retrieve;dur=12.3, generate;dur=1500.0"
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from utils.quantization import (
+    bytes_per_vector,
+    dequantize_embeddings,
+    quantize_embeddings,
+    truncate_and_normalize,
+)
+
+
+def test_truncate_and_normalize():
+    """
+    Tests that embeddings are truncated to the leading dimensions and re-normalized.
+    """
+    normalized = truncate_and_normalize([[3.0, 4.0, 12.0]], dimensionality=2)
+
+    assert normalized.shape == (1, 2)
+    np.testing.assert_allclose(normalized[0], [0.6, 0.8], rtol=1e-6)
+
+
+@pytest.mark.parametrize("precision,tolerance", [("float16", 1e-3), ("int8", 1e-2)])
+def test_quantization_round_trip(precision, tolerance):
+    """
+    Tests that quantized embeddings reconstruct close to the originals.
+    """
+    embeddings = truncate_and_normalize(np.random.default_rng(0).normal(size=(8, 64)))
+
+    codes, scales = quantize_embeddings(embeddings, precision)
+    restored = dequantize_embeddings(codes, scales)
+
+    assert codes.dtype == np.dtype(precision)
+    np.testing.assert_allclose(restored, embeddings, atol=tolerance)
+
+
+def test_bytes_per_vector():
+    """
+    Tests the storage size of a vector at each precision.
+    """
+    assert bytes_per_vector(768, "float32") == 3072
+    assert bytes_per_vector(768, "float16") == 1536
+    assert bytes_per_vector(768, "int8") == 772
+    with pytest.raises(ValueError):
+        bytes_per_vector(768, "int4")
@@ -0,0 +1,42 @@
+import pytest
+from utils.resource_usage import measure_stage, reset_peak_rss, track_resources
+
+ALLOCATION = 64 * 1024 * 1024
+
+
+@pytest.mark.skipif(not reset_peak_rss(), reason="needs Linux procfs")
+def test_track_resources_separates_retained_and_peak_memory():
+    """
+    Tests that a stage keeping memory shows it as growth, while a stage only
+    using it temporarily shows it in its peak.
+    """
+    # Arrange
+    kept = []
+
+    # Act
+    with track_resources() as usage:
+        with measure_stage("retaining"):
+            kept.append(b"x" * ALLOCATION)
+        with measure_stage("temporary"):
+            temporary = b"y" * ALLOCATION
+            del temporary
+
+    # Assert
+    retaining = usage["stages"]["retaining"]
+    temporary = usage["stages"]["temporary"]
+    assert retaining["rss_delta_mb"] >= 48
+    assert abs(temporary["rss_delta_mb"]) < 16
+    assert temporary["peak_rss_mb"] - temporary["rss_before_mb"] >= 48
+    assert usage["peak_rss_mb"] >= temporary["peak_rss_mb"]
+    assert usage["rss_after_mb"] - usage["rss_before_mb"] >= 48
+    assert usage["wall_s"] >= 0 and usage["cpu_s"] >= 0
+
+
+def test_measure_stage_outside_a_task():
+    """
+    Tests that stages can be measured without a tracked task.
+    """
+    with measure_stage("standalone") as usage:
+        pass
+
+    assert set(usage) >= {"wall_s", "cpu_s", "rss_delta_mb", "peak_rss_mb"}
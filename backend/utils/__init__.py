@@ -1,3 +1,25 @@
 from .file_type_checking import validate_document_type, get_supported_extensions
+from .highlighting import find_highlights
+from .embedding_models import embedding_identity, resolve_embedding_backend
+from .quantization import (
+    SUPPORTED_PRECISIONS,
+    bytes_per_vector,
+    dequantize_embeddings,
+    quantize_embeddings,
+    truncate_and_normalize,
+    validate_precision,
+)
 
-__all__ = ["validate_document_type", "get_supported_extensions"]
+__all__ = [
+    "validate_document_type",
+    "get_supported_extensions",
+    "find_highlights",
+    "embedding_identity",
+    "resolve_embedding_backend",
+    "SUPPORTED_PRECISIONS",
+    "bytes_per_vector",
+    "dequantize_embeddings",
+    "quantize_embeddings",
+    "truncate_and_normalize",
+    "validate_precision",
+]
@@ -0,0 +1,36 @@
+from typing import Dict
+
+# Gemini embedding model names all live under this prefix
+GEMINI_MODEL_PREFIX = "models/"
+
+
+def resolve_embedding_backend(model_name: str) -> str:
+    """
+    Resolve which embedding backend serves the given model.
+
+    Args:
+        model_name: The embedding model name, e.g. "models/text-embedding-004"
+            or "sentence-transformers/all-MiniLM-L6-v2".
+
+    Returns:
+        "gemini" for Gemini API models, "sentence-transformers" otherwise.
+    """
+    if model_name.startswith(GEMINI_MODEL_PREFIX):
+        return "gemini"
+    return "sentence-transformers"
+
+
+def embedding_identity(model_name: str) -> Dict[str, str]:
+    """
+    Describe the backend and model that produce a collection's vectors.
+
+    Args:
+        model_name: The embedding model name.
+
+    Returns:
+        The identity recorded in the collection metadata.
+    """
+    return {
+        "embedding_backend": resolve_embedding_backend(model_name),
+        "embedding_model": model_name,
+    }
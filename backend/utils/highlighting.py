@@ -0,0 +1,46 @@
+import re
+from typing import List, Set, Tuple
+
+# Words too common to be worth highlighting
+STOPWORDS: Set[str] = set(
+    "a an and are as at be by can do does for from how i in is it of on or our "
+    "that the this to was we what when where which who why will with you "
+    "le la les de des du et un une".split()
+)
+
+
+def find_highlights(query: str, text: str) -> List[Tuple[int, int]]:
+    """
+    Find the spans of a text that match the words of a query.
+
+    Matching is case-insensitive on whole words, ignoring stopwords and
+    one-letter words. Adjacent matches separated only by whitespace or
+    punctuation are merged into a single span.
+
+    Args:
+        query: The search query.
+        text: The text to highlight.
+
+    Returns:
+        A sorted list of (start, end) character offsets into the text.
+    """
+    terms = {
+        word
+        for word in re.findall(r"\w+", query.lower())
+        if len(word) > 1 and word not in STOPWORDS
+    }
+    if not terms:
+        return []
+
+    pattern = re.compile(
+        r"\b(" + "|".join(re.escape(term) for term in sorted(terms)) + r")\b",
+        re.IGNORECASE,
+    )
+    spans: List[Tuple[int, int]] = []
+    for match in pattern.finditer(text):
+        start, end = match.span()
+        if spans and not text[spans[-1][1] : start].strip(" \t-,.;:"):
+            spans[-1] = (spans[-1][0], end)
+        else:
+            spans.append((start, end))
+    return spans
@@ -0,0 +1,279 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Callable, Dict, Iterator, Optional
+from prometheus_client import Counter, Gauge, Histogram
+from .resource_usage import measure_stage
+
+# Latency buckets from a few milliseconds (local stages) to tens of seconds
+# (LLM calls and document conversion)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+MB = 1024 * 1024
+# Memory buckets from 128 MB to the 8 GB worker limit
+MEMORY_BUCKETS = tuple(2**i * MB for i in range(7, 14))
+# Queue wait buckets from instant pickup to an hour behind large documents
+QUEUE_WAIT_BUCKETS = (0.1, 0.5, 1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+
+RAG_STAGE_DURATION = Histogram(
+    "rag_stage_duration_seconds",
+    "Time spent in each stage of the RAG pipeline.",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+RAG_STAGE_ERRORS = Counter(
+    "rag_stage_errors_total",
+    "Exceptions raised by each stage of the RAG pipeline.",
+    ["stage"],
+)
+RAG_CANDIDATES = Histogram(
+    "rag_candidates",
+    "Number of chunks passed between RAG stages.",
+    ["stage"],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100),
+)
+LLM_TOKENS = Counter(
+    "llm_tokens_total",
+    "LLM tokens used, by call and direction.",
+    ["call", "direction"],
+)
+CANCELLED_REQUESTS = Counter(
+    "rag_requests_cancelled_total",
+    "RAG pipeline executions stopped because their result was no longer wanted.",
+    ["reason", "stage"],
+)
+AVOIDED_STAGES = Counter(
+    "rag_stages_avoided_total",
+    "RAG stages skipped or interrupted because the request was cancelled.",
+    ["stage"],
+)
+LLM_TOKENS_AVOIDED = Counter(
+    "llm_output_tokens_avoided_total",
+    "Estimated LLM output tokens not generated because the request was cancelled.",
+)
+CACHE_REQUESTS = Counter(
+    "cache_requests_total",
+    "Cache lookups, by cache and result.",
+    ["cache", "result"],
+)
+COALESCED_REQUESTS = Counter(
+    "coalesced_requests_total",
+    "Requests answered by another request's execution, by scope.",
+    ["scope"],
+)
+ADMISSION_QUEUE_WAIT = Histogram(
+    "admission_queue_wait_seconds",
+    "Time spent waiting for a stage slot, by stage and priority.",
+    ["stage", "priority"],
+    buckets=LATENCY_BUCKETS,
+)
+ADMISSION_REJECTIONS = Counter(
+    "admission_rejections_total",
+    "Requests shed by admission control, by stage, priority and reason.",
+    ["stage", "priority", "reason"],
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    "admission_in_flight",
+    "Calls holding a stage slot.",
+    ["stage"],
+)
+QUOTA_WAIT = Histogram(
+    "quota_wait_seconds",
+    "Time spent waiting for cluster-wide Gemini quota, by quota and priority.",
+    ["quota", "priority"],
+    buckets=LATENCY_BUCKETS,
+)
+QUOTA_REJECTIONS = Counter(
+    "quota_rejections_total",
+    "Calls rejected for lack of Gemini quota, by quota and priority.",
+    ["quota", "priority"],
+)
+QUOTA_AVAILABLE = Gauge(
+    "quota_available",
+    "Last seen level of each Gemini quota bucket.",
+    ["quota", "unit"],
+)
+INGEST_STAGE_DURATION = Histogram(
+    "ingest_stage_duration_seconds",
+    "Time spent in each stage of document ingestion.",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+INGEST_STAGE_ERRORS = Counter(
+    "ingest_stage_errors_total",
+    "Exceptions raised by each stage of document ingestion.",
+    ["stage"],
+)
+INGEST_CHUNKS = Counter(
+    "ingest_chunks_total",
+    "Chunks produced and stored by document ingestion.",
+)
+INGEST_ROUTED = Counter(
+    "ingest_tasks_routed_total",
+    "Uploads sent to each ingestion lane.",
+    ["lane"],
+)
+INGEST_QUEUE_WAIT = Histogram(
+    "ingest_queue_wait_seconds",
+    "Time uploads waited in their ingestion lane before a worker started them.",
+    ["lane"],
+    buckets=QUEUE_WAIT_BUCKETS,
+)
+INGEST_STAGE_CPU = Counter(
+    "ingest_stage_cpu_seconds_total",
+    "CPU time used by each stage of document ingestion.",
+    ["stage"],
+)
+INGEST_STAGE_RSS_GROWTH = Counter(
+    "ingest_stage_rss_growth_bytes_total",
+    "Resident memory each stage of document ingestion left allocated.",
+    ["stage"],
+)
+INGEST_STAGE_PEAK_RSS = Histogram(
+    "ingest_stage_peak_rss_bytes",
+    "Peak resident memory of the worker during each ingestion stage.",
+    ["stage"],
+    buckets=MEMORY_BUCKETS,
+)
+TASK_PEAK_RSS = Histogram(
+    "worker_task_peak_rss_bytes",
+    "Peak resident memory of the worker during each task.",
+    ["task"],
+    buckets=MEMORY_BUCKETS,
+)
+WORKER_RSS = Gauge(
+    "worker_rss_bytes",
+    "Resident memory of the worker after its last task.",
+)
+WORKER_RECYCLES = Counter(
+    "worker_recycles_total",
+    "Worker restarts requested because memory crossed the threshold.",
+)
+
+# Per-request (or per-task) stage timings in seconds, shared by reference
+# with the threads a request hands work to
+_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("timings", default=None)
+
+
+@contextmanager
+def collect_timings() -> Iterator[Dict[str, float]]:
+    """
+    Collect the stage timings of the current request or task.
+
+    Yields:
+        A dictionary filled with the seconds spent in each timed stage.
+    """
+    timings: Dict[str, float] = {}
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+@contextmanager
+def timed_stage(
+    stage: str,
+    duration: Histogram = RAG_STAGE_DURATION,
+    errors: Counter = RAG_STAGE_ERRORS,
+) -> Iterator[None]:
+    """
+    Time a stage, count its errors and add it to the current request timings.
+
+    Args:
+        stage: The stage name.
+        duration: The histogram observing the stage duration.
+        errors: The counter incremented when the stage raises.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        errors.labels(stage).inc()
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        duration.labels(stage).observe(elapsed)
+        timings = _timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+
+
+@contextmanager
+def ingest_stage(stage: str) -> Iterator[None]:
+    """
+    Time a document ingestion stage and measure its memory and CPU use.
+
+    Args:
+        stage: The stage name.
+    """
+    with timed_stage(stage, INGEST_STAGE_DURATION, INGEST_STAGE_ERRORS):
+        with measure_stage(stage) as usage:
+            yield
+    INGEST_STAGE_CPU.labels(stage).inc(usage["cpu_s"])
+    INGEST_STAGE_RSS_GROWTH.labels(stage).inc(max(0.0, usage["rss_delta_mb"]) * MB)
+    INGEST_STAGE_PEAK_RSS.labels(stage).observe(usage["peak_rss_mb"] * MB)
+
+
+def instrument_stage(stage: str) -> Callable[[Callable], Callable]:
+    """
+    Decorate a function, such as a LangGraph node, so each call is timed as a
+    RAG stage.
+
+    Args:
+        stage: The stage name.
+
+    Returns:
+        The decorator.
+    """
+
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed_stage(stage):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def record_llm_usage(call: str, message: Any):
+    """
+    Count the tokens reported by an LLM response.
+
+    Args:
+        call: The kind of LLM call, e.g. "hyde" or "answer".
+        message: The LangChain message returned by the model.
+    """
+    usage = getattr(message, "usage_metadata", None) or {}
+    if usage.get("input_tokens"):
+        LLM_TOKENS.labels(call, "input").inc(usage["input_tokens"])
+    if usage.get("output_tokens"):
+        LLM_TOKENS.labels(call, "output").inc(usage["output_tokens"])
+
+
+def record_cache(cache: str, hit: bool):
+    """
+    Count a cache lookup.
+
+    Args:
+        cache: The cache name.
+        hit: Whether the lookup was a hit.
+    """
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def format_server_timing(timings: Dict[str, float]) -> str:
+    """
+    Format stage timings as a `Server-Timing` header value.
+
+    Args:
+        timings: The seconds spent in each stage.
+
+    Returns:
+        The header value, with durations in milliseconds.
+    """
+    return ", ".join(
+        f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()
+    )
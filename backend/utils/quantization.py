@@ -0,0 +1,124 @@
+from typing import Optional, Sequence, Tuple
+import numpy as np
+
+# Storage precisions supported for embedding vectors
+SUPPORTED_PRECISIONS: Tuple[str, ...] = ("float32", "float16", "int8")
+
+# Bytes used by a single vector component at each precision
+_BYTES_PER_COMPONENT = {"float32": 4, "float16": 2, "int8": 1}
+
+
+def validate_precision(precision: str) -> str:
+    """
+    Validate that the given storage precision is supported.
+
+    Args:
+        precision: The storage precision name.
+
+    Returns:
+        The validated precision name.
+
+    Raises:
+        ValueError: If the precision is not supported.
+    """
+    if precision not in SUPPORTED_PRECISIONS:
+        supported = ", ".join(SUPPORTED_PRECISIONS)
+        raise ValueError(
+            f"Unsupported embedding precision '{precision}'. Supported: {supported}"
+        )
+    return precision
+
+
+def truncate_and_normalize(
+    embeddings: Sequence[Sequence[float]], dimensionality: Optional[int] = None
+) -> np.ndarray:
+    """
+    Truncate embeddings to the leading dimensions and re-normalize them.
+
+    Reduced-dimension Gemini embeddings are prefixes of the full vector, so
+    truncating locally reproduces what the API returns for a smaller
+    `output_dimensionality`, up to the L2 normalization applied here.
+
+    Args:
+        embeddings: A list of embeddings.
+        dimensionality: The number of leading dimensions to keep, or None to
+            keep them all.
+
+    Returns:
+        A float32 matrix with one unit-length row per embedding.
+    """
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    if dimensionality is not None:
+        matrix = matrix[:, :dimensionality]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def quantize_embeddings(
+    embeddings: np.ndarray, precision: str
+) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Quantize a float32 embedding matrix to the given precision.
+
+    int8 uses symmetric per-vector scalar quantization, so every row keeps its
+    own float32 scale.
+
+    Args:
+        embeddings: A float32 matrix with one embedding per row.
+        precision: The target precision.
+
+    Returns:
+        A tuple of the quantized codes and the per-row scales (None unless the
+        precision is int8).
+    """
+    validate_precision(precision)
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if precision == "float32":
+        return embeddings, None
+    if precision == "float16":
+        return embeddings.astype(np.float16), None
+
+    scales = np.abs(embeddings).max(axis=1, keepdims=True) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(embeddings / scales), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def dequantize_embeddings(
+    codes: np.ndarray, scales: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Reconstruct a float32 embedding matrix from quantized codes.
+
+    Args:
+        codes: The quantized codes.
+        scales: The per-row scales returned for int8 codes.
+
+    Returns:
+        A float32 matrix.
+    """
+    matrix = codes.astype(np.float32)
+    if scales is not None:
+        matrix *= scales
+    return matrix
+
+
+def bytes_per_vector(dimensionality: int, precision: str) -> int:
+    """
+    Compute the storage size of a single vector.
+
+    Args:
+        dimensionality: The number of vector components.
+        precision: The storage precision.
+
+    Returns:
+        The size in bytes, including the int8 scale.
+    """
+    validate_precision(precision)
+    size = dimensionality * _BYTES_PER_COMPONENT[precision]
+    if precision == "int8":
+        size += 4
+    return size
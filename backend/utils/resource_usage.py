@@ -0,0 +1,143 @@
+import os
+import resource
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+_MB = 1024 * 1024
+
+# Resource usage of the current task, filled in by each measured stage
+_usage: ContextVar[Optional[Dict[str, Any]]] = ContextVar("usage", default=None)
+
+
+def current_rss() -> int:
+    """
+    Read the resident memory of this process.
+
+    Returns:
+        The resident set size in bytes.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        # Without procfs, the lifetime peak is the closest available figure
+        return _lifetime_peak_rss()
+
+
+def peak_rss() -> int:
+    """
+    Read the peak resident memory of this process since the last
+    `reset_peak_rss`.
+
+    Returns:
+        The peak resident set size in bytes.
+    """
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return _lifetime_peak_rss()
+
+
+def reset_peak_rss() -> bool:
+    """
+    Reset the peak resident memory of this process to its current value.
+
+    Returns:
+        False if the platform does not support it, in which case the peak
+        covers the whole life of the process.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _lifetime_peak_rss() -> int:
+    """
+    Read the peak resident memory since the process started.
+
+    Returns:
+        The peak resident set size in bytes.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@contextmanager
+def track_resources() -> Iterator[Dict[str, Any]]:
+    """
+    Measure the memory, CPU and wall time of the current task.
+
+    CPU time and memory are those of the whole process, which is the task's
+    own with the solo pool.
+
+    Yields:
+        A dictionary filled with the task's usage when the block exits, with
+        the usage of each `measure_stage` block under "stages".
+    """
+    usage: Dict[str, Any] = {"stages": {}}
+    reset_peak_rss()
+    rss_before = current_rss()
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    token = _usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _usage.reset(token)
+        rss_after = current_rss()
+        stage_peaks = [stage["peak_rss_mb"] for stage in usage["stages"].values()]
+        usage.update(
+            {
+                "wall_s": round(time.perf_counter() - wall_start, 3),
+                "cpu_s": round(time.process_time() - cpu_start, 3),
+                "rss_before_mb": round(rss_before / _MB, 1),
+                "rss_after_mb": round(rss_after / _MB, 1),
+                "peak_rss_mb": max([round(peak_rss() / _MB, 1), *stage_peaks]),
+            }
+        )
+
+
+@contextmanager
+def measure_stage(stage: str) -> Iterator[Dict[str, float]]:
+    """
+    Measure the memory, CPU and wall time of a stage of the current task.
+
+    Stages must run one at a time, as each resets the process's peak memory.
+
+    Args:
+        stage: The stage name.
+
+    Yields:
+        A dictionary filled with the stage's usage when the block exits.
+    """
+    stage_usage: Dict[str, float] = {}
+    reset_peak_rss()
+    rss_before = current_rss()
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    try:
+        yield stage_usage
+    finally:
+        rss_after = current_rss()
+        stage_usage.update(
+            {
+                "wall_s": round(time.perf_counter() - wall_start, 3),
+                "cpu_s": round(time.process_time() - cpu_start, 3),
+                "rss_before_mb": round(rss_before / _MB, 1),
+                "rss_after_mb": round(rss_after / _MB, 1),
+                "rss_delta_mb": round((rss_after - rss_before) / _MB, 1),
+                "peak_rss_mb": round(peak_rss() / _MB, 1),
+            }
+        )
+        usage = _usage.get()
+        if usage is not None:
+            usage["stages"][stage] = stage_usage